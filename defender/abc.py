@@ -16,7 +16,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Iterable, Optional
 from redbot.core import Config, commands
 from redbot.core.bot import Red
 from .enums import Rank, EmergencyModules
@@ -24,6 +24,7 @@ from .core.warden.enums import Event as WardenEvent
 from .core.warden.rule import WardenRule
 from .core.utils import QuickAction
 from typing import List, Dict
+from pathlib import Path
 import datetime
 import discord
 import asyncio
@@ -50,11 +51,18 @@ class MixinMeta(ABC):
         self.emergency_mode: dict
         self.active_warden_rules: dict
         self.invalid_warden_rules: dict
+        self.warden_dispatch: dict
         self.warden_checks: dict
         self.joined_users: dict
         self.monitor: dict
         self.loop: asyncio.AbstractEventLoop
         self.quick_actions: Dict[int, Dict[int, QuickAction]]
+        self.cache_snapshot_path: Path
+        self.cache_snapshot_enabled: bool
+        self.heat_snapshot_path: Path
+        self.dedup_snapshot_path: Path
+        self.heat_snapshot_enabled: bool
+        self.heat_db_path: Path
 
     @abstractmethod
     async def rank_user(self, member: discord.Member) -> Rank:
@@ -182,7 +190,17 @@ class MixinMeta(ABC):
         raise NotImplementedError()
 
     @abstractmethod
-    def get_warden_rules_by_event(self, guild: discord.Guild, event: WardenEvent) -> List[WardenRule]:
+    def get_warden_rules_by_event(
+        self, guild: discord.Guild, event: WardenEvent, rank: Optional[Rank] = None
+    ) -> List[WardenRule]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def build_warden_dispatch(self, guild_id: int):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def warden_rules_changed(self, guild_id: Optional[int] = None, replaced: Iterable[str] = ()):
         raise NotImplementedError()
 
     @abstractmethod
@@ -192,3 +210,11 @@ class MixinMeta(ABC):
     @abstractmethod
     async def format_punish_message(self, member: discord.Member) -> str:
         raise NotImplementedError()
+
+    @abstractmethod
+    async def save_cache_snapshot(self):
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def save_heat_snapshot(self):
+        raise NotImplementedError()
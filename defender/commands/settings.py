@@ -22,11 +22,14 @@ from ..abc import MixinMeta, CompositeMetaClass
 from ..enums import Action, Rank, PerspectiveAttributes as PAttr, EmergencyModules as EModules
 from redbot.core import commands
 from redbot.core.utils.chat_formatting import box, pagify, escape
-from ..core import cache as df_cache
+from ..core import cache as df_cache, memo
+from ..core.warden import heat, membercache, profiler
 from ..core.menus import RestrictedView, SettingSetSelect
 from redbot.core.commands import GuildConverter
 from discord import SelectOption
+from pathlib import Path
 import discord
+import sqlite3
 import asyncio
 import logging
 
@@ -69,6 +72,18 @@ class Settings(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
         else:
             await ctx.send("Defender system disabled. All auto modules and manual modules are now non-operational.")
 
+    @generalgroup.command(name="messagesearch")
+    async def generalgroupmessagesearch(self, ctx: commands.Context, on_or_off: bool):
+        """Toggles the search index of the recorded messages
+
+        Required by [p]defender messages search. It increases the memory used by the message cache."""
+        await self.config.guild(ctx.guild).message_search_index.set(on_or_off)
+        await df_cache.set_search_index(ctx.guild.id, on_or_off)
+        if on_or_off:
+            await ctx.send("Message search enabled. Recorded messages can now be searched.")
+        else:
+            await ctx.send("Message search disabled.")
+
     @dset.command(name="importfrom")
     async def dsetimportfrom(self, ctx: commands.Context, server: GuildConverter):
         """Import the configuration from another server
@@ -114,6 +129,7 @@ class Settings(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
 
         async with self.config.guild(ctx.guild).all() as guild_data:
             guild_data.update(to_copy)
+        await df_cache.set_search_index(ctx.guild.id, to_copy.get("message_search_index", False))
 
         imported = 0
         failed = 0
@@ -146,6 +162,7 @@ class Settings(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
                     self.active_warden_rules[ctx.guild.id][rule.name] = rule
                     to_add_raw[new_rule.name] = new_rule.raw_rule
                     imported += 1
+            self.warden_rules_changed(ctx.guild.id, replaced=to_add_raw)
 
             async with self.config.guild(ctx.guild).wd_rules() as wd_rules:
                 wd_rules.update(to_add_raw)
@@ -273,8 +290,9 @@ class Settings(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
             )
             return
         await self.config.guild(ctx.guild).clear()
-        self.active_warden_rules.pop(ctx.guild.id, None)
-        self.invalid_warden_rules.pop(ctx.guild.id, None)
+        removed = list(self.active_warden_rules.pop(ctx.guild.id, {}))
+        removed.extend(self.invalid_warden_rules.pop(ctx.guild.id, {}))
+        self.warden_rules_changed(ctx.guild.id, replaced=removed)
         await ctx.tick()
 
     @generalgroup.command(name="messagecacheexpire")
@@ -301,6 +319,68 @@ class Settings(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
             "Value set. If you experience out of memory issues it might be " "a good idea to tweak this setting."
         )
 
+    @generalgroup.command(name="messagecachebudget")
+    @commands.is_owner()
+    async def generalgroupcachebudget(self, ctx: commands.Context, megabytes: int):
+        """Sets the maximum memory the message cache can use across all servers
+
+        The budget is checked every minute: when it's exceeded the oldest messages
+        of the servers using the most memory are discarded first. 0 to disable."""
+        if megabytes < 0 or megabytes > 1_000_000:
+            return await ctx.send("A number between 0 and 1000000 please.")
+        df_cache.MSG_CACHE_BUDGET = megabytes * 1024 * 1024
+        await self.config.cache_budget.set(megabytes)
+        df_cache.enforce_budget()
+        if megabytes:
+            await ctx.send("Value set. See `[p]dset general messagecacheusage` for the current usage.")
+        else:
+            await ctx.send("Memory budget disabled.")
+
+    @generalgroup.command(name="messagecachesnapshot")
+    @commands.is_owner()
+    async def generalgroupcachesnapshot(self, ctx: commands.Context, on_or_off: bool):
+        """Toggles saving the message cache to disk
+
+        The cache is saved every 10 minutes and on unload, then restored
+        after a restart. Expired messages are dropped during the restore."""
+        await self.config.cache_snapshot.set(on_or_off)
+        self.cache_snapshot_enabled = on_or_off
+        if on_or_off:
+            await self.save_cache_snapshot()
+            await ctx.send("The message cache will now survive restarts.")
+        else:
+            self.cache_snapshot_path.unlink(missing_ok=True)
+            await ctx.send("The message cache will no longer be saved to disk.")
+
+    @generalgroup.command(name="messagecacheusage")
+    @commands.is_owner()
+    async def generalgroupcacheusage(self, ctx: commands.Context):
+        """Shows the estimated memory used by the message cache of each server"""
+        usage = df_cache.get_usage()
+        total = df_cache.get_total_bytes()
+        budget = df_cache.MSG_CACHE_BUDGET
+        text = f"Total: {total / 1024 / 1024:.2f} MB"
+        text += f" / {budget / 1024 / 1024:.0f} MB budget\n\n" if budget else " (no budget)\n\n"
+        for guid, nbytes, messages in usage:
+            guild = ctx.bot.get_guild(guid)
+            name = guild.name if guild else "Unknown server"
+            text += f"{nbytes / 1024 / 1024:>8.2f} MB {messages:>8} msgs  {name} ({guid})\n"
+
+        for p in pagify(text, page_length=1900):
+            await ctx.send(box(p))
+
+    @generalgroup.command(name="eventmemostats")
+    @commands.is_owner()
+    async def generalgroupeventmemostats(self, ctx: commands.Context):
+        """Shows how many expensive checks were shared between rules and modules during events"""
+        stats = memo.get_stats()
+        if not stats:
+            return await ctx.send("No event has been handled yet.")
+        text = f"{'Check':<30}{'Lookups':>10}{'Saved':>10}\n"
+        for name, (lookups, saved) in stats.items():
+            text += f"{name:<30}{lookups:>10}{saved:>10}\n"
+        await ctx.send(box(text))
+
     @dset.group(name="rank3")
     @commands.admin()
     async def rank3group(self, ctx: commands.Context):
@@ -665,6 +745,8 @@ class Settings(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
     async def wardensetregex(self, ctx: commands.Context, on_or_off: bool):
         """Toggles the ability to globally create rules with user defined regex"""
         await self.config.wd_regex_allowed.set(on_or_off)
+        # Results of regex conditions that were computed with the old setting
+        membercache.clear()
         if on_or_off:
             await ctx.send(
                 "All servers will now be able to create Warden rules with user defined regex. "
@@ -723,6 +805,77 @@ class Settings(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
         await self.config.wd_upload_max_size.set(kilobytes)
         await ctx.send(f"Size set. I will not accept any rule bigger than {kilobytes}KB.")
 
+    @wardenset.command(name="heatpointscap")
+    @commands.is_owner()
+    async def wardenheatpointscap(self, ctx: commands.Context, points: int):
+        """Sets the maximum heatpoints a user, channel or custom heat level can reach
+
+        Past this, the heatpoints closest to expiring are discarded to make room for new ones."""
+        if points < 100 or points > 10_000:
+            return await ctx.send("A number between 100 and 10000 please.")
+        heat.MAX_HEATPOINTS = points
+        await self.config.wd_heatpoints_cap.set(points)
+        await ctx.send(f"Value set. Heat levels will be capped at {points} heatpoints.")
+
+    @wardenset.command(name="heatsnapshot")
+    @commands.is_owner()
+    async def wardenheatsnapshot(self, ctx: commands.Context, on_or_off: bool):
+        """Toggles saving the heat levels to disk
+
+        Heat, and the markers that keep notifications from being repeated, is saved
+        every 10 minutes and on unload, then restored after a restart. Heatpoints
+        that expired in the meantime are dropped. The sandbox is never saved."""
+        await self.config.wd_heat_snapshot.set(on_or_off)
+        self.heat_snapshot_enabled = on_or_off
+        if on_or_off:
+            await self.save_heat_snapshot()
+            await ctx.send("Heat levels will now survive restarts.")
+        else:
+            self.heat_snapshot_path.unlink(missing_ok=True)
+            self.dedup_snapshot_path.unlink(missing_ok=True)
+            await ctx.send("Heat levels will no longer be saved to disk.")
+
+    @wardenset.command(name="conditiontiming")
+    @commands.is_owner()
+    async def wardenconditiontiming(self, ctx: commands.Context, on_or_off: bool):
+        """Toggles timing each condition of the Warden rules
+
+        The cost of each rule is always tracked, this also shows which of its conditions
+        are the expensive ones in `[p]def warden stats <rule>`, at a small cost."""
+        await self.config.wd_condition_timing.set(on_or_off)
+        profiler.CONDITION_TIMING = on_or_off
+        if on_or_off:
+            await ctx.send("The conditions of the Warden rules will now be timed.")
+        else:
+            await ctx.send("The conditions of the Warden rules will no longer be timed.")
+
+    @wardenset.command(name="heatbackend")
+    @commands.is_owner()
+    async def wardenheatbackend(self, ctx: commands.Context, backend: str, *, db_path: str = ""):
+        """Sets where heat levels are kept
+
+        `memory`: in this bot's memory (default)
+        `sqlite`: in an SQLite database, which several bot processes or shards can share
+        to track the same users. Unless a path is passed, it's in Defender's data folder.
+        Each process must be pointed to the same file.
+
+        Heat levels gathered so far are not carried over.
+        Example:
+        [p]dset warden heatbackend sqlite /srv/redbot/shared/heat.sqlite3"""
+        backend = backend.lower()
+        if backend not in ("memory", "sqlite"):
+            return await ctx.send("Either `memory` or `sqlite` please.")
+        if backend == "sqlite":
+            try:
+                heat.set_backend(heat.SQLiteHeatBackend(Path(db_path) if db_path else self.heat_db_path))
+            except sqlite3.Error as e:
+                return await ctx.send(f"I could not open the database: {e}")
+        else:
+            heat.set_backend(None)
+        await self.config.wd_heat_backend.set(backend)
+        await self.config.wd_heat_db_path.set(db_path)
+        await ctx.send(f"Heat levels will now be kept in {'an SQLite database' if backend == 'sqlite' else 'memory'}.")
+
     @dset.group(name="commentanalysis", aliases=["ca"])
     @commands.admin()
     async def caset(self, ctx: commands.Context):
@@ -19,12 +19,13 @@ from defender.enums import EmergencyMode
 from ..abc import MixinMeta, CompositeMetaClass
 from ..enums import Rank
 from ..core.warden.enums import Event as WardenEvent
-from ..core.warden.rule import WardenRule
+from ..core.warden.rule import WardenRule, WDEventContext
 from ..core.warden.enums import Event as WardenEvent, ChecksKeys
 from ..core.warden.utils import rule_add_periodic_prompt, rule_add_overwrite_prompt, strip_yaml_codeblock
-from ..core.warden import heat, api as WardenAPI
+from ..core.warden import heat, profiler, api as WardenAPI
 from ..core.status import make_status
 from ..core.cache import UserCacheConverter
+from ..core import cache as df_cache
 from ..core.utils import utcnow
 from ..exceptions import ExecutionError, InvalidRule
 from ..core.announcements import get_announcements_embed
@@ -34,7 +35,7 @@ from redbot.core.utils.chat_formatting import error, pagify, box, inline, escape
 from redbot.core import commands
 from io import BytesIO
 from inspect import cleandoc
-from typing import Union
+from typing import Optional, Union
 import emoji, pydantic, regex, yaml, sys, rapidfuzz  # Debug info purpose
 import logging
 import asyncio
@@ -45,6 +46,8 @@ import tarfile
 
 log = logging.getLogger("red.x26cogs.defender")
 
+SEARCH_RESULTS_CAP = 200
+
 
 class StaffTools(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
     @commands.group(aliases=["def"])
@@ -142,6 +145,79 @@ class StaffTools(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
             pages = [box(p, lang="md") for p in pages]
             await menu(ctx, pages, DEFAULT_CONTROLS)
 
+    @defmessagesgroup.command(name="search")
+    async def defmessagesgroupsearch(self, ctx: commands.Context, *, terms: str):
+        """Searches the recorded messages
+
+        Only messages containing all the words are shown, newest first.
+        It can be restricted to a channel with `--in` or to a user with `--user`, at the end.
+        Requires the search index, see `[p]dset general messagesearch`
+
+        Examples:
+        [p]def messages search free nitro
+        [p]def messages search free nitro --in #general
+        [p]def messages search free nitro --user Twentysix"""
+        author = ctx.author
+        guild = ctx.guild
+        channel_id = author_id = None
+        # The filter is always explicit, so that a search word is never taken for one
+        parts = regex.split(r"(?:^|\s+)--(in|user)\s+", terms, maxsplit=1)
+        terms = parts[0]
+        option, target = parts[1:] if len(parts) == 3 else (None, None)
+        try:
+            if option == "in":
+                try:
+                    target = await commands.TextChannelConverter().convert(ctx, target)
+                except commands.BadArgument:
+                    target = await commands.ThreadConverter().convert(ctx, target)
+            elif option == "user":
+                target = await UserCacheConverter().convert(ctx, target)
+        except commands.BadArgument as e:
+            return await ctx.send(str(e))
+        if isinstance(target, (discord.TextChannel, discord.Thread)):
+            if not target.permissions_for(author).read_messages:
+                self.send_to_monitor(
+                    guild,
+                    f"{author} ({author.id}) attempted to search the message history of channel #{target.name}",
+                )
+                return await ctx.send("You do not have read permissions in that channel. Request denied.")
+            channel_id = target.id
+        elif target is not None:
+            author_id = target.id
+
+        def can_read(m):
+            # Unlike the logs, we don't even show that a message matched in a channel they can't read
+            channel = guild.get_channel(m.channel_id) or guild.get_thread(m.channel_id)
+            return not channel or channel.permissions_for(author).read_messages
+
+        results = df_cache.search_messages(
+            guild, terms, channel_id=channel_id, author_id=author_id, check=can_read, limit=SEARCH_RESULTS_CAP
+        )
+        if results is None:
+            return await ctx.send(f"Message search is not enabled. See `{ctx.prefix}dset general messagesearch`.")
+
+        _log = []
+        for m in results:
+            channel = guild.get_channel(m.channel_id) or guild.get_thread(m.channel_id)
+            ts = m.created_at.strftime("%Y/%m/%d %H:%M:%S")
+            channel = f"#{channel.name}" if channel else m.channel_id
+            user = guild.get_member(m.author_id)
+            user = f"{user}" if user else m.author_id
+            _log.append(f"[{ts}]({channel})({user}) {m.content}".replace("`", "'"))
+
+        if not _log:
+            return await ctx.send("No recorded messages match your search.")
+        if len(_log) >= SEARCH_RESULTS_CAP:
+            _log.insert(0, f"# Only the {SEARCH_RESULTS_CAP} newest matches are shown")
+
+        self.send_to_monitor(guild, f"{author} ({author.id}) searched the message history for '{terms}'")
+
+        pages = [box(p, lang="md") for p in pagify("\n".join(_log), page_length=1300)]
+        if len(pages) == 1:
+            await ctx.send(pages[0])
+        else:
+            await menu(ctx, pages, DEFAULT_CONTROLS)
+
     @defmessagesgroup.command(name="exportuser")
     async def defmessagesgroupexportuser(self, ctx: commands.Context, user: UserCacheConverter):
         """Exports recent messages of a user to a file"""
@@ -421,6 +497,7 @@ class StaffTools(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
             warden_rules[new_rule.name] = rule
         self.active_warden_rules[ctx.guild.id][new_rule.name] = new_rule
         self.invalid_warden_rules[ctx.guild.id].pop(new_rule.name, None)
+        self.warden_rules_changed(ctx.guild.id, replaced=[new_rule.name])
 
         if not prompts_sent:
             await ctx.tick()
@@ -434,6 +511,7 @@ class StaffTools(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
         try:
             self.active_warden_rules[ctx.guild.id].pop(name, None)
             self.invalid_warden_rules[ctx.guild.id].pop(name, None)
+            self.warden_rules_changed(ctx.guild.id, replaced=[name])
             async with self.config.guild(ctx.guild).wd_rules() as warden_rules:
                 del warden_rules[name]
             await ctx.tick()
@@ -459,8 +537,10 @@ class StaffTools(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
             return await ctx.send("Not proceeding with deletion.")
 
         await self.config.guild(ctx.guild).wd_rules.clear()
+        removed = [*self.active_warden_rules[ctx.guild.id], *self.invalid_warden_rules[ctx.guild.id]]
         self.active_warden_rules[ctx.guild.id] = {}
         self.invalid_warden_rules[ctx.guild.id] = {}
+        self.warden_rules_changed(ctx.guild.id, replaced=removed)
         await ctx.send("All rules have been deleted.")
 
     @wardengroup.command(name="list")
@@ -619,6 +699,7 @@ class StaffTools(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
                     warden_rules[new_rule.name] = raw_rule
                 self.active_warden_rules[ctx.guild.id][new_rule.name] = new_rule
                 self.invalid_warden_rules[ctx.guild.id].pop(new_rule.name, None)
+                self.warden_rules_changed(ctx.guild.id, replaced=[new_rule.name])
                 if not prompts_sent:
                     await message.add_reaction(confirm_emoji)
                 else:
@@ -686,8 +767,9 @@ class StaffTools(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
                 if m.joined_at is None:
                     continue
                 rank = await self.rank_user(m)
-                if await rule.satisfies_conditions(rank=rank, user=m, cog=self, guild=m.guild):
-                    targets.append(m)
+                wd_ctx = WDEventContext(cog=self, guild=m.guild, user=m)
+                if await rule.satisfies_conditions(rank=rank, ctx=wd_ctx):
+                    targets.append((m, wd_ctx))
 
         if len(targets) == 0:
             return await ctx.send("No user can be affected by this rule.")
@@ -708,9 +790,9 @@ class StaffTools(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
 
         errors = 0
         async with ctx.typing():
-            async for m in AsyncIter(targets, steps=2):
+            async for m, wd_ctx in AsyncIter(targets, steps=2):
                 try:
-                    await rule.do_actions(user=m, guild=m.guild, cog=self)
+                    await rule.do_actions(ctx=wd_ctx)
                 except Exception as e:
                     errors += 1
                     self.send_to_monitor(ctx.guild, f"[Warden] ({rule.name}): {e}")
@@ -751,7 +833,7 @@ class StaffTools(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
                 to_add = []
                 for k, v in sorted(state[_type].items()):
                     if is_relevant(k, keywords):
-                        to_add.append(f"{k}: {len(v)}")
+                        to_add.append(f"{k}: {v}")
                 if to_add:
                     if first_run:
                         text += f"- **{state_name}**:"
@@ -784,6 +866,62 @@ class StaffTools(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
             heat.empty_state(ctx.guild, debug=True)
             await message.add_reaction("✅")
 
+    @wardengroup.command(name="stats")
+    async def wardengroupstats(self, ctx: commands.Context, *, rule: str = ""):
+        """Shows what the Warden rules cost
+
+        Without a rule, the rules are ranked from the most expensive. Stats are
+        collected since the cog was loaded, a rule's start over when it's replaced
+        or removed. Time spent waiting on regex or Discord is shown as await time."""
+
+        def ms(seconds):
+            return f"{seconds * 1000:.1f}"
+
+        def us(seconds):
+            return f"{seconds * 1_000_000:.0f}"
+
+        if rule:
+            guild_stats = profiler.get_guild_stats(ctx.guild.id)
+            # Rule names are stored the way WardenRule.parse normalizes them, module checks as they are
+            stats = guild_stats.get(rule.lower().replace(" ", "-")) or guild_stats.get(rule.lower())
+            if stats is None:
+                return await ctx.send("That rule has not been evaluated yet.")
+            avg = stats.eval_time / stats.evaluations if stats.evaluations else 0
+            text = (
+                f"Evaluations: {stats.evaluations} ({stats.passes} passed, {stats.skipped} skipped by keywords)\n"
+                f"Actions executed: {stats.actions}\n"
+                f"Evaluation time: {ms(stats.eval_time)} ms total, {us(avg)} µs avg, {us(stats.p99())} µs p99\n"
+                f"Await time: {ms(stats.await_time)} ms\n"
+                f"Actions time: {ms(stats.action_time)} ms\n"
+            )
+            if stats.conditions:
+                text += "\nConditions:\n"
+                conditions = sorted(stats.conditions.items(), key=lambda i: i[1].time, reverse=True)
+                for condition, c_stats in conditions:
+                    avg = c_stats.time / c_stats.evaluations
+                    text += f"{condition.value:<34}{c_stats.evaluations:>8}x {ms(c_stats.time):>9} ms"
+                    text += f" {us(avg):>7} µs avg\n"
+            elif not profiler.CONDITION_TIMING:
+                text += (
+                    "\nThe bot owner can enable the timing of each condition with "
+                    f"`{ctx.clean_prefix}dset warden conditiontiming`"
+                )
+            return await ctx.send(box(text))
+
+        ranked = profiler.get_ranked(ctx.guild.id)
+        if not ranked:
+            return await ctx.send("No rule has been evaluated yet.")
+        text = f"{'Rule':<28}{'Evals':>8}{'Pass':>7}{'Total ms':>10}{'Avg µs':>8}{'p99 µs':>8}"
+        text += f"{'Await ms':>10}{'Act ms':>9}\n"
+        for name, stats in ranked:
+            avg = stats.eval_time / stats.evaluations if stats.evaluations else 0
+            text += (
+                f"{name[:27]:<28}{stats.evaluations:>8}{stats.passes:>7}{ms(stats.total_time):>10}"
+                f"{us(avg):>8}{us(stats.p99()):>8}{ms(stats.await_time):>10}{ms(stats.action_time):>9}\n"
+            )
+        for p in pagify(text, page_length=1900):
+            await ctx.send(box(p))
+
     @wardengroup.command(name="debug", usage="<id> <event> [rank]")
     async def wardengroupdebug(self, ctx: commands.Context, _id: int, event: WardenEvent, rank: int = None):
         """Simulate and give a detailed summary of an event
@@ -842,13 +980,12 @@ class StaffTools(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
             rank = Rank.Rank1  # On a user-less event (for now, only on-emergency) rank is not considered
             user = None
 
+        wd_ctx = WDEventContext(cog=self, guild=guild, user=user, message=message, debug=True)
         for rule in rules:
-            result = await rule.satisfies_conditions(
-                cog=self, guild=guild, rank=rank, user=user, message=message, debug=True
-            )
+            result = await rule.satisfies_conditions(rank=rank, ctx=wd_ctx)
             results.append(result)
             if result:
-                await rule.do_actions(cog=self, guild=guild, user=user, message=message, debug=True)
+                await rule.do_actions(ctx=wd_ctx)
 
         text = ""
         for i, result in enumerate(results):
@@ -19,13 +19,12 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from ..abc import MixinMeta, CompositeMetaClass
 from redbot.core.utils.chat_formatting import box, humanize_list
-from redbot.core.utils.common_filters import INVITE_URL_RE
 from ..abc import CompositeMetaClass
 from ..enums import Action
 from ..core.menus import QAView
 from ..core import cache as df_cache
 from ..core.utils import get_external_invite, ACTIONS_VERBS, utcnow, timestamp
-from ..core.warden import heat
+from ..core import dedup, memo
 from .utils import timestamp
 from io import BytesIO
 from collections import namedtuple, OrderedDict
@@ -52,7 +51,7 @@ class AutoModules(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
             {"name": "Channel", "value": message.channel.mention},
         ]
 
-        result = INVITE_URL_RE.findall(message.content)
+        result = memo.find_invites(message.content)
 
         if not result:
             return
@@ -191,21 +190,11 @@ class AutoModules(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
             {"name": "Channel", "value": message.channel.mention},
         ]
 
-        cache = df_cache.get_user_messages(author)
-
         max_messages = await self.config.guild(guild).raider_detection_messages()
         minutes = await self.config.guild(guild).raider_detection_minutes()
-        x_minutes_ago = message.created_at - timedelta(minutes=minutes)
-        recent = 0
-
-        for i, m in enumerate(cache):
-            if m.created_at > x_minutes_ago:
-                recent += 1
-            # We only care about the X most recent ones
-            if i == max_messages - 1:
-                break
+        recent = df_cache.get_message_rate(author, minutes, now=message.created_at)
 
-        if recent != max_messages:
+        if recent < max_messages:
             return
 
         quick_action = QAView(self, author.id, "Message spammer")
@@ -311,9 +300,8 @@ class AutoModules(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
         lvl_msg = ""
         lvl = await self.config.guild(guild).join_monitor_v_level()
         if lvl > guild.verification_level.value:
-            if not heat.get_custom_heat(guild, "core-jm-lvl") == 0:
+            if not dedup.add(guild.id, "core-jm-lvl", timedelta(minutes=1)):
                 return False
-            heat.increase_custom_heat(guild, "core-jm-lvl", timedelta(minutes=1))
             try:
                 lvl = discord.VerificationLevel(lvl)
                 await guild.edit(verification_level=lvl)
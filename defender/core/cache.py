@@ -16,18 +16,25 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from collections import deque, defaultdict, namedtuple
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 from copy import deepcopy, copy
-from typing import Optional
+from array import array
+from pathlib import Path
+from bisect import bisect_left, bisect_right
+from typing import Callable, Collection, Iterator, List, Optional
+from sys import getsizeof
 from discord.ext.commands.errors import BadArgument
 from discord.ext.commands import IDConverter
-from discord.utils import time_snowflake
-from redbot.core.utils import AsyncIter
+from discord.utils import time_snowflake, snowflake_time
 from ..core.utils import utcnow
 import regex as re
 import discord
 import logging
 import asyncio
+import heapq
+import struct
+import time
+import os
 
 log = logging.getLogger("red.x26cogs.defender")
 
@@ -35,27 +42,251 @@ MessageEdit = namedtuple("MessageEdit", ("content", "edited_at"))
 # These values are overriden at runtime with the owner's settings
 MSG_EXPIRATION_TIME = 48  # Hours
 MSG_STORE_CAP = 3000
-_guild_dict = {"users": {}, "channels": {}}
+MSG_EDITS_CAP = 20
+MSG_CACHE_BUDGET = 0  # Bytes, 0 is unlimited
+# The budget is enforced by the periodic cleanup. Only bursts past this share of it are trimmed right away
+BUDGET_HIGH_WATER = 1.25
+CLEANUP_SLICE = 0.005  # Seconds of work between yields to the event loop
+# Estimated memory costs, in bytes. Content strings are added on top
+ROW_BYTES = 32  # A row in a store: 3 array items and a list slot
+INDEX_BYTES = 64  # An entry in the message ID index
+HISTORY_BYTES = 680  # An EditHistory and its deque
+EDIT_BYTES = 120  # A MessageEdit and its timestamp
+RATE_BYTES = 600  # A RateRing
+RATE_RING_SIZE = 50  # Timestamps kept for each user's message rate
+POSTING_BYTES = 40  # A message ID in a token's set
+TOKEN_BYTES = 280  # A token and its set
+SEARCH_TOKEN_RE = re.compile(r"\w{2,}")
+# "messages" maps message ID -> the store to read it from: its channel store, or its user store
+# once the channel store has evicted it. "edits" maps message ID -> EditHistory
+# "rates" user ID -> RateRing, "tokens" token -> message IDs (search index)
+# "bytes" is the estimated memory usage of the guild's cache
+_guild_dict = {"users": {}, "channels": {}, "messages": {}, "edits": {}, "rates": {}, "tokens": {}, "bytes": 0}
 _message_cache = defaultdict(lambda: deepcopy(_guild_dict))
+# Author ID -> guild ID -> IDs of the channel stores that may hold their messages
+_author_index = defaultdict(dict)
+_total_bytes = 0
+_search_guilds = set()  # Guilds with the search index enabled
 _msg_obj = None  # Warden use
 
 # We're gonna store *a lot* of messages in memory and we're gonna improve
-# performances by storing only a lite version of them
+# performances by storing them in columns: one row per message, IDs packed
+# in arrays, timestamps derived from the IDs. The content strings are shared
+# between the user store and the channel store of a message.
+# LiteMessage objects are only built on read.
+
+
+class EditHistory:
+    __slots__ = ("content", "edits")
+
+    def __init__(self, content):
+        self.content = content
+        self.edits = deque(maxlen=MSG_EDITS_CAP)
 
 
 class LiteMessage:
-    __slots__ = ("id", "created_at", "content", "channel_id", "author_id", "edits")
+    __slots__ = ("id", "content", "channel_id", "author_id", "edits")
+
+    def __init__(self, _id: int, author_id: int, channel_id: int, content: str, edits=()):
+        self.id = _id
+        self.author_id = author_id
+        self.channel_id = channel_id
+        self.content = content
+        self.edits = edits
+
+    @property
+    def created_at(self):
+        return snowflake_time(self.id)
+
+
+class MessageStore:
+    """
+    Messages of a single user or channel, sorted oldest first.
+    Rows before 'start' have been discarded and are periodically compacted
+    away, so that dropping the oldest message doesn't shift the whole store.
+    """
 
-    def __init__(self, message: discord.Message):
-        self.id = message.id
-        self.created_at = message.created_at
-        self.content = message.content
-        self.author_id = message.author.id
-        self.channel_id = message.channel.id
-        self.edits = deque(maxlen=20)
-        if message.attachments:
-            filename = message.attachments[0].filename
-            self.content = f"(Attachment: {filename}) {self.content}"
+    __slots__ = ("ids", "author_ids", "channel_ids", "contents", "start", "nbytes", "generation")
+    # The content strings are shared with the channel stores, which account for them
+    counts_content = False
+
+    def __init__(self):
+        self.ids = array("Q")
+        self.author_ids = array("Q")
+        self.channel_ids = array("Q")
+        self.contents = []
+        self.start = 0
+        self.nbytes = 0
+        # Bumped whenever existing rows move, so that readers can find their place again
+        self.generation = 0
+
+    def _contents_size(self, contents) -> int:
+        if not self.counts_content:
+            return 0
+        return sum(map(getsizeof, contents))
+
+    def __len__(self):
+        return len(self.ids) - self.start
+
+    def append(self, _id: int, author_id: int, channel_id: int, content: str):
+        self.nbytes += ROW_BYTES + (getsizeof(content) if self.counts_content else 0)
+        ids = self.ids
+        if len(ids) == self.start or ids[-1] < _id:
+            ids.append(_id)
+            self.author_ids.append(author_id)
+            self.channel_ids.append(channel_id)
+            self.contents.append(content)
+            return
+        # Events from different channels can reach us slightly out of order
+        self.generation += 1
+        i = bisect_left(ids, _id, self.start)
+        ids.insert(i, _id)
+        self.author_ids.insert(i, author_id)
+        self.channel_ids.insert(i, channel_id)
+        self.contents.insert(i, content)
+
+    def popleft(self):
+        """Discards the oldest message, returns its (id, author_id, channel_id)"""
+        i = self.start
+        row = (self.ids[i], self.author_ids[i], self.channel_ids[i])
+        self.nbytes -= ROW_BYTES + (getsizeof(self.contents[i]) if self.counts_content else 0)
+        self.contents[i] = None
+        self.start += 1
+        self._maybe_compact()
+        return row
+
+    def _maybe_compact(self):
+        start = self.start
+        if start == len(self.ids):
+            self.ids = array("Q")
+            self.author_ids = array("Q")
+            self.channel_ids = array("Q")
+            self.contents = []
+            self.start = 0
+            self.generation += 1
+        elif start > 64 and start * 2 > len(self.ids):
+            del self.ids[:start]
+            del self.author_ids[:start]
+            del self.channel_ids[:start]
+            del self.contents[:start]
+            self.start = 0
+            self.generation += 1
+
+    def discard_until(self, _id: int):
+        """Discards the messages up to _id included, returns their IDs"""
+        start = self.start
+        i = bisect_right(self.ids, _id, start)
+        if i == start:
+            return ()
+        removed = self.ids[start:i]
+        self.nbytes -= ROW_BYTES * (i - start) + self._contents_size(self.contents[start:i])
+        self.contents[start:i] = [None] * (i - start)
+        self.start = i
+        self._maybe_compact()
+        return removed
+
+    def oldest_id(self) -> int:
+        return self.ids[self.start]
+
+    def find(self, _id: int) -> Optional[int]:
+        i = bisect_left(self.ids, _id, self.start)
+        if i < len(self.ids) and self.ids[i] == _id:
+            return i
+        return None
+
+    def row(self, i: int, edits: dict) -> LiteMessage:
+        _id = self.ids[i]
+        history = edits.get(_id) if edits else None
+        if history is None:
+            return LiteMessage(_id, self.author_ids[i], self.channel_ids[i], self.contents[i])
+        return LiteMessage(_id, self.author_ids[i], self.channel_ids[i], history.content, history.edits)
+
+    def rows_until(self, _id: int):
+        """(ID, content) of the messages up to _id included"""
+        start = self.start
+        i = bisect_right(self.ids, _id, start)
+        return list(zip(self.ids[start:i], self.contents[start:i]))
+
+    def remove_author(self, author_id: int):
+        """Removes the messages of an author, returns their (ID, content)"""
+        keep = [i for i in range(self.start, len(self.ids)) if self.author_ids[i] != author_id]
+        if len(keep) == len(self):
+            return []
+        removed = [
+            (self.ids[i], self.contents[i]) for i in range(self.start, len(self.ids)) if self.author_ids[i] == author_id
+        ]
+        self.ids = array("Q", [self.ids[i] for i in keep])
+        self.author_ids = array("Q", [self.author_ids[i] for i in keep])
+        self.channel_ids = array("Q", [self.channel_ids[i] for i in keep])
+        self.contents = [self.contents[i] for i in keep]
+        self.start = 0
+        self.nbytes = ROW_BYTES * len(keep) + self._contents_size(self.contents)
+        self.generation += 1
+        return removed
+
+    def iter_newest(self, edits: dict, since: Optional[datetime] = None, limit: Optional[int] = None):
+        """
+        Walks the live store newest first, without copying it, stopping at
+        the time / count bound. It's safe to suspend between items: if the
+        rows have moved in the meantime the position is found again by ID
+        """
+        until_id = time_snowflake(since, high=True) if since is not None else 0
+        generation = self.generation
+        i = len(self.ids) - 1
+        count = 0
+        while limit is None or count < limit:
+            if self.generation != generation:
+                generation = self.generation
+                i = bisect_left(self.ids, last_id, self.start) - 1
+            if i < self.start:
+                return
+            last_id = self.ids[i]
+            if last_id <= until_id:
+                return
+            yield self.row(i, edits)
+            count += 1
+            i -= 1
+
+
+class ChannelStore(MessageStore):
+    __slots__ = ()
+    counts_content = True
+
+
+class RateRing:
+    """
+    The timestamps (in ms, as in snowflakes) of a user's last
+    RATE_RING_SIZE messages, oldest ones get overwritten
+    """
+
+    __slots__ = ("stamps", "head", "count")
+
+    def __init__(self):
+        self.stamps = array("Q", bytes(8 * RATE_RING_SIZE))
+        self.head = 0
+        self.count = 0
+
+    def add(self, stamp: int):
+        self.stamps[self.head] = stamp
+        self.head = (self.head + 1) % RATE_RING_SIZE
+        if self.count < RATE_RING_SIZE:
+            self.count += 1
+
+    def nth_newest(self, n: int) -> int:
+        return self.stamps[(self.head - n) % RATE_RING_SIZE]
+
+    def count_after(self, stamp: int) -> int:
+        """How many of the stored timestamps are more recent than 'stamp'"""
+        if not self.count or self.nth_newest(1) <= stamp:
+            return 0
+        lo, hi = 1, self.count
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.nth_newest(mid) > stamp:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
 
 
 class CacheUser:
@@ -105,87 +336,601 @@ class UserCacheConverter(IDConverter):
 
 
 def add_message(message):
-    author = message.author
-    guild = message.guild
-    channel = message.channel
-    if author.id not in _message_cache[guild.id]["users"]:
-        _message_cache[guild.id]["users"][author.id] = deque(maxlen=MSG_STORE_CAP)
+    content = message.content
+    if message.attachments:
+        filename = message.attachments[0].filename
+        content = f"(Attachment: {filename}) {content}"
 
-    lite_message = LiteMessage(message)
+    _add_message(message.guild.id, message.id, message.author.id, message.channel.id, content)
 
-    _message_cache[guild.id]["users"][author.id].appendleft(lite_message)
 
-    if channel.id not in _message_cache[guild.id]["channels"]:
-        _message_cache[guild.id]["channels"][channel.id] = deque(maxlen=MSG_STORE_CAP)
+def _add_message(guild_id: int, _id: int, author_id: int, channel_id: int, content: str, *, track_rate=True):
+    _cache = _message_cache[guild_id]
+    if _id in _cache["messages"]:
+        return
 
-    _message_cache[guild.id]["channels"][channel.id].appendleft(lite_message)
+    if author_id not in _cache["users"]:
+        _cache["users"][author_id] = MessageStore()
+    if channel_id not in _cache["channels"]:
+        _cache["channels"][channel_id] = ChannelStore()
+
+    user_store = _cache["users"][author_id]
+    channel_store = _cache["channels"][channel_id]
+    used = user_store.nbytes + channel_store.nbytes
+
+    user_store.append(_id, author_id, channel_id, content)
+    channel_store.append(_id, author_id, channel_id, content)
+    _cache["messages"][_id] = channel_store
+    channels = _author_index[author_id].get(guild_id)
+    if channels is None:
+        channels = _author_index[author_id][guild_id] = set()
+    channels.add(channel_id)
+    _charge(_cache, INDEX_BYTES)
+
+    if track_rate:
+        ring = _cache["rates"].get(author_id)
+        if ring is None:
+            ring = _cache["rates"][author_id] = RateRing()
+            _charge(_cache, RATE_BYTES)
+        ring.add(_id >> 22)
+    if guild_id in _search_guilds:
+        _index_tokens(_cache, _id, content)
+
+    if len(user_store) > MSG_STORE_CAP:
+        evicted = user_store.popleft()
+        if _cache["messages"].get(evicted[0]) is user_store:
+            del _cache["messages"][evicted[0]]
+            _charge(_cache, -INDEX_BYTES)
+        _forget(_cache, *evicted)
+    if len(channel_store) > MSG_STORE_CAP:
+        if _cache["tokens"]:
+            oldest = channel_store.start
+            _unindex_tokens(_cache, channel_store.ids[oldest], channel_store.contents[oldest])
+        evicted_id, evicted_author_id, evicted_channel_id = channel_store.popleft()
+        # Its author's store may still have it, in which case it can still be read and edited
+        evicted_user_store = _cache["users"].get(evicted_author_id)
+        if evicted_user_store is not None and evicted_user_store.find(evicted_id) is not None:
+            _cache["messages"][evicted_id] = evicted_user_store
+        else:
+            _cache["messages"].pop(evicted_id, None)
+            _charge(_cache, -INDEX_BYTES)
+        _forget(_cache, evicted_id, evicted_author_id, evicted_channel_id)
+    _charge(_cache, user_store.nbytes + channel_store.nbytes - used)
 
+    if MSG_CACHE_BUDGET and _total_bytes > MSG_CACHE_BUDGET * BUDGET_HIGH_WATER:
+        enforce_budget()
 
-async def add_message_edit(message):
-    author = message.author
-    guild = message.guild
-    channel = message.channel
 
+def _forget(_cache, _id: int, author_id: int, channel_id: int):
+    # Edit history goes away once the message is out of both stores
+    if not _cache["edits"] or _id not in _cache["edits"]:
+        return
+    for store in (_cache["users"].get(author_id), _cache["channels"].get(channel_id)):
+        if store and store.oldest_id() <= _id:
+            return
+    _charge(_cache, -_history_size(_cache["edits"].pop(_id)))
+
+
+def _charge(_cache, nbytes: int):
+    global _total_bytes
+    _cache["bytes"] += nbytes
+    _total_bytes += nbytes
+
+
+def _index_tokens(_cache, _id: int, content: str):
+    tokens = _cache["tokens"]
+    nbytes = 0
+    for token in set(SEARCH_TOKEN_RE.findall(content.lower())):
+        ids = tokens.get(token)
+        if ids is None:
+            ids = tokens[token] = set()
+            nbytes += TOKEN_BYTES
+        ids.add(_id)
+        nbytes += POSTING_BYTES
+    _charge(_cache, nbytes)
+
+
+def _unindex_tokens(_cache, _id: int, content: str):
+    # The index holds the current content, which could be an edit
+    history = _cache["edits"].get(_id) if _cache["edits"] else None
+    if history is not None:
+        content = history.content
+    tokens = _cache["tokens"]
+    nbytes = 0
+    for token in set(SEARCH_TOKEN_RE.findall(content.lower())):
+        ids = tokens.get(token)
+        if ids is None or _id not in ids:
+            continue
+        ids.discard(_id)
+        nbytes += POSTING_BYTES
+        if not ids:
+            del tokens[token]
+            nbytes += TOKEN_BYTES
+    _charge(_cache, -nbytes)
+
+
+def _history_size(history: EditHistory) -> int:
+    return (
+        HISTORY_BYTES + getsizeof(history.content) + sum(EDIT_BYTES + getsizeof(edit.content) for edit in history.edits)
+    )
+
+
+async def add_message_edit(message):
     # .edits will contain past edits
     # .content will always be current
-    async for m in AsyncIter(_message_cache[guild.id]["users"].get(author.id, []).copy(), steps=10):
-        if m.id == message.id:
-            m.edits.appendleft(MessageEdit(content=m.content, edited_at=message.edited_at))
-            m.content = message.content
-            break
+    _cache = _message_cache[message.guild.id]
+    store = _cache["messages"].get(message.id)
+    if store is None:
+        return
+
+    # Only what the channel stores hold is searchable
+    if message.guild.id in _search_guilds and isinstance(store, ChannelStore):
+        _unindex_tokens(_cache, message.id, store.contents[store.find(message.id)])
+        _index_tokens(_cache, message.id, message.content)
+
+    history = _cache["edits"].get(message.id)
+    if history is None:
+        history = EditHistory(store.contents[store.find(message.id)])
+        _cache["edits"][message.id] = history
+        used = 0
     else:
-        async for m in AsyncIter(_message_cache[guild.id]["channels"].get(channel.id, []).copy(), steps=10):
-            if m.id == message.id:
-                m.edits.appendleft(MessageEdit(content=m.content, edited_at=message.edited_at))
-                m.content = message.content
-                break
+        used = _history_size(history)
 
+    history.edits.appendleft(MessageEdit(content=history.content, edited_at=message.edited_at))
+    history.content = message.content
+    _charge(_cache, _history_size(history) - used)
 
-def get_user_messages(user):
-    guild = user.guild
-    if user.id not in _message_cache[guild.id]["users"]:
-        return []
 
-    return _message_cache[guild.id]["users"][user.id].copy()
+def get_message(guild: discord.Guild, message_id: int) -> Optional[LiteMessage]:
+    _cache = _message_cache[guild.id]
+    store = _cache["messages"].get(message_id)
+    if store is None:
+        return None
+    return store.row(store.find(message_id), _cache["edits"])
+
+
+def get_user_messages(user):
+    return list(iter_user_messages(user))
 
 
 def get_channel_messages(channel):
-    guild = channel.guild
-    if channel.id not in _message_cache[guild.id]["channels"]:
-        return []
+    return list(iter_channel_messages(channel))
 
-    return _message_cache[guild.id]["channels"][channel.id].copy()
+
+def get_message_rate(user, minutes: int, *, now: Optional[datetime] = None) -> int:
+    """
+    How many messages the user has sent in the last X minutes.
+    Counts up to RATE_RING_SIZE and doesn't depend on the message cache's cap
+    """
+    _cache = _message_cache.get(user.guild.id)
+    ring = _cache["rates"].get(user.id) if _cache else None
+    if ring is None:
+        return 0
+    now = now or utcnow()
+    return ring.count_after(time_snowflake(now - timedelta(minutes=minutes)) >> 22)
+
+
+def iter_user_messages(user, *, since: Optional[datetime] = None, limit: Optional[int] = None) -> Iterator[LiteMessage]:
+    """The user's cached messages newest first, optionally only the ones more recent than 'since'"""
+    _cache = _message_cache.get(user.guild.id)
+    store = _cache["users"].get(user.id) if _cache else None
+    if store is None:
+        return iter(())
+    return store.iter_newest(_cache["edits"], since, limit)
+
+
+def iter_channel_messages(
+    channel, *, since: Optional[datetime] = None, limit: Optional[int] = None
+) -> Iterator[LiteMessage]:
+    """The channel's cached messages newest first, optionally only the ones more recent than 'since'"""
+    _cache = _message_cache.get(channel.guild.id)
+    store = _cache["channels"].get(channel.id) if _cache else None
+    if store is None:
+        return iter(())
+    return store.iter_newest(_cache["edits"], since, limit)
 
 
 async def discard_stale():
-    x_hours_ago = utcnow() - timedelta(hours=MSG_EXPIRATION_TIME)
-    for guid, _cache in _message_cache.items():
-        for uid, store in _cache["users"].items():
-            _message_cache[guid]["users"][uid] = deque(
-                [m for m in store if m.created_at > x_hours_ago], maxlen=MSG_STORE_CAP
-            )
-        await asyncio.sleep(0)
+    """
+    Drops the expired messages. Stores are sorted oldest first, so this
+    is O(expired) per store and it yields to the event loop every few ms
+    """
+    x_hours_ago = time_snowflake(utcnow() - timedelta(hours=MSG_EXPIRATION_TIME))
+    deadline = time.monotonic() + CLEANUP_SLICE
+    for guid, _cache in list(_message_cache.items()):
+        for cid, store in list(_cache["channels"].items()):
+            _expire_channel_store(_cache, cid, store, x_hours_ago)
+            if time.monotonic() > deadline:
+                await asyncio.sleep(0)
+                deadline = time.monotonic() + CLEANUP_SLICE
+
+        for uid, store in list(_cache["users"].items()):
+            _expire_user_store(guid, _cache, uid, store, x_hours_ago)
+            if time.monotonic() > deadline:
+                await asyncio.sleep(0)
+                deadline = time.monotonic() + CLEANUP_SLICE
+
+        _expire_edits(_cache, x_hours_ago)
+        if not _cache["users"] and not _cache["channels"] and _message_cache.get(guid) is _cache:
+            _charge(_cache, -_cache["bytes"])
+            del _message_cache[guid]
+
+
+def _expire_channel_store(_cache, cid: int, store: MessageStore, until_id: int):
+    if _cache["tokens"]:
+        for _id, content in store.rows_until(until_id):
+            _unindex_tokens(_cache, _id, content)
+    used = store.nbytes
+    removed = store.discard_until(until_id)
+    for _id in removed:
+        _cache["messages"].pop(_id, None)
+    _charge(_cache, store.nbytes - used - INDEX_BYTES * len(removed))
+    _drop_if_empty(_cache["channels"], cid, store)
+
+
+def _expire_user_store(guid: int, _cache, uid: int, store: MessageStore, until_id: int):
+    used = store.nbytes
+    removed = 0
+    for _id in store.discard_until(until_id):
+        if _cache["messages"].get(_id) is store:
+            del _cache["messages"][_id]
+            removed += 1
+    _charge(_cache, store.nbytes - used - INDEX_BYTES * removed)
+    # Their messages in the channel stores have expired too at this point
+    if _drop_if_empty(_cache["users"], uid, store):
+        _forget_author_in_guild(uid, guid)
+        if _cache["rates"].pop(uid, None) is not None:
+            _charge(_cache, -RATE_BYTES)
+
+
+def _expire_edits(_cache, until_id: int):
+    if _cache["edits"]:
+        for _id in [_id for _id in _cache["edits"] if _id <= until_id]:
+            _charge(_cache, -_history_size(_cache["edits"].pop(_id)))
+
+
+def enforce_budget():
+    """
+    Evicts the oldest messages of the largest guild until the cache is
+    comfortably under budget. The largest guild is always above its fair
+    share of the budget, so active guilds can't starve the smaller ones
+    """
+    target = MSG_CACHE_BUDGET * 0.9
+    while MSG_CACHE_BUDGET and _total_bytes > target and _message_cache:
+        guid, _cache = max(_message_cache.items(), key=lambda kv: kv[1]["bytes"])
+        fair_share = MSG_CACHE_BUDGET / len(_message_cache)
+        to_free = max(_total_bytes - target, _cache["bytes"] - fair_share)
+        stores = list(_cache["users"].values()) + list(_cache["channels"].values())
+        if not stores:
+            break
+        oldest = min(store.oldest_id() for store in stores)
+        newest = max(store.ids[-1] for store in stores)
+        # Evicts the share of the guild's time window that matches the bytes to free
+        until_id = oldest + int((newest - oldest) * min(1.0, to_free / max(_cache["bytes"], 1)))
+        used = _total_bytes
+        for cid, store in list(_cache["channels"].items()):
+            _expire_channel_store(_cache, cid, store, until_id)
+        for uid, store in list(_cache["users"].items()):
+            _expire_user_store(guid, _cache, uid, store, until_id)
+        _expire_edits(_cache, until_id)
+        if not _cache["users"] and not _cache["channels"]:
+            _charge(_cache, -_cache["bytes"])
+            del _message_cache[guid]
+        elif _total_bytes == used:
+            break
 
-    for guid, _cache in _message_cache.items():
-        for cid, store in _cache["channels"].items():
-            _message_cache[guid]["channels"][cid] = deque(
-                [m for m in store if m.created_at > x_hours_ago], maxlen=MSG_STORE_CAP
-            )
-        await asyncio.sleep(0)
+
+async def set_search_index(guild_id: int, enabled: bool):
+    """Enables or disables the search index of a guild, indexing what's already cached"""
+    _cache = _message_cache.get(guild_id)
+    if not enabled:
+        _search_guilds.discard(guild_id)
+        if _cache is not None and _cache["tokens"]:
+            tokens = _cache["tokens"]
+            _charge(_cache, -(TOKEN_BYTES * len(tokens) + POSTING_BYTES * sum(map(len, tokens.values()))))
+            _cache["tokens"] = {}
+        return
+    if guild_id in _search_guilds:
+        return
+    _search_guilds.add(guild_id)
+    if _cache is None:
+        return
+    deadline = time.monotonic() + CLEANUP_SLICE
+    for store in list(_cache["channels"].values()):
+        # Only the messages that were cached before this call
+        for i in range(store.start, len(store.ids)):
+            _id = store.ids[i]
+            history = _cache["edits"].get(_id)
+            _index_tokens(_cache, _id, history.content if history else store.contents[i])
+        if time.monotonic() > deadline:
+            await asyncio.sleep(0)
+            deadline = time.monotonic() + CLEANUP_SLICE
+            if guild_id not in _search_guilds:
+                return
+
+
+def search_messages(
+    guild: discord.Guild,
+    terms: str,
+    *,
+    channel_id: Optional[int] = None,
+    author_id: Optional[int] = None,
+    check: Optional[Callable[[LiteMessage], bool]] = None,
+    limit: Optional[int] = None,
+) -> Optional[List[LiteMessage]]:
+    """
+    The cached messages containing all the words in 'terms', newest first, up to 'limit' of them.
+    Returns None if the guild's search index is disabled
+    """
+    if guild.id not in _search_guilds:
+        return None
+    _cache = _message_cache.get(guild.id)
+    words = set(SEARCH_TOKEN_RE.findall(terms.lower()))
+    if _cache is None or not words:
+        return []
+    postings = sorted((_cache["tokens"].get(word, set()) for word in words), key=len)
+    # Walked newest first, so that we can stop as soon as we have enough
+    candidates = [-_id for _id in postings[0]]
+    heapq.heapify(candidates)
+    results = []
+    while candidates and (limit is None or len(results) < limit):
+        _id = -heapq.heappop(candidates)
+        if not all(_id in posting for posting in postings[1:]):
+            continue
+        m = get_message(guild, _id)
+        if m is None:
+            continue
+        if channel_id is not None and m.channel_id != channel_id:
+            continue
+        if author_id is not None and m.author_id != author_id:
+            continue
+        if check is not None and not check(m):
+            continue
+        results.append(m)
+    return results
+
+
+def get_total_bytes() -> int:
+    return _total_bytes
+
+
+def get_usage():
+    """Returns (guild ID, estimated bytes, messages) for each guild, largest first"""
+    usage = [(guid, _cache["bytes"], len(_cache["messages"])) for guid, _cache in _message_cache.items()]
+    return sorted(usage, key=lambda u: u[1], reverse=True)
+
+
+def _drop_if_empty(stores: dict, key: int, store: MessageStore) -> bool:
+    # The store could have been replaced while we were yielding
+    if not len(store) and stores.get(key) is store:
+        del stores[key]
+        return True
+    return False
+
+
+def _forget_author_in_guild(author_id: int, guild_id: int):
+    guilds = _author_index.get(author_id)
+    if guilds is None:
+        return
+    guilds.pop(guild_id, None)
+    if not guilds:
+        del _author_index[author_id]
 
 
 async def discard_messages_from_user(_id):
-    for guid, _cache in _message_cache.items():
-        for uid, store in _cache["users"].items():
-            _message_cache[guid]["users"][uid] = deque([m for m in store if m.author_id != _id], maxlen=MSG_STORE_CAP)
+    # Only the stores that hold their messages are touched
+    for guid, channel_ids in _author_index.pop(_id, {}).items():
+        _cache = _message_cache.get(guid)
+        if _cache is None:
+            continue
+        user_store = _cache["users"].pop(_id, None)
+        if user_store is not None:
+            _charge(_cache, -user_store.nbytes)
+            # The messages their channel stores have already evicted
+            for message_id in user_store.ids[user_store.start :]:
+                if _cache["messages"].get(message_id) is user_store:
+                    del _cache["messages"][message_id]
+                    history = _cache["edits"].pop(message_id, None)
+                    if history is not None:
+                        _charge(_cache, -_history_size(history))
+                    _charge(_cache, -INDEX_BYTES)
+        if _cache["rates"].pop(_id, None) is not None:
+            _charge(_cache, -RATE_BYTES)
+        for cid in channel_ids:
+            store = _cache["channels"].get(cid)
+            if store is None:
+                continue
+            used = store.nbytes
+            for message_id, content in store.remove_author(_id):
+                if _cache["tokens"]:
+                    _unindex_tokens(_cache, message_id, content)
+                _cache["messages"].pop(message_id, None)
+                history = _cache["edits"].pop(message_id, None)
+                if history is not None:
+                    _charge(_cache, -_history_size(history))
+                _charge(_cache, -INDEX_BYTES)
+            _charge(_cache, store.nbytes - used)
+            _drop_if_empty(_cache["channels"], cid, store)
         await asyncio.sleep(0)
 
-    for guid, _cache in _message_cache.items():
-        for cid, store in _cache["channels"].items():
-            _message_cache[guid]["channels"][cid] = deque(
-                [m for m in store if m.author_id != _id], maxlen=MSG_STORE_CAP
-            )
-        await asyncio.sleep(0)
+
+# Snapshot file layout, all integers little endian:
+# magic | per guild: guild ID, messages, edit histories
+#       | per message: ID, author ID, channel ID, content
+#       | per edit history: message ID, edits, current content | per edit: edited at, content
+# Strings are a length followed by utf-8 bytes
+SNAPSHOT_MAGIC = b"DFMC1"
+_guild_header = struct.Struct("<QII")
+_message_row = struct.Struct("<QQQI")
+_history_header = struct.Struct("<QII")
+_edit_header = struct.Struct("<dI")
+_str_header = struct.Struct("<I")
+_snapshot_generation = 0
+
+
+def _encode(text: str) -> bytes:
+    return text.encode("utf-8", "surrogatepass")
+
+
+def _snapshot_guild(guild_id: int, _cache) -> bytes:
+    rows = []
+    for store in _cache["channels"].values():
+        for i in range(store.start, len(store.ids)):
+            content = _encode(store.contents[i])
+            rows.append(_message_row.pack(store.ids[i], store.author_ids[i], store.channel_ids[i], len(content)))
+            rows.append(content)
+    # Messages that only their user store still remembers
+    n_rows = len(rows) // 2
+    for store in _cache["users"].values():
+        for i in range(store.start, len(store.ids)):
+            if _cache["messages"].get(store.ids[i]) is not store:
+                continue
+            content = _encode(store.contents[i])
+            rows.append(_message_row.pack(store.ids[i], store.author_ids[i], store.channel_ids[i], len(content)))
+            rows.append(content)
+            n_rows += 1
+
+    for _id, history in _cache["edits"].items():
+        content = _encode(history.content)
+        rows.append(_history_header.pack(_id, len(history.edits), len(content)))
+        rows.append(content)
+        for edit in history.edits:
+            content = _encode(edit.content)
+            edited_at = edit.edited_at.timestamp() if edit.edited_at else 0.0
+            rows.append(_edit_header.pack(edited_at, len(content)))
+            rows.append(content)
+
+    return _guild_header.pack(guild_id, n_rows, len(_cache["edits"])) + b"".join(rows)
+
+
+def _write_snapshot(path: Path, chunks: List[bytes], generation: int):
+    tmp = path.with_name(f"{path.name}.{generation}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        for chunk in chunks:
+            f.write(chunk)
+    # A newer snapshot could have been written while we were busy
+    if generation == _snapshot_generation:
+        os.replace(tmp, path)
+    else:
+        os.remove(tmp)
+
+
+async def save_snapshot(path: Path):
+    """Serializes the cache a guild at a time, the file is written in a thread"""
+    global _snapshot_generation
+    _snapshot_generation += 1
+    generation = _snapshot_generation
+    chunks = []
+    deadline = time.monotonic() + CLEANUP_SLICE
+    for guild_id, _cache in list(_message_cache.items()):
+        chunks.append(_snapshot_guild(guild_id, _cache))
+        if time.monotonic() > deadline:
+            await asyncio.sleep(0)
+            deadline = time.monotonic() + CLEANUP_SLICE
+    await asyncio.to_thread(_write_snapshot, path, chunks, generation)
+
+
+def save_snapshot_sync(path: Path):
+    """For cog unload, where we can't wait on anything"""
+    global _snapshot_generation
+    _snapshot_generation += 1
+    chunks = [_snapshot_guild(guild_id, _cache) for guild_id, _cache in list(_message_cache.items())]
+    _write_snapshot(path, chunks, _snapshot_generation)
+
+
+async def load_snapshot(path: Path, *, skip_authors: Collection[int] = ()):
+    """
+    Restores a snapshot in the background, in small slices, dropping what has expired
+    in the meantime. Messages received in the meantime are kept. 'skip_authors' is
+    checked as the restore goes, authors whose data is deleted meanwhile can be added to it
+    """
+    try:
+        data = await asyncio.to_thread(path.read_bytes)
+    except FileNotFoundError:
+        return
+    if not data.startswith(SNAPSHOT_MAGIC):
+        log.warning("Ignoring the message cache snapshot: unknown format")
+        return
+
+    x_hours_ago = time_snowflake(utcnow() - timedelta(hours=MSG_EXPIRATION_TIME))
+    restored = 0
+    offset = len(SNAPSHOT_MAGIC)
+    deadline = time.monotonic() + CLEANUP_SLICE
+    try:
+        while offset < len(data):
+            guild_id, n_rows, n_histories = _guild_header.unpack_from(data, offset)
+            offset += _guild_header.size
+            rows = []
+            for _ in range(n_rows):
+                _id, author_id, channel_id, length = _message_row.unpack_from(data, offset)
+                offset += _message_row.size
+                if _id > x_hours_ago:
+                    content = data[offset : offset + length].decode("utf-8", "surrogatepass")
+                    rows.append((_id, author_id, channel_id, content))
+                offset += length
+            rows.sort()
+            for _id, author_id, channel_id, content in rows:
+                if author_id in skip_authors:
+                    continue
+                _add_message(guild_id, _id, author_id, channel_id, content, track_rate=False)
+                if time.monotonic() > deadline:
+                    await asyncio.sleep(0)
+                    deadline = time.monotonic() + CLEANUP_SLICE
+            restored += len(rows)
+
+            for _ in range(n_histories):
+                _id, n_edits, length = _history_header.unpack_from(data, offset)
+                offset += _history_header.size
+                content = data[offset : offset + length].decode("utf-8", "surrogatepass")
+                offset += length
+                edits = []
+                for _ in range(n_edits):
+                    edited_at, length = _edit_header.unpack_from(data, offset)
+                    offset += _edit_header.size
+                    edit_content = data[offset : offset + length].decode("utf-8", "surrogatepass")
+                    offset += length
+                    edited_at = datetime.fromtimestamp(edited_at, timezone.utc) if edited_at else None
+                    edits.append(MessageEdit(content=edit_content, edited_at=edited_at))
+                _restore_history(guild_id, _id, content, edits)
+
+            _rebuild_rates(guild_id)
+    except (struct.error, UnicodeDecodeError) as e:
+        log.error("The message cache snapshot is corrupted, stopped restoring it", exc_info=e)
+
+    log.debug("Restored %s messages from the message cache snapshot", restored)
+
+
+def _restore_history(guild_id: int, _id: int, content: str, edits: List[MessageEdit]):
+    _cache = _message_cache.get(guild_id)
+    # Only if it's still cached and it hasn't been edited since the restart
+    if _cache is None or _id in _cache["edits"]:
+        return
+    store = _cache["messages"].get(_id)
+    if store is None:
+        return
+    searchable = guild_id in _search_guilds and isinstance(store, ChannelStore)
+    if searchable:
+        _unindex_tokens(_cache, _id, store.contents[store.find(_id)])
+    history = EditHistory(content)
+    history.edits.extend(edits)
+    _cache["edits"][_id] = history
+    _charge(_cache, _history_size(history))
+    if searchable:
+        _index_tokens(_cache, _id, content)
+
+
+def _rebuild_rates(guild_id: int):
+    # Restored messages are older than the live ones, the rings have to be rebuilt in order
+    _cache = _message_cache.get(guild_id)
+    if _cache is None:
+        return
+    for author_id, store in _cache["users"].items():
+        if author_id not in _cache["rates"]:
+            _charge(_cache, RATE_BYTES)
+        ring = _cache["rates"][author_id] = RateRing()
+        for i in range(max(store.start, len(store.ids) - RATE_RING_SIZE), len(store.ids)):
+            ring.add(store.ids[i] >> 22)
 
 
 # This is a single message object that we store to mock commands in Warden
@@ -0,0 +1,114 @@
+"""
+Defender - Protects your community with automod features and
+           empowers the staff and users you trust with
+           advanced moderation tools
+Copyright (C) 2020-present  Twentysix (https://github.com/Twentysix26/)
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+from pathlib import Path
+import logging
+import struct
+import time
+import os
+
+log = logging.getLogger("red.x26cogs.defender")
+
+# Internal "don't repeat this for X" markers, such as the ones that prevent the same
+# notification from being sent over and over during a raid.
+# They are kept apart from Warden's heat store, which only holds rule-defined keys.
+# Expiry is bucketed by second: each key is checked once, when its bucket is due.
+
+# (guild ID, key) -> monotonic expiry
+_expiries = {}
+# Monotonic second -> keys that expire during that second
+_buckets = defaultdict(list)
+_last_expired_bucket = int(time.monotonic())
+
+
+def add(guild_id: int, key: str, ttl: timedelta) -> bool:
+    """Adds the key for 'ttl', unless it's already there. Returns whether it was added"""
+    now = time.monotonic()
+    k = (guild_id, key)
+    expiry = _expiries.get(k)
+    if expiry is not None and expiry > now:
+        return False
+    expiry = now + ttl.total_seconds()
+    _expiries[k] = expiry
+    _buckets[int(expiry)].append(k)
+    return True
+
+
+def discard_expired():
+    """Drops the keys in the buckets that are due. O(expired keys)"""
+    global _last_expired_bucket
+    now = time.monotonic()
+    current = int(now)
+    for second in range(_last_expired_bucket, current):
+        for k in _buckets.pop(second, ()):
+            expiry = _expiries.get(k)
+            # Re-added keys have their expiry in a later bucket
+            if expiry is not None and expiry <= now:
+                del _expiries[k]
+    _last_expired_bucket = current
+
+
+# Snapshot file layout, all integers little endian:
+# magic | per key: guild ID, expiry as unix time, key length, utf-8 key
+SNAPSHOT_MAGIC = b"DFDD1"
+_row = struct.Struct("<QdI")
+
+
+def save_snapshot(path: Path):
+    """Small enough to be written in one go, even on unload"""
+    now = time.monotonic()
+    offset = time.time() - now
+    rows = [SNAPSHOT_MAGIC]
+    for (guild_id, key), expiry in list(_expiries.items()):
+        if expiry <= now:
+            continue
+        key = key.encode("utf-8", "surrogatepass")
+        rows.append(_row.pack(guild_id, expiry + offset, len(key)))
+        rows.append(key)
+    tmp = path.with_name(f"{path.name}.tmp")
+    tmp.write_bytes(b"".join(rows))
+    os.replace(tmp, path)
+
+
+def load_snapshot(path: Path):
+    """Restores the keys that haven't expired in the meantime"""
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return
+    if not data.startswith(SNAPSHOT_MAGIC):
+        log.warning("Ignoring the dedup snapshot: unknown format")
+        return
+
+    now = time.monotonic()
+    offset = time.time() - now
+    pos = len(SNAPSHOT_MAGIC)
+    try:
+        while pos < len(data):
+            guild_id, expiry, length = _row.unpack_from(data, pos)
+            pos += _row.size
+            key = data[pos : pos + length].decode("utf-8", "surrogatepass")
+            pos += length
+            expiry -= offset
+            k = (guild_id, key)
+            if expiry > now and expiry > _expiries.get(k, 0.0):
+                _expiries[k] = expiry
+                _buckets[int(expiry)].append(k)
+    except (struct.error, UnicodeDecodeError) as e:
+        log.error("The dedup snapshot is corrupted, stopped restoring it", exc_info=e)
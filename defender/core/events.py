@@ -18,11 +18,11 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from ..abc import MixinMeta, CompositeMetaClass
 from ..enums import Action, Rank, QAAction
 from ..core.warden.enums import Event as WardenEvent, ChecksKeys as WDChecksKeys
-from ..core.warden.rule import WardenRule
-from ..core.warden import api as WardenAPI
+from ..core.warden.rule import WardenRule, WDEventContext
+from ..core.warden import api as WardenAPI, membercache
 from ..core.utils import QUICK_ACTION_EMOJIS, utcnow
 from ..exceptions import ExecutionError, MisconfigurationError
-from . import cache as df_cache
+from . import cache as df_cache, memo
 from redbot.core import commands
 from discord import MessageType
 import discord
@@ -36,6 +36,7 @@ log = logging.getLogger("red.x26cogs.defender")
 
 class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
     @commands.Cog.listener()
+    @memo.event_scoped
     async def on_message(self, message: discord.Message):
         author = message.author
         if not hasattr(author, "guild") or not author.guild:
@@ -66,21 +67,18 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
         rank = await self.rank_user(author)
 
         if rank == Rank.Rank1:
-            if await self.bot.is_mod(author):  # Is staff?
+            if await memo.is_mod(self.bot, author):  # Is staff?
                 is_staff = True
                 await self.refresh_staff_activity(guild)
 
         rule: WardenRule
         if await self.config.guild(guild).warden_enabled():
-            rules = self.get_warden_rules_by_event(guild, WardenEvent.OnMessage)
+            rules = self.get_warden_rules_by_event(guild, WardenEvent.OnMessage, rank)
+            wd_ctx = WDEventContext(cog=self, guild=guild, message=message, user=author)
             for rule in rules:
-                if await rule.satisfies_conditions(
-                    cog=self, rank=rank, guild=message.guild, message=message, user=message.author
-                ):
+                if await rule.satisfies_conditions(rank=rank, ctx=wd_ctx):
                     try:
-                        wd_expelled = await rule.do_actions(
-                            cog=self, guild=message.guild, message=message, user=message.author
-                        )
+                        wd_expelled = await rule.do_actions(ctx=wd_ctx)
                         if wd_expelled:
                             expelled = True
                             await asyncio.sleep(0.1)
@@ -169,6 +167,7 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
                     log.error("Unexpected error in CommentAnalysis", exc_info=e)
 
     @commands.Cog.listener()
+    @memo.event_scoped
     async def on_message_edit(self, message_before: discord.Message, message: discord.Message):
         author = message.author
         if not hasattr(author, "guild") or not author.guild:
@@ -194,19 +193,18 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
         rank = await self.rank_user(author)
 
         if rank == Rank.Rank1:
-            if await self.bot.is_mod(author):  # Is staff?
+            if await memo.is_mod(self.bot, author):  # Is staff?
                 is_staff = True
                 await self.refresh_staff_activity(guild)
 
         rule: WardenRule
         if await self.config.guild(guild).warden_enabled():
-            rules = self.get_warden_rules_by_event(guild, WardenEvent.OnMessageEdit)
+            rules = self.get_warden_rules_by_event(guild, WardenEvent.OnMessageEdit, rank)
+            wd_ctx = WDEventContext(cog=self, guild=guild, message=message, user=message.author)
             for rule in rules:
-                if await rule.satisfies_conditions(
-                    cog=self, rank=rank, guild=guild, message=message, user=message.author
-                ):
+                if await rule.satisfies_conditions(rank=rank, ctx=wd_ctx):
                     try:
-                        wd_expelled = await rule.do_actions(cog=self, guild=guild, message=message, user=message.author)
+                        wd_expelled = await rule.do_actions(ctx=wd_ctx)
                         if wd_expelled:
                             expelled = True
                             await asyncio.sleep(0.1)
@@ -256,6 +254,7 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
                     log.error("Unexpected error in CommentAnalysis", exc_info=e)
 
     @commands.Cog.listener()
+    @memo.event_scoped
     async def on_message_delete(self, message: discord.Message):
         author = message.author
         if not hasattr(author, "guild") or not author.guild:
@@ -275,13 +274,12 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
 
         rule: WardenRule
         if await self.config.guild(guild).warden_enabled():
-            rules = self.get_warden_rules_by_event(guild, WardenEvent.OnMessageDelete)
+            rules = self.get_warden_rules_by_event(guild, WardenEvent.OnMessageDelete, rank)
+            wd_ctx = WDEventContext(cog=self, guild=guild, message=message, user=message.author)
             for rule in rules:
-                if await rule.satisfies_conditions(
-                    cog=self, rank=rank, guild=guild, message=message, user=message.author
-                ):
+                if await rule.satisfies_conditions(rank=rank, ctx=wd_ctx):
                     try:
-                        await rule.do_actions(cog=self, guild=guild, message=message, user=message.author)
+                        await rule.do_actions(ctx=wd_ctx)
                     except (discord.Forbidden, discord.HTTPException, ExecutionError) as e:
                         self.send_to_monitor(
                             guild, f"[Warden] Rule {rule.name} " f"({rule.last_action.value}) - {str(e)}"
@@ -293,6 +291,7 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
                         log.error("Warden - unexpected error during actions execution", exc_info=e)
 
     @commands.Cog.listener()
+    @memo.event_scoped
     async def on_reaction_add(self, reaction: discord.Reaction, user: discord.Member):
         if not hasattr(user, "guild") or not user.guild or user.bot:
             return
@@ -304,13 +303,12 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
         rule: WardenRule
         if await self.config.guild(guild).warden_enabled():
             rank = await self.rank_user(user)
-            rules = self.get_warden_rules_by_event(guild, WardenEvent.OnReactionAdd)
+            rules = self.get_warden_rules_by_event(guild, WardenEvent.OnReactionAdd, rank)
+            wd_ctx = WDEventContext(cog=self, guild=guild, message=message, user=user, reaction=reaction)
             for rule in rules:
-                if await rule.satisfies_conditions(
-                    cog=self, rank=rank, guild=guild, message=message, user=user, reaction=reaction
-                ):
+                if await rule.satisfies_conditions(rank=rank, ctx=wd_ctx):
                     try:
-                        await rule.do_actions(cog=self, guild=guild, message=message, user=user, reaction=reaction)
+                        await rule.do_actions(ctx=wd_ctx)
                     except (discord.Forbidden, discord.HTTPException, ExecutionError) as e:
                         self.send_to_monitor(
                             guild, f"[Warden] Rule {rule.name} " f"({rule.last_action.value}) - {str(e)}"
@@ -322,7 +320,10 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
                         log.error("Warden - unexpected error during actions execution", exc_info=e)
 
     @commands.Cog.listener()
+    @memo.event_scoped
     async def on_member_join(self, member: discord.Member):
+        # Whatever was known about a returning member may be outdated
+        membercache.invalidate_member(member.guild.id, member.id)
         if member.bot:
             return
 
@@ -334,12 +335,13 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
 
         if await self.config.guild(guild).warden_enabled():
             rule: WardenRule
-            rules = self.get_warden_rules_by_event(guild, WardenEvent.OnUserJoin)
+            rank = await self.rank_user(member)
+            rules = self.get_warden_rules_by_event(guild, WardenEvent.OnUserJoin, rank)
+            wd_ctx = WDEventContext(cog=self, guild=guild, user=member)
             for rule in rules:
-                rank = await self.rank_user(member)
-                if await rule.satisfies_conditions(cog=self, rank=rank, guild=guild, user=member):
+                if await rule.satisfies_conditions(rank=rank, ctx=wd_ctx):
                     try:
-                        await rule.do_actions(cog=self, guild=guild, user=member)
+                        await rule.do_actions(ctx=wd_ctx)
                     except (discord.Forbidden, discord.HTTPException, ExecutionError) as e:
                         self.send_to_monitor(
                             guild, f"[Warden] Rule {rule.name} " f"({rule.last_action.value}) - {str(e)}"
@@ -356,7 +358,9 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
                 await self.join_monitor_suspicious(member)
 
     @commands.Cog.listener()
+    @memo.event_scoped
     async def on_member_remove(self, member: discord.Member):
+        membercache.invalidate_member(member.guild.id, member.id)
         if member.bot:
             return
 
@@ -368,12 +372,13 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
 
         if await self.config.guild(guild).warden_enabled():
             rule: WardenRule
-            rules = self.get_warden_rules_by_event(guild, WardenEvent.OnUserLeave)
+            rank = await self.rank_user(member)
+            rules = self.get_warden_rules_by_event(guild, WardenEvent.OnUserLeave, rank)
+            wd_ctx = WDEventContext(cog=self, guild=guild, user=member)
             for rule in rules:
-                rank = await self.rank_user(member)
-                if await rule.satisfies_conditions(cog=self, rank=rank, guild=guild, user=member):
+                if await rule.satisfies_conditions(rank=rank, ctx=wd_ctx):
                     try:
-                        await rule.do_actions(cog=self, guild=guild, user=member)
+                        await rule.do_actions(ctx=wd_ctx)
                     except (discord.Forbidden, discord.HTTPException, ExecutionError) as e:
                         self.send_to_monitor(
                             guild, f"[Warden] Rule {rule.name} " f"({rule.last_action.value}) - {str(e)}"
@@ -385,7 +390,10 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
                         log.error("Warden - unexpected error during actions execution", exc_info=e)
 
     @commands.Cog.listener()
+    @memo.event_scoped
     async def on_member_update(self, before: discord.Member, after: discord.Member):
+        # Nickname, guild avatar, roles...
+        membercache.invalidate_member(after.guild.id, after.id)
         guild = after.guild
         if await self.bot.cog_disabled_in_guild(self, guild):  # type: ignore
             return
@@ -405,12 +413,13 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
 
         rule: WardenRule
         event = WardenEvent.OnRoleRemove if removed else WardenEvent.OnRoleAdd
-        rules = self.get_warden_rules_by_event(guild, event)
+        rank = await self.rank_user(after)
+        rules = self.get_warden_rules_by_event(guild, event, rank)
+        wd_ctx = WDEventContext(cog=self, guild=guild, user=after, role=role)
         for rule in rules:
-            rank = await self.rank_user(after)
-            if await rule.satisfies_conditions(cog=self, rank=rank, guild=guild, user=after, role=role):
+            if await rule.satisfies_conditions(rank=rank, ctx=wd_ctx):
                 try:
-                    await rule.do_actions(cog=self, guild=guild, user=after, role=role)
+                    await rule.do_actions(ctx=wd_ctx)
                 except (discord.Forbidden, discord.HTTPException, ExecutionError) as e:
                     self.send_to_monitor(guild, f"[Warden] Rule {rule.name} " f"({rule.last_action.value}) - {str(e)}")
                 except Exception as e:
@@ -418,13 +427,33 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
                     log.error("Warden - unexpected error during actions execution", exc_info=e)
 
     @commands.Cog.listener()
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        # Username, display name, avatar...
+        membercache.invalidate_user(after.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_create(self, role: discord.Role):
+        # Roles can be referred to by name in the rules
+        membercache.invalidate_guild(role.guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if before.name != after.name:
+            membercache.invalidate_guild(after.guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        membercache.invalidate_guild(role.guild.id)
+
+    @commands.Cog.listener()
+    @memo.event_scoped
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
         user = payload.member
         if not user or not hasattr(user, "guild") or not user.guild or user.bot:
             return
         if await self.bot.cog_disabled_in_guild(self, user.guild):  # type: ignore
             return
-        if await self.bot.is_mod(user):  # Is staff?
+        if await memo.is_mod(self.bot, user):  # Is staff?
             await self.refresh_staff_activity(user.guild)
         else:
             return
@@ -462,7 +491,7 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
                 guild, f"[QuickAction] Prevented user {user} from taking action on themselves. " "Was this deliberate?"
             )
             return
-        elif await self.bot.is_mod(target):
+        elif await memo.is_mod(self.bot, target):
             self.send_to_monitor(guild, f"[QuickAction] Target user {target} is a staff member. I cannot do that.")
             return
 
@@ -517,12 +546,13 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
         )
 
     @commands.Cog.listener()
+    @memo.event_scoped
     async def on_reaction_remove(self, reaction: discord.Reaction, user: discord.Member):
         if not hasattr(user, "guild") or not user.guild or user.bot:
             return
         if await self.bot.cog_disabled_in_guild(self, user.guild):  # type: ignore
             return
-        if await self.bot.is_mod(user):  # Is staff?
+        if await memo.is_mod(self.bot, user):  # Is staff?
             await self.refresh_staff_activity(user.guild)
 
         message = reaction.message
@@ -530,13 +560,12 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
         rule: WardenRule
         if await self.config.guild(guild).warden_enabled():
             rank = await self.rank_user(user)
-            rules = self.get_warden_rules_by_event(guild, WardenEvent.OnReactionRemove)
+            rules = self.get_warden_rules_by_event(guild, WardenEvent.OnReactionRemove, rank)
+            wd_ctx = WDEventContext(cog=self, guild=guild, message=message, user=user, reaction=reaction)
             for rule in rules:
-                if await rule.satisfies_conditions(
-                    cog=self, rank=rank, guild=guild, message=message, user=user, reaction=reaction
-                ):
+                if await rule.satisfies_conditions(rank=rank, ctx=wd_ctx):
                     try:
-                        await rule.do_actions(cog=self, guild=guild, message=message, user=user, reaction=reaction)
+                        await rule.do_actions(ctx=wd_ctx)
                     except (discord.Forbidden, discord.HTTPException, ExecutionError) as e:
                         self.send_to_monitor(
                             guild, f"[Warden] Rule {rule.name} " f"({rule.last_action.value}) - {str(e)}"
@@ -548,6 +577,7 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
                         log.error("Warden - unexpected error during actions execution", exc_info=e)
 
     @commands.Cog.listener()
+    @memo.event_scoped
     async def on_x26_defender_emergency(self, guild: discord.Guild):
         rule: WardenRule
         if await self.bot.cog_disabled_in_guild(self, guild):  # type: ignore
@@ -556,10 +586,11 @@ class Events(MixinMeta, metaclass=CompositeMetaClass):  # type: ignore
             return
 
         rules = self.get_warden_rules_by_event(guild, WardenEvent.OnEmergency)
+        wd_ctx = WDEventContext(cog=self, guild=guild)
         for rule in rules:
-            if await rule.satisfies_conditions(cog=self, rank=rule.rank, guild=guild):
+            if await rule.satisfies_conditions(rank=rule.rank, ctx=wd_ctx):
                 try:
-                    await rule.do_actions(cog=self, guild=guild)
+                    await rule.do_actions(ctx=wd_ctx)
                 except (discord.Forbidden, discord.HTTPException, ExecutionError) as e:
                     self.send_to_monitor(guild, f"[Warden] Rule {rule.name} " f"({rule.last_action.value}) - {str(e)}")
                 except Exception as e:
@@ -0,0 +1,102 @@
+"""
+Defender - Protects your community with automod features and
+           empowers the staff and users you trust with
+           advanced moderation tools
+Copyright (C) 2020-present  Twentysix (https://github.com/Twentysix26/)
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+from redbot.core.utils.common_filters import INVITE_URL_RE
+import functools
+import logging
+
+log = logging.getLogger("red.x26cogs.defender")
+
+# Event scoped memoization: while an event is being handled, the expensive checks that several
+# rules and modules ask for (rank, staff status, invites...) are computed only once.
+# The memo lives in a context variable, so it's private to the task that handles the event.
+
+_memo: ContextVar[Optional[dict]] = ContextVar("defender_event_memo", default=None)
+
+# Name -> lookups made / lookups answered from the memo, since the cog was loaded
+calls = Counter()
+hits = Counter()
+
+
+def event_scoped(listener):
+    """Gives each call of the listener its own memo"""
+
+    @functools.wraps(listener)
+    async def wrapper(*args, **kwargs):
+        token = _memo.set({})
+        try:
+            return await listener(*args, **kwargs)
+        finally:
+            _memo.reset(token)
+
+    return wrapper
+
+
+def memoized(name: str, key):
+    """
+    Memoizes a coroutine function for the duration of an event. key receives the
+    function's arguments and returns what identifies the result. Outside of an event
+    the function is simply called
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            memo = _memo.get()
+            if memo is None:
+                return await function(*args, **kwargs)
+            calls[name] += 1
+            memo_key = (name, key(*args, **kwargs))
+            try:
+                result = memo[memo_key]
+            except KeyError:
+                result = memo[memo_key] = await function(*args, **kwargs)
+            else:
+                hits[name] += 1
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+@memoized("is_mod", key=lambda bot, member: (member.guild.id, member.id))
+async def is_mod(bot, member) -> bool:
+    return await bot.is_mod(member)
+
+
+def find_invites(text: str) -> list:
+    memo = _memo.get()
+    if memo is None:
+        return INVITE_URL_RE.findall(text)
+    calls["find_invites"] += 1
+    memo_key = ("find_invites", text)
+    try:
+        result = memo[memo_key]
+    except KeyError:
+        result = memo[memo_key] = INVITE_URL_RE.findall(text)
+    else:
+        hits["find_invites"] += 1
+    return result
+
+
+def get_stats() -> Dict[str, Tuple[int, int]]:
+    """Name -> (lookups, lookups saved)"""
+    return {name: (calls[name], hits[name]) for name in sorted(calls)}
@@ -18,6 +18,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from typing import Tuple, List
 from ..enums import Action, QAAction
 from ..exceptions import MisconfigurationError
+from . import memo
 from collections import namedtuple
 import datetime
 import discord
@@ -45,6 +46,7 @@ QUICK_ACTION_EMOJIS = {
 QuickAction = namedtuple("QuickAction", ("target", "reason"))
 
 
+@memo.memoized("get_external_invite", key=lambda guild, invites: (guild.id, tuple(invites)))
 async def get_external_invite(guild: discord.Guild, invites: List[Tuple]):
     if not guild.me.guild_permissions.manage_guild:
         raise MisconfigurationError("I need 'manage guild' permissions to fetch this server's invites.")
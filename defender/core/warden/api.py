@@ -18,7 +18,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from ...abc import MixinMeta
 from ...enums import Rank
 from .utils import strip_yaml_codeblock
-from .rule import WardenCheck
+from .rule import WardenCheck, WDEventContext
 from .enums import Event as WDEvent, ChecksKeys
 from typing import Optional
 import logging
@@ -81,7 +81,8 @@ async def eval_check(
     if wd_check is None:  # No check = Passed
         return True
 
-    return bool(await wd_check.satisfies_conditions(rank=Rank.Rank4, cog=cog, guild=guild, user=user, message=message))
+    wd_ctx = WDEventContext(cog=cog, guild=guild, user=user, message=message)
+    return bool(await wd_check.satisfies_conditions(rank=Rank.Rank4, ctx=wd_ctx))
 
 
 async def load_modules_checks():
@@ -0,0 +1,486 @@
+"""Defender - Protects your community with automod features and
+           empowers the staff and users you trust with
+           advanced moderation tools
+Copyright (C) 2020-present  Twentysix (https://github.com/Twentysix26/)
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+from ...core.warden import validation as models
+from ...enums import Rank
+from .enums import Condition
+from .utils import has_x_or_more_emojis, REMOVE_C_EMOJIS_RE, run_user_regex
+from ...exceptions import ExecutionError, MisconfigurationError
+from ...core import cache as df_cache, memo
+from ...core.utils import get_external_invite, utcnow
+from string import Template
+from typing import TYPE_CHECKING, Callable, Dict
+from . import heat, profiler
+import fnmatch
+import discord
+import datetime
+import logging
+import regex as re
+
+if TYPE_CHECKING:
+    from .rule import WDRuntime
+
+"""
+The condition checkers, one per Warden condition. They are bound to the conditions of a rule
+when the rule is parsed, so evaluating a condition is just a call.
+"""
+
+log = logging.getLogger("red.x26cogs.defender")
+
+MEDIA_URL_RE = re.compile(r"""(http)?s?:?(\/\/[^"']*\.(?:png|jpg|jpeg|gif|png|svg|mp4|gifv))""", re.I)
+URL_RE = re.compile(
+    r"""https?:\/\/(www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?&//=]*)""", re.I
+)
+
+CHECKERS: Dict[Condition, Callable] = {}
+
+
+def checker(condition: Condition, suggest: Condition = None):
+    def decorator(function):
+        if suggest is None:
+            CHECKERS[condition] = function
+            return function
+
+        def wrapper(runtime: WDRuntime, params):
+            runtime.cog.send_to_monitor(
+                runtime.guild,
+                f"[Warden] ({runtime.rule.name}): Condition "
+                f"'{condition.value}' is deprecated, use "
+                f"'{suggest.value}' instead.",
+            )
+            return function(runtime, params)
+
+        CHECKERS[condition] = wrapper
+        return wrapper
+
+    return decorator
+
+
+async def awaited(runtime: WDRuntime, coro):
+    """Awaits what the condition is waiting on (user regex, API calls...), counting the time in the rule's stats"""
+    start = profiler.clock()
+    try:
+        return await coro
+    finally:
+        if runtime.stats is not None:
+            runtime.stats.await_time += profiler.clock() - start
+
+
+def ensure_checkers():
+    for c in Condition:
+        if c not in CHECKERS:
+            raise MisconfigurationError(f"{c.value} does not have a checker.")
+
+
+@checker(Condition.MessageMatchesAny)
+async def message_matches_any(runtime: WDRuntime, params: models.WildcardList):
+    # One match = Passed
+    return params.matches(runtime.message.content)
+
+
+@checker(Condition.MessageMatchesRegex)
+async def message_matches_regex(runtime: WDRuntime, params: models.IsStr):
+    cog = runtime.cog
+    guild = runtime.guild
+    message = runtime.message
+    return await awaited(
+        runtime, run_user_regex(rule_obj=runtime.rule, cog=cog, guild=guild, regex=params.value, text=message.content)
+    )
+
+
+@checker(Condition.MessageContainsWord)
+async def message_contains_word(runtime: WDRuntime, params: models.WildcardList):
+    return params.matches_any(runtime.message.content.lower().split())
+
+
+@checker(Condition.UserActivityMatchesAny)
+async def user_activity_matches_any(runtime: WDRuntime, params: models.WildcardList):
+    user = runtime.user
+    to_check = []
+    for activity in user.activities:
+        if isinstance(activity, discord.BaseActivity):
+            if activity.name is not None:
+                to_check.append(activity.name.lower())
+
+    return params.matches_any(to_check)
+
+
+@checker(Condition.UserStatusMatchesAny)
+async def user_status_matches_any(runtime: WDRuntime, params: models.NonEmptyListStr):
+    user = runtime.user
+    status_str = str(user.status)
+    for status in params.value:
+        if status.lower() == status_str:
+            return True
+    return False
+
+
+@checker(Condition.UserIdMatchesAny)
+async def user_id_matches_any(runtime: WDRuntime, params: models.NonEmptyListInt):
+    user = runtime.user
+    for _id in params.value:
+        if _id == user.id:
+            return True
+    return False
+
+
+@checker(Condition.UsernameMatchesAny)
+async def username_matches_any(runtime: WDRuntime, params: models.WildcardList):
+    # One match = Passed
+    return params.matches(runtime.user.name)
+
+
+@checker(Condition.UsernameMatchesRegex)
+async def username_matches_regex(runtime: WDRuntime, params: models.IsStr):
+    cog = runtime.cog
+    guild = runtime.guild
+    user = runtime.user
+    return await awaited(
+        runtime, run_user_regex(rule_obj=runtime.rule, cog=cog, guild=guild, regex=params.value, text=user.name)
+    )
+
+
+@checker(Condition.NicknameMatchesAny)
+async def nickname_matches_any(runtime: WDRuntime, params: models.WildcardList):
+    # One match = Passed
+    user = runtime.user
+    if not user.nick:
+        return False
+    return params.matches(user.nick)
+
+
+@checker(Condition.NicknameMatchesRegex)
+async def nickname_matches_regex(runtime: WDRuntime, params: models.IsStr):
+    cog = runtime.cog
+    guild = runtime.guild
+    user = runtime.user
+    if not user.nick:
+        return False
+    return await awaited(
+        runtime, run_user_regex(rule_obj=runtime.rule, cog=cog, guild=guild, regex=params.value, text=user.nick)
+    )
+
+
+@checker(Condition.DisplayNameMatchesAny)
+async def display_name_matches_any(runtime: WDRuntime, params: models.WildcardList):
+    # One match = Passed
+    return params.matches(runtime.user.display_name)
+
+
+@checker(Condition.DisplayNameMatchesRegex)
+async def display_name_matches_regex(runtime: WDRuntime, params: models.IsStr):
+    cog = runtime.cog
+    guild = runtime.guild
+    user = runtime.user
+    return await awaited(
+        runtime, run_user_regex(rule_obj=runtime.rule, cog=cog, guild=guild, regex=params.value, text=user.display_name)
+    )
+
+
+@checker(Condition.ChannelMatchesAny)
+async def channel_matches_any(runtime: WDRuntime, params: models.NonEmptyList):
+    guild = runtime.guild
+    channel = runtime.channel
+    parent = runtime.parent
+    if channel.id in params.value:
+        return True
+    if parent is None:  # Name matching for channels only
+        for channel_str in params.value:
+            channel_str = str(channel_str)
+            channel_obj = discord.utils.get(guild.text_channels, name=channel_str)
+            if channel_obj is not None and channel_obj == channel:
+                return True
+    return False
+
+
+@checker(Condition.CategoryMatchesAny)
+async def category_matches_any(runtime: WDRuntime, params: models.NonEmptyList):
+    guild = runtime.guild
+    channel = runtime.channel
+    parent = runtime.parent
+    chan = channel if parent is None else parent
+    if chan.category is None:
+        return False
+    if chan.category.id in params.value:
+        return True
+    for category_str in params.value:
+        category_str = str(category_str)
+        category_obj = discord.utils.get(guild.categories, name=category_str)
+        if category_obj is not None and category_obj == chan.category:
+            return True
+    return False
+
+
+@checker(Condition.ChannelIsPublic)
+async def channel_is_public(runtime: WDRuntime, params: models.IsBool):
+    guild = runtime.guild
+    channel = runtime.channel
+    parent = runtime.parent
+    if parent is None:
+        everyone = guild.default_role
+        public = everyone not in channel.overwrites or channel.overwrites[everyone].read_messages in (
+            True,
+            None,
+        )
+        return params.value is public
+    else:
+        is_public_thread = channel.type is discord.ChannelType.public_thread
+        return params.value is is_public_thread
+
+
+@checker(Condition.UserCreatedLessThan)
+async def user_created_less_than(runtime: WDRuntime, params: models.UserJoinedCreated):
+    user = runtime.user
+    if isinstance(params.value, int):
+        if params.value == 0:
+            return True
+        x_hours_ago = utcnow() - datetime.timedelta(hours=params.value)
+    else:
+        x_hours_ago = utcnow() - params.value  # type: ignore
+
+    return user.created_at > x_hours_ago
+
+
+@checker(Condition.UserIsRank)
+async def user_is_rank(runtime: WDRuntime, params: models.IsRank):
+    cog = runtime.cog
+    user = runtime.user
+    return await cog.rank_user(user) == Rank(params.value)
+
+
+@checker(Condition.UserJoinedLessThan)
+async def user_joined_less_than(runtime: WDRuntime, params: models.UserJoinedCreated):
+    user = runtime.user
+    if isinstance(params.value, int):
+        if params.value == 0:
+            return True
+        x_hours_ago = utcnow() - datetime.timedelta(hours=params.value)
+    else:
+        x_hours_ago = utcnow() - params.value  # type: ignore
+
+    return user.joined_at > x_hours_ago
+
+
+@checker(Condition.UserHasDefaultAvatar)
+async def user_has_default_avatar(runtime: WDRuntime, params: models.IsBool):
+    user = runtime.user
+    default_avatar_url_pattern = "*/embed/avatars/*.png"
+    match = fnmatch.fnmatch(user.avatar.url, default_avatar_url_pattern)
+    return params.value is match
+
+
+@checker(Condition.InEmergencyMode)
+async def in_emergency_mode(runtime: WDRuntime, params: models.IsBool):
+    cog = runtime.cog
+    guild = runtime.guild
+    in_emergency = cog.is_in_emergency_mode(guild)
+    return in_emergency is params.value
+
+
+@checker(Condition.MessageHasAttachment)
+async def message_has_attachment(runtime: WDRuntime, params: models.IsBool):
+    message = runtime.message
+    return bool(message.attachments) is params.value
+
+
+@checker(Condition.UserHasAnyRoleIn)
+async def user_has_any_role_in(runtime: WDRuntime, params: models.NonEmptyList):
+    guild = runtime.guild
+    user = runtime.user
+    for role_id_or_name in params.value:
+        role = guild.get_role(role_id_or_name)
+        if role is None:
+            role = discord.utils.get(guild.roles, name=role_id_or_name)
+        if role:
+            if role in user.roles:
+                return True
+    return False
+
+
+@checker(Condition.UserHasSentLessThanMessages)
+async def user_has_sent_less_than_messages(runtime: WDRuntime, params: models.IsInt):
+    cog = runtime.cog
+    user = runtime.user
+    msg_n = await cog.get_total_recorded_messages(user)
+    return msg_n < params.value
+
+
+@checker(Condition.UserMessageRateMoreThan)
+async def user_message_rate_more_than(runtime: WDRuntime, params: models.MessageRate):
+    user = runtime.user
+    return df_cache.get_message_rate(user, params.minutes) > params.messages
+
+
+@checker(Condition.MessageContainsInvite)
+async def message_contains_invite(runtime: WDRuntime, params: models.IsBool):
+    guild = runtime.guild
+    message = runtime.message
+    results = memo.find_invites(message.content)
+    if results:
+        has_invite = True
+        try:
+            if await awaited(runtime, get_external_invite(guild, results)) is None:
+                has_invite = False
+        except MisconfigurationError as e:
+            raise ExecutionError(str(e))
+        except Exception as e:
+            error_text = "Unexpected error: failed to fetch server's own invites"
+            log.error(error_text, exc_info=e)
+            raise ExecutionError(error_text)
+    else:
+        has_invite = False
+    return has_invite is params.value
+
+
+@checker(Condition.MessageContainsMedia)
+async def message_contains_media(runtime: WDRuntime, params: models.IsBool):
+    message = runtime.message
+    has_media = MEDIA_URL_RE.search(message.content)
+    return bool(has_media) is params.value
+
+
+@checker(Condition.MessageContainsUrl)
+async def message_contains_url(runtime: WDRuntime, params: models.IsBool):
+    message = runtime.message
+    has_url = URL_RE.search(message.content)
+    return bool(has_url) is params.value
+
+
+@checker(Condition.MessageContainsMTMentions)
+async def message_contains_mt_mentions(runtime: WDRuntime, params: models.IsInt):
+    message = runtime.message
+    return len(message.raw_mentions) > params.value
+
+
+@checker(Condition.MessageContainsMTUniqueMentions)
+async def message_contains_mt_unique_mentions(runtime: WDRuntime, params: models.IsInt):
+    message = runtime.message
+    return len(set(message.mentions)) > params.value
+
+
+@checker(Condition.MessageContainsMTRolePings)
+async def message_contains_mt_role_pings(runtime: WDRuntime, params: models.IsInt):
+    message = runtime.message
+    return len(message.role_mentions) > params.value
+
+
+@checker(Condition.MessageContainsMTEmojis)
+async def message_contains_mt_emojis(runtime: WDRuntime, params: models.IsInt):
+    cog = runtime.cog
+    guild = runtime.guild
+    message = runtime.message
+    over_limit = has_x_or_more_emojis(cog.bot, guild, message.content, params.value + 1)
+    return over_limit
+
+
+@checker(Condition.MessageHasMTCharacters)
+async def message_has_mt_characters(runtime: WDRuntime, params: models.IsInt):
+    # We're turning one custom emoji code into a single character to avoid
+    # unexpected (from a user's POV) behaviour
+    message = runtime.message
+    clean_content = REMOVE_C_EMOJIS_RE.sub("x", message.clean_content)
+    return len(clean_content) > params.value
+
+
+@checker(Condition.IsStaff)
+async def is_staff(runtime: WDRuntime, params: models.IsBool):
+    cog = runtime.cog
+    user = runtime.user
+    is_staff = await memo.is_mod(cog.bot, user)
+    return is_staff is params.value
+
+
+@checker(Condition.IsHelper)
+async def is_helper(runtime: WDRuntime, params: models.IsBool):
+    cog = runtime.cog
+    user = runtime.user
+    is_helper = await cog.is_helper(user)
+    return is_helper is params.value
+
+
+@checker(Condition.UserHeatIs)
+async def user_heat_is(runtime: WDRuntime, params: models.IsInt):
+    user = runtime.user
+    debug = runtime.debug
+    return heat.get_user_heat(user, debug=debug) == params.value
+
+
+@checker(Condition.ChannelHeatIs)
+async def channel_heat_is(runtime: WDRuntime, params: models.IsInt):
+    channel = runtime.channel
+    debug = runtime.debug
+    return heat.get_channel_heat(channel, debug=debug) == params.value
+
+
+@checker(Condition.CustomHeatIs)
+async def custom_heat_is(runtime: WDRuntime, params: models.CheckCustomHeatpoint):
+    guild = runtime.guild
+    debug = runtime.debug
+    heat_key = Template(params.label).safe_substitute(runtime.state)
+    return heat.get_custom_heat(guild, heat_key, debug=debug) == params.points
+
+
+@checker(Condition.UserHeatMoreThan)
+async def user_heat_more_than(runtime: WDRuntime, params: models.IsInt):
+    user = runtime.user
+    debug = runtime.debug
+    return heat.get_user_heat(user, debug=debug) > params.value
+
+
+@checker(Condition.ChannelHeatMoreThan)
+async def channel_heat_more_than(runtime: WDRuntime, params: models.IsInt):
+    channel = runtime.channel
+    debug = runtime.debug
+    return heat.get_channel_heat(channel, debug=debug) > params.value
+
+
+@checker(Condition.CustomHeatMoreThan)
+async def custom_heat_more_than(runtime: WDRuntime, params: models.CheckCustomHeatpoint):
+    guild = runtime.guild
+    debug = runtime.debug
+    heat_key = Template(params.label).safe_substitute(runtime.state)
+    return heat.get_custom_heat(guild, heat_key, debug=debug) > params.points
+
+
+@checker(Condition.Compare)
+async def compare(runtime: WDRuntime, params: models.Compare):
+    value1 = runtime.safe_sub(params.value1)
+    value2 = runtime.safe_sub(params.value2)
+
+    if params.operator == "==":
+        return value1 == value2
+    elif params.operator == "contains":
+        return value2 in value1
+    elif params.operator == "contains-pattern":
+        return fnmatch.fnmatch(value1.lower(), value2.lower())
+    elif params.operator == "!=":
+        return value1 != value2
+
+    # Numeric operators
+    try:
+        value1, value2 = int(value1), int(value2)
+    except ValueError:
+        raise ExecutionError(f"Could not compare {value1} with {value2}: they both need to be numbers!")
+
+    if params.operator == ">":
+        return value1 > value2
+    elif params.operator == "<":
+        return value1 < value2
+    elif params.operator == "<=":
+        return value1 <= value2
+    elif params.operator == ">=":
+        return value1 >= value2
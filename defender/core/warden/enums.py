@@ -96,6 +96,7 @@ class Condition(enum.Enum):
     UserStatusMatchesAny = "user-status-matches-any"
     UserHasDefaultAvatar = "user-has-default-avatar"
     UserHasSentLessThanMessages = "user-has-sent-less-than-messages"
+    UserMessageRateMoreThan = "user-message-rate-more-than"
     ChannelMatchesAny = "channel-matches-any"
     CategoryMatchesAny = "category-matches-any"
     ChannelIsPublic = "channel-is-public"
@@ -18,11 +18,19 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import discord
 import logging
 import asyncio
-from ...core.utils import utcnow
+import heapq
+import itertools
+import sqlite3
+import struct
+import threading
+import time
+import os
 from copy import deepcopy
 from datetime import timedelta
-from collections import defaultdict, deque
-from typing import Union
+from collections import defaultdict
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, List, Optional, Union
 
 """
 This system is meant to enhance Warden in a way that allows to track (and act on) recurring events
@@ -32,160 +40,684 @@ This system works by attaching "heat" points to members (or even channels) that
 amount of time and are shared between different Warden rules.
 """
 
+# This value is overriden at runtime with the owner's settings
 MAX_HEATPOINTS = 100
 log = logging.getLogger("red.x26cogs.defender")
 
 _guild_heat = {"channels": {}, "users": {}, "custom": {}}
 _heat_store = defaultdict(lambda: deepcopy(_guild_heat))
 _sandbox_heat_store = defaultdict(lambda: deepcopy(_guild_heat))
+# Min-heap of (monotonic time, tiebreaker, HeatLevel): when to check a heat level for removal
+# Each heat level has at most one entry, pushed back if it got more heat in the meantime
+_expiry_queue = []
+_expiry_counter = itertools.count()
+EXPIRY_TICK_BUDGET = 1000  # Heat levels to check per tick, the rest waits for the next one
 
 
 class HeatLevel:
-    __slots__ = ("guild", "id", "type", "_heat_points")
+    __slots__ = ("guild", "id", "type", "debug", "_heat_points", "_total", "_last_expiry", "_scheduled")
 
-    def __init__(self, guild: int, _id: Union[str, int], _type: str):
+    def __init__(self, guild: int, _id: Union[str, int], _type: str, debug=False):
         self.guild = guild
         self.id = _id
         self.type = _type
-        self._heat_points = deque(maxlen=MAX_HEATPOINTS)
-
-    def increase_heat(self, td: timedelta):
-        ts = utcnow()
-        ts += td
-        self._heat_points.append(ts)
+        self.debug = debug
+        # Min-heap of (monotonic clock expiry, points): the next ones to expire are always first
+        self._heat_points = []
+        self._total = 0
+        self._last_expiry = 0.0
+        self._scheduled = False
+
+    def increase_heat(self, td: timedelta, points: int = 1):
+        self._add(time.monotonic() + td.total_seconds(), points)
+
+    def _add(self, expiry: float, points: int):
+        heapq.heappush(self._heat_points, (expiry, points))
+        self._total += points
+        if expiry > self._last_expiry:
+            self._last_expiry = expiry
+        if not self._scheduled:
+            _schedule(self, expiry)
+        excess = self._total - MAX_HEATPOINTS
+        # Over the cap: the heatpoints closest to expiring make room
+        while excess > 0:
+            expiry, weight = self._heat_points[0]
+            if weight <= excess:
+                heapq.heappop(self._heat_points)
+                self._total -= weight
+                excess -= weight
+            else:
+                heapq.heapreplace(self._heat_points, (expiry, weight - excess))
+                self._total -= excess
+                excess = 0
 
     def _expire_heat(self):
-        now = utcnow()
-        self._heat_points = deque([h for h in self._heat_points if h > now], maxlen=MAX_HEATPOINTS)
+        heat_points = self._heat_points
+        if not heat_points:
+            return
+        now = time.monotonic()
+        while heat_points and heat_points[0][0] <= now:
+            self._total -= heapq.heappop(heat_points)[1]
 
     def __len__(self):
         self._expire_heat()
-        q = len(self._heat_points)
+        q = self._total
         if q == 0:
             discard_heatlevel(self)
         return q
 
     def __repr__(self):
-        return f"<HeatLevel: {len(self._heat_points)}>"
+        return f"<HeatLevel: {self._total}>"
 
 
-def get_heat_store(guild_id, debug=False):
-    if debug is False:
-        return _heat_store[guild_id]
-    else:
-        return _sandbox_heat_store[guild_id]
+class HeatBackend(ABC):
+    """
+    Where the production heat levels are kept. A heat level is identified by its guild ID,
+    its type ("users", "channels" or "custom") and the ID or key it's about
+    """
+
+    # Whether the heat survives restarts by itself, without snapshots
+    persistent = False
+    # Set when the backend can't be used anymore, the memory backend takes over
+    failed = False
+
+    @abstractmethod
+    def get_heat(self, guild_id: int, _type: str, _id: Union[str, int]) -> int:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def increase_heat(self, guild_id: int, _type: str, _id: Union[str, int], td: timedelta, points: int):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def empty_heat(self, guild_id: int, _type: str, _id: Union[str, int]):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_state(self, guild_id: int) -> Dict[str, Dict[Union[str, int], int]]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def empty_state(self, guild_id: int):
+        raise NotImplementedError()
+
+    def discard_expired(self):
+        """Called every second by the expiry ticker"""
+
+    def close(self):
+        pass
+
+
+class MemoryHeatBackend(HeatBackend):
+    """The heat levels are kept in this process' memory. Also used for the sandbox"""
+
+    def __init__(self, store: dict, debug=False):
+        self.store = store
+        self.debug = debug
+
+    def get_heat(self, guild_id, _type, _id):
+        heatlevel = self.store[guild_id][_type].get(_id)
+        if heatlevel:
+            return len(heatlevel)
+        else:
+            return 0
+
+    def increase_heat(self, guild_id, _type, _id, td, points):
+        heatlevels = self.store[guild_id][_type]
+        heatlevel = heatlevels.get(_id)
+        if not heatlevel:
+            heatlevel = heatlevels[_id] = HeatLevel(guild_id, _id, _type, self.debug)
+        heatlevel.increase_heat(td, points)
+
+    def empty_heat(self, guild_id, _type, _id):
+        heatlevel = self.store[guild_id][_type].get(_id)
+        if heatlevel:
+            discard_heatlevel(heatlevel)
+
+    def get_state(self, guild_id):
+        state = {}
+        for _type, heatlevels in self.store[guild_id].items():
+            state[_type] = {}
+            for _id, heatlevel in list(heatlevels.items()):
+                q = len(heatlevel)
+                if q:
+                    state[_type][_id] = q
+        return state
+
+    def empty_state(self, guild_id):
+        self.store.pop(guild_id, None)
+
+
+class SQLiteHeatBackend(HeatBackend):
+    """
+    The heat levels are kept in an SQLite database in WAL mode, which several bot processes
+    can share. The database is only ever touched by a writer thread: new heatpoints are
+    buffered and committed on every tick, or sooner once SQLITE_WRITE_BATCH of them are
+    waiting. The writer keeps the live rows in memory and on every tick only reads back
+    what's new: the rows added since the last tick and the heat levels emptied by any
+    process, which are logged in heat_empties. Reads are served from the totals it keeps.
+    Heat from the other processes can show up to a second late
+    """
+
+    persistent = True
+
+    def __init__(self, path: Path):
+        self.conn = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+        # A locked database must not stall the writer for long, the rows are simply retried on the next tick
+        self.conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # The sequences only ever grow, which is how each process finds what's new since its last tick
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS heat (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "guild INTEGER, type INTEGER, id TEXT, expiry REAL, points INTEGER)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS heat_level ON heat (guild, type, id, expiry)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS heat_expiry ON heat (expiry)")
+        # A NULL type empties the whole guild. Only the rows up to until_seq were emptied
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS heat_empties (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "guild INTEGER, type INTEGER, id TEXT, until_seq INTEGER, at REAL)"
+        )
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+        self._wakeup = threading.Event()
+        # Rows waiting to be committed, also kept by heat level so that reads can count them
+        self._pending = []
+        self._pending_points = defaultdict(list)
+        # Rows the writer is committing right now
+        self._committing_points = {}
+        # Heat levels and guilds to delete. Until that's done their committed heat is ignored
+        self._deletes = []
+        self._emptied = defaultdict(int)
+        self._emptied_guilds = defaultdict(int)
+        # Guild ID -> (type, ID) -> committed heat, published by the writer after each commit
+        self._committed = {}
+        # Only used by the writer: guild ID -> (type, ID) -> seq -> (expiry, points) of the live
+        # rows, their totals, and their expiries in a heap
+        self._rows = {}
+        self._totals = {}
+        self._expiries = []
+        self._last_seq = 0
+        self._last_empty_seq = None
+        self._requested = 0
+        self._done = 0
+        self._failures = 0
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="defender-heat-writer", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _key(guild_id, _type, _id):
+        return (guild_id, _HEAT_TYPES.index(_type), str(_id))
+
+    def _uncommitted(self, key, now):
+        q = 0
+        for points_by_key in (self._pending_points, self._committing_points):
+            pending = points_by_key.get(key)
+            if pending:
+                q += sum(points for expiry, points in pending if expiry > now)
+        return q
+
+    def get_heat(self, guild_id, _type, _id):
+        key = self._key(guild_id, _type, _id)
+        now = time.time()
+        with self._lock:
+            q = self._uncommitted(key, now)
+            if key not in self._emptied and guild_id not in self._emptied_guilds:
+                q += self._committed.get(guild_id, {}).get(key[1:], 0)
+        # The cap is applied on read: with several writers there's no single heap to trim
+        return min(q, MAX_HEATPOINTS)
+
+    def increase_heat(self, guild_id, _type, _id, td, points):
+        key = self._key(guild_id, _type, _id)
+        expiry = time.time() + td.total_seconds()
+        with self._lock:
+            self._pending.append((*key, expiry, points))
+            self._pending_points[key].append((expiry, points))
+            if len(self._pending) >= SQLITE_WRITE_BATCH:
+                self._wakeup.set()
+
+    def empty_heat(self, guild_id, _type, _id):
+        key = self._key(guild_id, _type, _id)
+        with self._lock:
+            # What's being committed right now is deleted right after, along with the older rows
+            if self._pending_points.pop(key, None):
+                self._pending = [row for row in self._pending if row[:3] != key]
+            self._committing_points.pop(key, None)
+            self._deletes.append(key)
+            self._emptied[key] += 1
+
+    def get_state(self, guild_id):
+        state = {_type: {} for _type in _HEAT_TYPES}
+        now = time.time()
+        with self._lock:
+            committed = {} if guild_id in self._emptied_guilds else self._committed.get(guild_id, {})
+            keys = {(guild_id, type_n, _id) for type_n, _id in committed}
+            for points_by_key in (self._pending_points, self._committing_points):
+                keys.update(key for key in points_by_key if key[0] == guild_id)
+            levels = {}
+            for key in keys:
+                q = self._uncommitted(key, now)
+                if key not in self._emptied:
+                    q += committed.get(key[1:], 0)
+                levels[key[1:]] = q
+        for (type_n, _id), q in levels.items():
+            if q:
+                _type = _HEAT_TYPES[type_n]
+                state[_type][_id if _type == "custom" else int(_id)] = min(q, MAX_HEATPOINTS)
+        return state
+
+    def empty_state(self, guild_id):
+        with self._lock:
+            self._pending = [row for row in self._pending if row[0] != guild_id]
+            for points_by_key in (self._pending_points, self._committing_points):
+                for key in [key for key in points_by_key if key[0] == guild_id]:
+                    del points_by_key[key]
+            self._deletes.append(guild_id)
+            self._emptied_guilds[guild_id] += 1
+
+    def discard_expired(self):
+        self._wakeup.set()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Has the writer commit what's pending and waits for it. Meant for tests and benchmarks"""
+        with self._lock:
+            self._requested += 1
+            request = self._requested
+            self._wakeup.set()
+            return self._synced.wait_for(lambda: self._done >= request or not self._thread.is_alive(), timeout)
+
+    def close(self):
+        with self._lock:
+            self._closing = True
+            self._wakeup.set()
+        self._thread.join(SQLITE_CLOSE_TIMEOUT)
+        if self._thread.is_alive():
+            log.error("Warden - the heat database is busy, the last heatpoints could not be committed")
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            with self._lock:
+                closing = self._closing
+            self._sync()
+            if closing or self.failed:
+                break
+        try:
+            self.conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _sync(self):
+        with self._lock:
+            rows, self._pending = self._pending, []
+            self._committing_points, self._pending_points = self._pending_points, defaultdict(list)
+            deletes, self._deletes = self._deletes, []
+            request = self._requested
+        try:
+            changes = self._apply(*self._write(rows, deletes))
+        except sqlite3.Error as e:
+            with self._lock:
+                # Nothing was committed, everything is retried on the next tick
+                self._pending = rows + self._pending
+                for key, points in self._committing_points.items():
+                    self._pending_points[key] = points + self._pending_points.get(key, [])
+                self._committing_points = {}
+                self._deletes = deletes + self._deletes
+                self._failures += 1
+                if self._failures >= SQLITE_MAX_FAILURES:
+                    self.failed = True
+                self._done = request
+                self._synced.notify_all()
+            log.error("Warden - error while syncing the shared heat database", exc_info=e)
+            return
+        with self._lock:
+            if changes is None:
+                self._committed = {guild_id: dict(totals) for guild_id, totals in self._totals.items()}
+            else:
+                for (guild_id, level), q in changes.items():
+                    if q:
+                        self._committed.setdefault(guild_id, {})[level] = q
+                    elif level in self._committed.get(guild_id, ()):
+                        del self._committed[guild_id][level]
+                        if not self._committed[guild_id]:
+                            del self._committed[guild_id]
+            self._committing_points = {}
+            for delete in deletes:
+                emptied = self._emptied if isinstance(delete, tuple) else self._emptied_guilds
+                emptied[delete] -= 1
+                if not emptied[delete]:
+                    del emptied[delete]
+            self._failures = 0
+            self._done = request
+            self._synced.notify_all()
+
+    def _write(self, rows, deletes):
+        """Commits the batch, returns what changed in the database since the last tick"""
+        conn = self.conn
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for delete in deletes:
+                until_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM heat").fetchone()[0]
+                if isinstance(delete, tuple):
+                    conn.execute("DELETE FROM heat WHERE guild = ? AND type = ? AND id = ?", delete)
+                else:
+                    conn.execute("DELETE FROM heat WHERE guild = ?", (delete,))
+                    delete = (delete, None, None)
+                conn.execute(
+                    "INSERT INTO heat_empties (guild, type, id, until_seq, at) VALUES (?, ?, ?, ?, ?)",
+                    (*delete, until_seq, now),
+                )
+            conn.executemany("INSERT INTO heat (guild, type, id, expiry, points) VALUES (?, ?, ?, ?, ?)", rows)
+            conn.execute("DELETE FROM heat WHERE expiry <= ?", (now,))
+            conn.execute("DELETE FROM heat_empties WHERE at <= ?", (now - SQLITE_EMPTIES_TTL,))
+            # Everything is read again on the first tick, or if we've been away long enough
+            # to miss heat levels being emptied
+            oldest_empty = conn.execute("SELECT MIN(seq) FROM heat_empties").fetchone()[0]
+            last_empty = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'heat_empties'").fetchone()
+            last_empty = last_empty[0] if last_empty else 0
+            full = self._last_empty_seq is None or (
+                last_empty > self._last_empty_seq and (oldest_empty or last_empty + 1) > self._last_empty_seq + 1
+            )
+            since = 0 if full else self._last_seq
+            new_rows = conn.execute(
+                "SELECT seq, guild, type, id, expiry, points FROM heat WHERE seq > ?", (since,)
+            ).fetchall()
+            empties = []
+            if not full:
+                empties = conn.execute(
+                    "SELECT guild, type, id, until_seq FROM heat_empties WHERE seq > ? ORDER BY seq",
+                    (self._last_empty_seq,),
+                ).fetchall()
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        self._last_empty_seq = last_empty
+        return now, full, new_rows, empties
+
+    def _apply(self, now, full, new_rows, empties):
+        """
+        Brings the writer's rows and totals up to date. Returns the new totals of the
+        heat levels that changed, or None if everything was read again
+        """
+        if full:
+            self._rows, self._totals, self._expiries = {}, {}, []
+        changed = set()
+        for guild_id, type_n, _id, until_seq in empties:
+            guild_rows = self._rows.get(guild_id, {})
+            levels = list(guild_rows) if type_n is None else [(type_n, _id)]
+            for level in levels:
+                rows = guild_rows.get(level)
+                if rows:
+                    for seq in [seq for seq in rows if seq <= until_seq]:
+                        self._remove_row(guild_id, level, seq)
+                    changed.add((guild_id, level))
+        for seq, guild_id, type_n, _id, expiry, points in new_rows:
+            self._last_seq = max(self._last_seq, seq)
+            level = (type_n, _id)
+            self._rows.setdefault(guild_id, {}).setdefault(level, {})[seq] = (expiry, points)
+            totals = self._totals.setdefault(guild_id, {})
+            totals[level] = totals.get(level, 0) + points
+            heapq.heappush(self._expiries, (expiry, seq, guild_id, level))
+            changed.add((guild_id, level))
+        while self._expiries and self._expiries[0][0] <= now:
+            expiry, seq, guild_id, level = heapq.heappop(self._expiries)
+            # Could have been emptied already
+            if seq in self._rows.get(guild_id, {}).get(level, ()):
+                self._remove_row(guild_id, level, seq)
+                changed.add((guild_id, level))
+        if full:
+            return None
+        return {(guild_id, level): self._totals.get(guild_id, {}).get(level, 0) for guild_id, level in changed}
+
+    def _remove_row(self, guild_id, level, seq):
+        guild_rows = self._rows[guild_id]
+        expiry, points = guild_rows[level].pop(seq)
+        totals = self._totals[guild_id]
+        totals[level] -= points
+        if not guild_rows[level]:
+            del guild_rows[level]
+            del totals[level]
+            if not guild_rows:
+                del self._rows[guild_id]
+                del self._totals[guild_id]
+
+
+_HEAT_TYPES = ("users", "channels", "custom")
+SQLITE_WRITE_BATCH = 500  # Pending heatpoints that wake up the writer before the next tick
+SQLITE_BUSY_TIMEOUT = 250  # ms
+SQLITE_MAX_FAILURES = 10  # Failed syncs in a row before falling back to memory
+SQLITE_CLOSE_TIMEOUT = 5  # s
+SQLITE_EMPTIES_TTL = 300  # s, how long the emptied heat levels are logged for the other processes
+_memory_backend = MemoryHeatBackend(_heat_store)
+_sandbox_backend = MemoryHeatBackend(_sandbox_heat_store, debug=True)
+_backend: HeatBackend = _memory_backend
+
+
+def get_backend(debug=False) -> HeatBackend:
+    if debug:
+        return _sandbox_backend
+    if _backend.failed:
+        log.error("Warden - the heat database keeps failing, heat will be kept in memory until the next restart")
+        set_backend(None)
+    return _backend
+
+
+def set_backend(backend: Optional[HeatBackend]):
+    """Swaps the production backend, None goes back to memory. Heat is not carried over"""
+    global _backend
+    old_backend = _backend
+    _backend = backend or _memory_backend
+    if old_backend is not _backend:
+        old_backend.close()
 
 
 def get_user_heat(user: discord.Member, *, debug=False):
-    heat = get_heat_store(user.guild.id, debug)["users"].get(user.id)
-    if heat:
-        return len(heat)
-    else:
-        return 0
+    return get_backend(debug).get_heat(user.guild.id, "users", user.id)
 
 
 def get_channel_heat(channel: discord.TextChannel, *, debug=False):
-    heat = get_heat_store(channel.guild.id, debug)["channels"].get(channel.id)
-    if heat:
-        return len(heat)
-    else:
-        return 0
+    return get_backend(debug).get_heat(channel.guild.id, "channels", channel.id)
 
 
 def get_custom_heat(guild: discord.Guild, key: str, *, debug=False):
-    key = key.lower()
-    heat = get_heat_store(guild.id, debug)["custom"].get(key)
-    if heat:
-        return len(heat)
-    else:
-        return 0
+    return get_backend(debug).get_heat(guild.id, "custom", key.lower())
 
 
 def empty_user_heat(user: discord.Member, *, debug=False):
-    heat = get_heat_store(user.guild.id, debug)["users"].get(user.id)
-    if heat:
-        discard_heatlevel(heat, debug=debug)
+    get_backend(debug).empty_heat(user.guild.id, "users", user.id)
 
 
 def empty_channel_heat(channel: discord.TextChannel, *, debug=False):
-    heat = get_heat_store(channel.guild.id, debug)["channels"].get(channel.id)
-    if heat:
-        discard_heatlevel(heat, debug=debug)
+    get_backend(debug).empty_heat(channel.guild.id, "channels", channel.id)
 
 
 def empty_custom_heat(guild: discord.Guild, key: str, *, debug=False):
-    key = key.lower()
-    heat = get_heat_store(guild.id, debug)["custom"].get(key)
-    if heat:
-        discard_heatlevel(heat, debug=debug)
+    get_backend(debug).empty_heat(guild.id, "custom", key.lower())
 
 
-def increase_user_heat(user: discord.Member, td: timedelta, *, debug=False):
-    heat = get_heat_store(user.guild.id, debug)["users"].get(user.id)
-    if heat:
-        heat.increase_heat(td)
-    else:
-        get_heat_store(user.guild.id, debug)["users"][user.id] = HeatLevel(user.guild.id, user.id, "users")
-        get_heat_store(user.guild.id, debug)["users"][user.id].increase_heat(td)
+def increase_user_heat(user: discord.Member, td: timedelta, points: int = 1, *, debug=False):
+    get_backend(debug).increase_heat(user.guild.id, "users", user.id, td, points)
 
 
-def increase_channel_heat(channel: discord.TextChannel, td: timedelta, *, debug=False):
-    heat = get_heat_store(channel.guild.id, debug)["channels"].get(channel.id)
-    if heat:
-        heat.increase_heat(td)
-    else:
-        get_heat_store(channel.guild.id, debug)["channels"][channel.id] = HeatLevel(
-            channel.guild.id, channel.id, "channels"
-        )
-        get_heat_store(channel.guild.id, debug)["channels"][channel.id].increase_heat(td)
+def increase_channel_heat(channel: discord.TextChannel, td: timedelta, points: int = 1, *, debug=False):
+    get_backend(debug).increase_heat(channel.guild.id, "channels", channel.id, td, points)
 
 
-def increase_custom_heat(guild: discord.Guild, key: str, td: timedelta, *, debug=False):
-    key = key.lower()
-    heat = get_heat_store(guild.id, debug)["custom"].get(key)
-    if heat:
-        heat.increase_heat(td)
-    else:
-        get_heat_store(guild.id, debug)["custom"][key] = HeatLevel(guild.id, key, "custom")
-        get_heat_store(guild.id, debug)["custom"][key].increase_heat(td)
+def increase_custom_heat(guild: discord.Guild, key: str, td: timedelta, points: int = 1, *, debug=False):
+    get_backend(debug).increase_heat(guild.id, "custom", key.lower(), td, points)
 
 
-def discard_heatlevel(heatlevel: HeatLevel, *, debug=False):
-    try:
-        del get_heat_store(heatlevel.guild, debug)[heatlevel.type][heatlevel.id]
-    except Exception as e:
-        pass
+def discard_heatlevel(heatlevel: HeatLevel):
+    store = (_sandbox_heat_store if heatlevel.debug else _heat_store).get(heatlevel.guild)
+    # It could have been emptied and replaced by a new one in the meantime
+    if store is not None and store[heatlevel.type].get(heatlevel.id) is heatlevel:
+        del store[heatlevel.type][heatlevel.id]
 
 
-async def remove_stale_heat():
-    # In case you're wondering wtf am I doing here:
-    # I'm calling len on each HeatLevel object to trigger
-    # its auto removal logic, so they don't linger indefinitely
-    # in the cache after the heatpoints are expired and the user is long gone
-    for store in (_heat_store, _sandbox_heat_store):
-        for c in store.values():
-            for cc in c.values():
-                for heat_level in list(cc.values()):
-                    len(heat_level)
-            await asyncio.sleep(0)
+def _schedule(heatlevel: HeatLevel, when: float):
+    heatlevel._scheduled = True
+    heapq.heappush(_expiry_queue, (when, next(_expiry_counter), heatlevel))
+
+
+def discard_expired_heat():
+    """
+    Removes the heat levels whose heatpoints have all expired. It only looks at
+    the ones that are due, up to EXPIRY_TICK_BUDGET of them
+    """
+    now = time.monotonic()
+    checked = 0
+    while _expiry_queue and _expiry_queue[0][0] <= now and checked < EXPIRY_TICK_BUDGET:
+        heatlevel = heapq.heappop(_expiry_queue)[2]
+        heatlevel._scheduled = False
+        checked += 1
+        if heatlevel._last_expiry > now:
+            _schedule(heatlevel, heatlevel._last_expiry)
+        else:
+            discard_heatlevel(heatlevel)
+    get_backend().discard_expired()
 
 
 def get_state(guild, debug=False):
-    if not debug:
-        return _heat_store[guild.id].copy()
-    else:
-        return _sandbox_heat_store[guild.id].copy()
+    """Heat levels of the guild and their heat, by type"""
+    return get_backend(debug).get_state(guild.id)
 
 
 def empty_state(guild, debug=False):
-    try:
-        if not debug:
-            del _heat_store[guild.id]
-        else:
-            del _sandbox_heat_store[guild.id]
-    except KeyError:
-        pass
+    get_backend(debug).empty_state(guild.id)
 
 
 def get_custom_heat_keys(guild: discord.Guild):
-    return list(_heat_store[guild.id]["custom"].keys())
+    return list(_backend.get_state(guild.id)["custom"].keys())
+
+
+# Snapshot file layout, all integers little endian:
+# magic | per guild: guild ID, heat levels
+#       | per heat level: type, heatpoints entries, ID (a string for custom heat)
+#       | per entry: expiry as unix time, points
+# The sandbox store is never saved
+SNAPSHOT_MAGIC = b"DFHT1"
+_guild_header = struct.Struct("<QI")
+_level_header = struct.Struct("<BI")
+_level_id = struct.Struct("<Q")
+_entry = struct.Struct("<dI")
+_str_header = struct.Struct("<I")
+_snapshot_generation = 0
+
+
+def _snapshot_guild(guild_id: int, guild_heat) -> bytes:
+    # Monotonic time doesn't survive a restart, expiries are saved as wall clock time
+    now = time.monotonic()
+    offset = time.time() - now
+    rows = []
+    n_levels = 0
+    for type_n, _type in enumerate(_HEAT_TYPES):
+        for heatlevel in list(guild_heat[_type].values()):
+            heatlevel._expire_heat()
+            if not heatlevel._total:
+                continue
+            rows.append(_level_header.pack(type_n, len(heatlevel._heat_points)))
+            if _type == "custom":
+                key = heatlevel.id.encode("utf-8", "surrogatepass")
+                rows.append(_str_header.pack(len(key)))
+                rows.append(key)
+            else:
+                rows.append(_level_id.pack(heatlevel.id))
+            for expiry, points in heatlevel._heat_points:
+                rows.append(_entry.pack(expiry + offset, points))
+            n_levels += 1
+    return _guild_header.pack(guild_id, n_levels) + b"".join(rows)
+
+
+def _write_snapshot(path: Path, chunks: List[bytes], generation: int):
+    tmp = path.with_name(f"{path.name}.{generation}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        for chunk in chunks:
+            f.write(chunk)
+    # A newer snapshot could have been written while we were busy
+    if generation == _snapshot_generation:
+        os.replace(tmp, path)
+    else:
+        os.remove(tmp)
+
+
+async def save_snapshot(path: Path):
+    """Serializes the heat store a guild at a time, the file is written in a thread"""
+    global _snapshot_generation
+    _snapshot_generation += 1
+    generation = _snapshot_generation
+    chunks = []
+    for guild_id, guild_heat in list(_heat_store.items()):
+        chunks.append(_snapshot_guild(guild_id, guild_heat))
+        await asyncio.sleep(0)
+    await asyncio.to_thread(_write_snapshot, path, chunks, generation)
+
+
+def save_snapshot_sync(path: Path):
+    """For cog unload, where we can't wait on anything"""
+    global _snapshot_generation
+    _snapshot_generation += 1
+    chunks = [_snapshot_guild(guild_id, guild_heat) for guild_id, guild_heat in list(_heat_store.items())]
+    _write_snapshot(path, chunks, _snapshot_generation)
+
+
+async def load_snapshot(path: Path):
+    """
+    Restores the heat store, dropping the heatpoints that have expired in the meantime.
+    Heat gained since the restart is kept and counts towards the cap
+    """
+    try:
+        data = await asyncio.to_thread(path.read_bytes)
+    except FileNotFoundError:
+        return
+    if not data.startswith(SNAPSHOT_MAGIC):
+        log.warning("Ignoring the heat snapshot: unknown format")
+        return
+
+    now = time.monotonic()
+    offset = time.time() - now
+    restored = 0
+    pos = len(SNAPSHOT_MAGIC)
+    try:
+        while pos < len(data):
+            guild_id, n_levels = _guild_header.unpack_from(data, pos)
+            pos += _guild_header.size
+            for _ in range(n_levels):
+                type_n, n_entries = _level_header.unpack_from(data, pos)
+                pos += _level_header.size
+                _type = _HEAT_TYPES[type_n]
+                if _type == "custom":
+                    (length,) = _str_header.unpack_from(data, pos)
+                    pos += _str_header.size
+                    _id = data[pos : pos + length].decode("utf-8", "surrogatepass")
+                    pos += length
+                else:
+                    (_id,) = _level_id.unpack_from(data, pos)
+                    pos += _level_id.size
+                entries = []
+                for _ in range(n_entries):
+                    expiry, points = _entry.unpack_from(data, pos)
+                    pos += _entry.size
+                    expiry -= offset
+                    if expiry > now:
+                        entries.append((expiry, points))
+                if not entries:
+                    continue
+                store = _heat_store[guild_id][_type]
+                heatlevel = store.get(_id)
+                if heatlevel is None:
+                    heatlevel = store[_id] = HeatLevel(guild_id, _id, _type)
+                for expiry, points in entries:
+                    heatlevel._add(expiry, points)
+                restored += 1
+            await asyncio.sleep(0)
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        log.error("The heat snapshot is corrupted, stopped restoring it", exc_info=e)
+
+    log.debug("Restored %s heat levels from the heat snapshot", restored)
@@ -0,0 +1,87 @@
+"""
+Defender - Protects your community with automod features and
+           empowers the staff and users you trust with
+           advanced moderation tools
+Copyright (C) 2020-present  Twentysix (https://github.com/Twentysix26/)
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from .enums import Condition
+from typing import Dict, Optional, Tuple
+import logging
+
+log = logging.getLogger("red.x26cogs.defender")
+
+# Results of the conditions that only depend on the state of a member, kept across events
+# so that they are not evaluated again on every message of a chatty user.
+# The listeners drop a member's results whenever their name, avatar or roles change.
+
+MEMBER_CONDITIONS = (
+    Condition.UsernameMatchesAny,
+    Condition.UsernameMatchesRegex,
+    Condition.NicknameMatchesAny,
+    Condition.NicknameMatchesRegex,
+    Condition.DisplayNameMatchesAny,
+    Condition.DisplayNameMatchesRegex,
+    Condition.UserCreatedLessThan,
+    Condition.UserHasDefaultAvatar,
+    Condition.UserHasAnyRoleIn,
+)
+# Accounts only get older: a negative result is final, a positive one isn't
+ONLY_NEGATIVE = (Condition.UserCreatedLessThan,)
+
+MAX_USERS = 50_000
+
+# User ID -> (guild ID, condition node) -> result
+_results: Dict[int, Dict[Tuple[int, object], bool]] = {}
+
+
+def get(guild_id: int, user_id: int, statement) -> Optional[bool]:
+    results = _results.get(user_id)
+    if results is None:
+        return None
+    return results.get((guild_id, statement))
+
+
+def store(guild_id: int, user_id: int, statement, result: bool):
+    if result is True and statement.enum in ONLY_NEGATIVE:
+        return
+    results = _results.get(user_id)
+    if results is None:
+        if len(_results) >= MAX_USERS:
+            # Make room by dropping the user that has been in here the longest
+            _results.pop(next(iter(_results)))
+        results = _results[user_id] = {}
+    results[(guild_id, statement)] = result
+
+
+def invalidate_member(guild_id: int, user_id: int):
+    results = _results.get(user_id)
+    if results is None:
+        return
+    for key in [k for k in results if k[0] == guild_id]:
+        del results[key]
+    if not results:
+        del _results[user_id]
+
+
+def invalidate_user(user_id: int):
+    _results.pop(user_id, None)
+
+
+def invalidate_guild(guild_id: int):
+    for user_id in list(_results):
+        invalidate_member(guild_id, user_id)
+
+
+def clear():
+    _results.clear()
@@ -0,0 +1,171 @@
+"""
+Defender - Protects your community with automod features and
+           empowers the staff and users you trust with
+           advanced moderation tools
+Copyright (C) 2020-present  Twentysix (https://github.com/Twentysix26/)
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from .enums import Condition
+from .validation import WildcardList
+from typing import Dict, FrozenSet, Iterable, Optional, Set, Tuple
+import logging
+import re
+
+log = logging.getLogger("red.x26cogs.defender")
+
+# Keyword prefilter: the literal parts of the keyword conditions of all the rules of a guild
+# are looked for in a message with a single scan. A rule with a top-level keyword condition
+# none of whose literals are in the message cannot pass, so it's not evaluated at all.
+
+KEYWORD_CONDITIONS = (Condition.MessageMatchesAny, Condition.MessageContainsWord)
+
+# Guild ID -> index of its active rules, built on first use after the rules change
+_indexes: Dict[int, "KeywordIndex"] = {}
+
+
+def longest_literal(pattern: str) -> str:
+    """The longest run of plain characters of a wildcard pattern"""
+    fragments = []
+    current = ""
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c in "*?":
+            fragments.append(current)
+            current = ""
+        elif c == "[":
+            j = i
+            if j < n and pattern[j] == "!":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+            if j >= n:  # Unclosed, fnmatch treats it as a plain [
+                current += c
+            else:
+                fragments.append(current)
+                current = ""
+                i = j + 1
+        else:
+            current += c
+    fragments.append(current)
+    return max(fragments, key=len)
+
+
+def rule_keywords(cond_tree: dict) -> Tuple[FrozenSet[str], ...]:
+    """
+    One group for each top-level keyword condition of a rule: at least one literal of
+    each group has to be in the message for the rule to pass. Conditions with a pattern
+    without literals (such as "*") could match anything and don't make a group
+    """
+    groups = []
+    for statement, model in cond_tree.items():
+        if getattr(statement, "enum", None) not in KEYWORD_CONDITIONS or not isinstance(model, WildcardList):
+            continue
+        literals = frozenset(longest_literal(p.lower()) for p in model.value)
+        if "" not in literals:
+            groups.append(literals)
+    return tuple(groups)
+
+
+def _trie_regex(literals: Iterable[str]) -> str:
+    """
+    An alternation of the literals grouped by common prefixes, which the regex engine can go through
+    without trying every literal at every position. It matches the longest literal it can
+    """
+    trie = {}
+    for literal in literals:
+        node = trie
+        for c in literal:
+            node = node.setdefault(c, {})
+        node[""] = None
+
+    def to_regex(node):
+        terminal = "" in node
+        branches = [re.escape(c) + to_regex(child) for c, child in sorted(node.items()) if c]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if terminal:
+            return body + "?" if len(branches) == 1 and len(body) == 1 else f"(?:{body})?"
+        return body
+
+    return to_regex(trie)
+
+
+class KeywordIndex:
+    __slots__ = ("rules", "regex", "contained")
+
+    def __init__(self, rules: Iterable):
+        self.rules = set(rules)
+        literals = set()
+        for rule in self.rules:
+            for group in rule.keywords:
+                literals.update(group)
+        self.regex = None
+        # At each position only the longest literal that starts there is reported, so every literal
+        # also stands for the ones it contains. Shorter literals are done first, so that a literal
+        # can reuse what was found for the ones inside of it
+        self.contained = {}
+        if literals:
+            self.regex = re.compile(f"(?=({_trie_regex(literals)}))", re.DOTALL)
+        for literal in sorted(literals, key=len):
+            contained = {literal}
+            # The literals starting past the first character, then the longest of those that are its prefixes
+            matches = list(self.regex.finditer(literal, 1))
+            matches.append(self.regex.match(literal[:-1]))
+            for m in filter(None, matches):
+                contained.update(self.contained[m.group(1)])
+            self.contained[literal] = frozenset(contained)
+
+    def scan(self, text: str) -> Set[str]:
+        """The literals that are in the (lowercase) text"""
+        found = set()
+        if self.regex is None:
+            return found
+        contained = self.contained
+        for m in self.regex.finditer(text):
+            found.update(contained[m.group(1)])
+        return found
+
+
+def get_index(guild_id: int, rules: Optional[Iterable] = None) -> Optional[KeywordIndex]:
+    index = _indexes.get(guild_id)
+    if index is None and rules is not None:
+        index = _indexes[guild_id] = KeywordIndex(rules)
+    return index
+
+
+def invalidate(guild_id: Optional[int] = None):
+    if guild_id is None:
+        _indexes.clear()
+    else:
+        _indexes.pop(guild_id, None)
+
+
+def may_pass(rule, ctx) -> bool:
+    """False only when the message cannot satisfy one of the rule's top-level keyword conditions"""
+    if not rule.keywords or ctx.message is None or ctx.debug:
+        return True
+    if ctx.keywords is None:
+        rules = ctx.cog.active_warden_rules.get(ctx.guild.id, {}).values() if ctx.cog else None
+        index = get_index(ctx.guild.id, rules)
+        if index is None:
+            return True
+        ctx.keywords = (index, index.scan(ctx.message.content.lower()))
+    index, found = ctx.keywords
+    if rule not in index.rules:  # Not an active rule, such as a Warden check
+        return True
+    return all(not found.isdisjoint(group) for group in rule.keywords)
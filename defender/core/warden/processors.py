@@ -0,0 +1,900 @@
+"""Defender - Protects your community with automod features and
+           empowers the staff and users you trust with
+           advanced moderation tools
+Copyright (C) 2020-present  Twentysix (https://github.com/Twentysix26/)
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+from ...core.warden import validation as models
+from ...enums import EmergencyMode, Action as ModAction
+from .enums import Action
+from .utils import delete_message_after
+from ...exceptions import ExecutionError, StopExecution, MisconfigurationError
+from ...core import cache as df_cache, memo
+from ...core.utils import utcnow
+from ...core.menus import QAView
+from string import Template
+from typing import TYPE_CHECKING, Callable, Dict
+from . import heat, membercache
+import random
+import discord
+import datetime
+import math
+
+if TYPE_CHECKING:
+    from .rule import WDRuntime
+
+"""
+The action processors, one per Warden action. Like the condition checkers, they are bound
+to the actions of a rule when the rule is parsed.
+"""
+
+PROCESSORS: Dict[Action, Callable] = {}
+
+
+def processor(action: Action, suggest: Action = None):
+    def decorator(function):
+        if suggest is None:
+            PROCESSORS[action] = function
+            return function
+
+        def wrapper(runtime: WDRuntime, params):
+            runtime.cog.send_to_monitor(
+                runtime.guild,
+                f"[Warden] ({runtime.rule.name}): Action "
+                f"'{action.value}' is deprecated, use "
+                f"'{suggest.value}' instead.",
+            )
+            return function(runtime, params)
+
+        PROCESSORS[action] = wrapper
+        return wrapper
+
+    return decorator
+
+
+def ensure_processors():
+    for a in Action:
+        if a not in PROCESSORS:
+            raise MisconfigurationError(f"{a.value} does not have a processor.")
+
+
+@processor(Action.DeleteUserMessage)
+async def delete_user_message(runtime: WDRuntime, params: models.IsNone):
+    message = runtime.message
+    await message.delete()
+
+
+@processor(Action.NotifyStaff)
+async def notify_staff(runtime: WDRuntime, params: models.NotifyStaff):
+    # Checks if only "content" has been passed
+    cog = runtime.cog
+    guild = runtime.guild
+    user = runtime.user
+    message = runtime.message
+    channel = runtime.channel
+    text_only = params.model_fields_set == {"content"}
+
+    quick_action = None
+    if params.qa_target:
+        qa_target = runtime.safe_sub(params.qa_target)
+        try:
+            qa_target = int(qa_target)
+        except ValueError:
+            raise ExecutionError(f"{qa_target} is not a valid ID for a Quick Action target.")
+        qa_reason = "" if params.qa_reason is None else params.qa_reason
+        qa_reason = runtime.safe_sub(qa_reason)
+        quick_action = QAView(cog, qa_target, qa_reason)
+
+    jump_to_msg = None
+
+    if params.jump_to_ctx_message:
+        jump_to_msg = message
+
+    if params.jump_to:
+        jump_to_channel_id = runtime.safe_sub(params.jump_to.channel_id)
+        jump_to_message_id = runtime.safe_sub(params.jump_to.message_id)
+        try:
+            jump_to_ch = discord.utils.get(guild.text_channels, id=int(jump_to_channel_id))
+        except ValueError:
+            raise ExecutionError(f'{jump_to_channel_id} is not a valid channel ID for a "jump to" message.')
+        if jump_to_ch:
+            try:
+                jump_to_msg = jump_to_ch.get_partial_message(int(jump_to_message_id))
+            except ValueError:
+                raise ExecutionError(f'{jump_to_message_id} is not a valid message ID for a "jump to" message.')
+        else:
+            raise ExecutionError(f'I could not find the destination channel for the "jump to" message.')
+
+    title = runtime.safe_sub(params.title) if params.title else None
+    heat_key = runtime.safe_sub(params.no_repeat_key) if params.no_repeat_key else None
+
+    fields = []
+
+    if params.fields:
+        for param in params.fields:
+            fields.append(param.dict())
+
+    for field in fields:
+        for attr in ("name", "value"):
+            if attr in field:
+                field[attr] = runtime.safe_sub(field[attr])
+
+    if params.add_ctx_fields:
+        ctx_fields = []
+        if user:
+            ctx_fields.append({"name": "Username", "value": f"`{user}`"})
+            ctx_fields.append({"name": "ID", "value": f"`{user.id}`"})
+        if message:
+            ctx_fields.append({"name": "Channel", "value": message.channel.mention})
+        fields = ctx_fields + fields
+
+    footer = None
+    if not text_only:
+        if params.footer_text is None:
+            footer = f"Warden rule `{runtime.rule.name}`"
+        elif params.footer_text == "":
+            footer = None
+        else:
+            footer = runtime.safe_sub(params.footer_text)
+
+    runtime.last_sent_message = await cog.send_notification(
+        guild,
+        runtime.safe_sub(params.content),
+        title=title,
+        ping=params.ping,
+        fields=fields,
+        footer=footer,
+        thumbnail=runtime.safe_sub(params.thumbnail) if params.thumbnail else None,
+        jump_to=jump_to_msg,
+        no_repeat_for=params.no_repeat_for,
+        heat_key=heat_key,
+        view=quick_action,
+        force_text_only=text_only,
+        allow_everyone_ping=params.allow_everyone_ping,
+    )
+
+
+@processor(Action.SetChannelSlowmode)
+async def set_channel_slowmode(runtime: WDRuntime, params: models.IsTimedelta):
+    channel = runtime.channel
+    if params.value.seconds != channel.slowmode_delay:
+        await channel.edit(slowmode_delay=params.value.seconds)
+
+
+@processor(Action.AddRolesToUser)
+async def add_roles_to_user(runtime: WDRuntime, params: models.NonEmptyList):
+    guild = runtime.guild
+    user = runtime.user
+    to_assign = []
+    for role_id_or_name in params.value:
+        role = guild.get_role(role_id_or_name)
+        if role is None:
+            role = discord.utils.get(guild.roles, name=role_id_or_name)
+        if role:
+            to_assign.append(role)
+    to_assign = list(set(to_assign))
+    to_assign = [r for r in to_assign if r not in user.roles]
+    if to_assign:
+        await user.add_roles(*to_assign, reason=f"Assigned by Warden rule '{runtime.rule.name}'")
+        # The next rules of this event must not rely on what was cached about the member
+        membercache.invalidate_member(guild.id, user.id)
+
+
+@processor(Action.RemoveRolesFromUser)
+async def remove_roles_from_user(runtime: WDRuntime, params: models.NonEmptyList):
+    guild = runtime.guild
+    user = runtime.user
+    to_unassign = []
+    for role_id_or_name in params.value:
+        role = guild.get_role(role_id_or_name)
+        if role is None:
+            role = discord.utils.get(guild.roles, name=role_id_or_name)
+        if role:
+            to_unassign.append(role)
+    to_unassign = list(set(to_unassign))
+    to_unassign = [r for r in to_unassign if r in user.roles]
+    if to_unassign:
+        await user.remove_roles(*to_unassign, reason=f"Unassigned by Warden rule '{runtime.rule.name}'")
+        membercache.invalidate_member(guild.id, user.id)
+
+
+@processor(Action.SetUserNickname)
+async def set_user_nickname(runtime: WDRuntime, params: models.IsStr):
+    user = runtime.user
+    if params.value == "":
+        value = None
+    else:
+        value = Template(params.value).safe_substitute(runtime.state)
+    await user.edit(nick=value, reason=f"Changed nickname by Warden rule '{runtime.rule.name}'")
+    membercache.invalidate_member(runtime.guild.id, user.id)
+
+
+@processor(Action.BanAndDelete)
+async def ban_and_delete(runtime: WDRuntime, params: models.IsInt):
+    cog = runtime.cog
+    guild = runtime.guild
+    user = runtime.user
+    if user not in guild.members:
+        raise ExecutionError(f"User {user} ({user.id}) not in the server.")
+    reason = f"Banned by Warden rule '{runtime.rule.name}'"
+    await guild.ban(user, delete_message_days=params.value, reason=reason)
+    runtime.last_expel_action = ModAction.Ban
+    cog.dispatch_event("member_remove", user, ModAction.Ban.value, reason)
+
+
+@processor(Action.Kick)
+async def kick(runtime: WDRuntime, params: models.IsNone):
+    cog = runtime.cog
+    guild = runtime.guild
+    user = runtime.user
+    if user not in guild.members:
+        raise ExecutionError(f"User {user} ({user.id}) not in the server.")
+    reason = f"Kicked by Warden action '{runtime.rule.name}'"
+    await guild.kick(user, reason=reason)
+    runtime.last_expel_action = ModAction.Kick
+    cog.dispatch_event("member_remove", user, ModAction.Kick.value, reason)
+
+
+@processor(Action.Softban)
+async def softban(runtime: WDRuntime, params: models.IsNone):
+    cog = runtime.cog
+    guild = runtime.guild
+    user = runtime.user
+    if user not in guild.members:
+        raise ExecutionError(f"User {user} ({user.id}) not in the server.")
+    reason = f"Softbanned by Warden rule '{runtime.rule.name}'"
+    await guild.ban(user, delete_message_days=1, reason=reason)
+    await guild.unban(user)
+    runtime.last_expel_action = Action.Softban
+    cog.dispatch_event("member_remove", user, ModAction.Softban.value, reason)
+
+
+@processor(Action.PunishUser)
+async def punish_user(runtime: WDRuntime, params: models.IsNone):
+    cog = runtime.cog
+    guild = runtime.guild
+    user = runtime.user
+    punish_role = guild.get_role(await cog.config.guild(guild).punish_role())
+    if punish_role and not cog.is_role_privileged(punish_role):
+        await user.add_roles(punish_role, reason=f"Punished by Warden rule '{runtime.rule.name}'")
+        membercache.invalidate_member(guild.id, user.id)
+    else:
+        cog.send_to_monitor(
+            guild,
+            f"[Warden] ({runtime.rule.name}): Failed to punish user. Is the punish role "
+            "still present and with *no* privileges?",
+        )
+
+
+@processor(Action.PunishUserWithMessage)
+async def punish_user_with_message(runtime: WDRuntime, params: models.IsNone):
+    cog = runtime.cog
+    guild = runtime.guild
+    user = runtime.user
+    channel = runtime.channel
+    punish_role = guild.get_role(await cog.config.guild(guild).punish_role())
+    punish_message = await cog.format_punish_message(user)
+    if punish_role and not cog.is_role_privileged(punish_role):
+        await user.add_roles(punish_role, reason=f"Punished by Warden rule '{runtime.rule.name}'")
+        membercache.invalidate_member(guild.id, user.id)
+        if punish_message:
+            await channel.send(punish_message)
+    else:
+        cog.send_to_monitor(
+            guild,
+            f"[Warden] ({runtime.rule.name}): Failed to punish user. Is the punish role "
+            "still present and with *no* privileges?",
+        )
+
+
+@processor(Action.Timeout)
+async def timeout_user(runtime: WDRuntime, params: models.IsOptionalTimedelta):
+    guild = runtime.guild
+    user = runtime.user
+    if user not in guild.members:
+        raise ExecutionError(f"User {user} ({user.id}) not in the server.")
+    reason = f"Timeout set by Warden action '{runtime.rule.name}'"
+    await user.timeout(params.value, reason=reason)
+
+
+@processor(Action.Modlog)
+async def send_mod_log(runtime: WDRuntime, params: models.IsStr):
+    cog = runtime.cog
+    guild = runtime.guild
+    user = runtime.user
+    if runtime.last_expel_action is None:
+        return
+    reason = Template(params.value).safe_substitute(runtime.state)
+    await cog.create_modlog_case(
+        cog.bot,
+        guild,
+        utcnow(),
+        runtime.last_expel_action.value,
+        user,
+        guild.me,
+        reason,
+        until=None,
+        channel=None,
+    )
+
+
+@processor(Action.EnableEmergencyMode)
+async def enable_emergency_mode(runtime: WDRuntime, params: models.IsBool):
+    cog = runtime.cog
+    guild = runtime.guild
+    if params.value:
+        cog.emergency_mode[guild.id] = EmergencyMode(manual=True)
+    else:
+        try:
+            del cog.emergency_mode[guild.id]
+        except KeyError:
+            pass
+
+
+@processor(Action.SendToMonitor)
+async def send_to_monitor(runtime: WDRuntime, params: models.IsStr):
+    cog = runtime.cog
+    guild = runtime.guild
+    value = Template(params.value).safe_substitute(runtime.state)
+    cog.send_to_monitor(guild, f"[Warden] ({runtime.rule.name}): {value}")
+
+
+@processor(Action.AddUserHeatpoint)
+async def add_user_heatpoint(runtime: WDRuntime, params: models.IsTimedelta):
+    user = runtime.user
+    debug = runtime.debug
+    heat.increase_user_heat(user, params.value, debug=debug)  # type: ignore
+    runtime.state["user_heat"] = heat.get_user_heat(user, debug=debug)
+
+
+@processor(Action.AddUserHeatpoints)
+async def add_user_heatpoints(runtime: WDRuntime, params: models.AddHeatpoints):
+    user = runtime.user
+    debug = runtime.debug
+    heat.increase_user_heat(user, params.delta, params.points, debug=debug)  # type: ignore
+    runtime.state["user_heat"] = heat.get_user_heat(user, debug=debug)
+
+
+@processor(Action.AddChannelHeatpoint)
+async def add_channel_heatpoint(runtime: WDRuntime, params: models.IsTimedelta):
+    channel = runtime.channel
+    debug = runtime.debug
+    heat.increase_channel_heat(channel, params.value, debug=debug)  # type: ignore
+    runtime.state["channel_heat"] = heat.get_channel_heat(channel, debug=debug)
+
+
+@processor(Action.AddChannelHeatpoints)
+async def add_channel_heatpoints(runtime: WDRuntime, params: models.AddHeatpoints):
+    channel = runtime.channel
+    debug = runtime.debug
+    heat.increase_channel_heat(channel, params.delta, params.points, debug=debug)  # type: ignore
+    runtime.state["channel_heat"] = heat.get_channel_heat(channel, debug=debug)
+
+
+@processor(Action.AddCustomHeatpoint)
+async def add_custom_heatpoint(runtime: WDRuntime, params: models.AddCustomHeatpoint):
+    guild = runtime.guild
+    debug = runtime.debug
+    heat_key = Template(params.label).safe_substitute(runtime.state)
+    heat.increase_custom_heat(guild, heat_key, params.delta, debug=debug)  # type: ignore
+
+
+@processor(Action.AddCustomHeatpoints)
+async def add_custom_heatpoints(runtime: WDRuntime, params: models.AddCustomHeatpoints):
+    guild = runtime.guild
+    debug = runtime.debug
+    heat_key = Template(params.label).safe_substitute(runtime.state)
+    heat.increase_custom_heat(guild, heat_key, params.delta, params.points, debug=debug)  # type: ignore
+
+
+@processor(Action.EmptyUserHeat)
+async def empty_user_heat(runtime: WDRuntime, params: models.IsNone):
+    user = runtime.user
+    debug = runtime.debug
+    heat.empty_user_heat(user, debug=debug)
+
+
+@processor(Action.EmptyChannelHeat)
+async def empty_channel_heat(runtime: WDRuntime, params: models.IsNone):
+    channel = runtime.channel
+    debug = runtime.debug
+    heat.empty_channel_heat(channel, debug=debug)
+
+
+@processor(Action.EmptyCustomHeat)
+async def empty_custom_heat(runtime: WDRuntime, params: models.IsStr):
+    guild = runtime.guild
+    debug = runtime.debug
+    heat_key = Template(params.value).safe_substitute(runtime.state)
+    heat.empty_custom_heat(guild, heat_key, debug=debug)
+
+
+@processor(Action.IssueCommand)
+async def issue_command(runtime: WDRuntime, params: models.IssueCommand):
+    cog = runtime.cog
+    guild = runtime.guild
+    message = runtime.message
+    issuer = guild.get_member(params.issue_as)
+    if issuer is None:
+        raise ExecutionError(f"User {params.issue_as} is not in the server.")
+    msg_obj = df_cache.get_msg_obj()
+    if msg_obj is None:
+        raise ExecutionError(f"Failed to issue command. Sorry!")
+
+    # User id + command in a non-message context
+    if message is None and params.destination is None:
+        notify_channel_id = await cog.config.guild(guild).notify_channel()
+        msg_obj.channel = guild.get_channel(notify_channel_id)
+        if msg_obj.channel is None:
+            raise ExecutionError(f"Failed to issue command. I could not find the " "notification channel.")
+    else:
+        if params.destination is None:  # User id + command in a message context
+            msg_obj.channel = message.channel
+        else:  # User id + command + arbitrary destination
+            destination = runtime.safe_sub(params.destination)
+            try:
+                msg_obj.channel = guild.get_channel(int(destination))
+            except ValueError:
+                raise ExecutionError(f"{destination} is not a valid ID.")
+            if msg_obj.channel is None:
+                raise ExecutionError(f"Failed to issue command. I could not find the " "notification channel.")
+            if msg_obj.channel.permissions_for(issuer).view_channel is False:
+                raise ExecutionError(
+                    "Failed to issue command. The issuer has no permissions " "to view the destination channel."
+                )
+
+    msg_obj.author = issuer
+    prefix = await cog.bot.get_prefix(msg_obj)
+    msg_obj.content = prefix[0] + runtime.safe_sub(params.command)
+    cog.bot.dispatch("message", msg_obj)
+
+
+@processor(Action.DeleteLastMessageSentAfter)
+async def delete_last_message_sent_after(runtime: WDRuntime, params: models.IsTimedelta):
+    cog = runtime.cog
+    if runtime.last_sent_message is not None:
+        cog.loop.create_task(delete_message_after(runtime.last_sent_message, params.value.seconds))
+        runtime.last_sent_message = None
+
+
+@processor(Action.SendMessage)
+async def send_message(runtime: WDRuntime, params: models.SendMessage):
+    cog = runtime.cog
+    guild = runtime.guild
+    channel = runtime.channel
+    parent = runtime.parent
+    params = params.model_copy()  # This model is mutable for easier handling
+
+    send_embed = False
+
+    for key in params.model_fields_set:
+        if key not in params._text_only_attrs:
+            send_embed = True
+            break
+
+    for key in params.model_dump():
+        attr = getattr(params, key)
+        if attr is None and key not in params._text_only_attrs:
+            setattr(params, key, None)
+        elif isinstance(attr, str):
+            setattr(params, key, runtime.safe_sub(attr))
+
+    is_user = False
+    pool = guild.text_channels if parent is None else guild.threads
+    if params.id.isdigit():
+        params.id = int(params.id)
+        destination = discord.utils.get(pool, id=params.id)
+        if destination is None:
+            destination = guild.get_member(params.id)
+            if destination is None:
+                cog.send_to_monitor(
+                    guild,
+                    f"[Warden] ({runtime.rule.name}): Failed to send message, " f"I could not find the recipient.",
+                )
+                return
+            else:
+                is_user = True
+    else:
+        destination = discord.utils.get(pool, name=params.id)
+        if destination is None:
+            raise ExecutionError(
+                f"[Warden] ({runtime.rule.name}): Failed to send message, "
+                f"'{params.id}' is not a valid channel name."
+            )
+
+    em = None
+
+    if send_embed is False and not params.content:
+        raise ExecutionError(f"[Warden] ({runtime.rule.name}): I have no content and " "no embed to send.")
+
+    if send_embed:
+        em = discord.Embed(title=params.title, description=params.description, url=params.url)
+
+        if params.author_name:
+            em.set_author(name=params.author_name, url=params.author_url, icon_url=params.author_icon_url)
+        em.set_image(url=params.image)
+        em.set_thumbnail(url=params.thumbnail)
+        em.set_footer(text=params.footer_text, icon_url=params.footer_icon_url)
+        for field in params.fields:
+            em.add_field(name=runtime.safe_sub(field.name), value=runtime.safe_sub(field.value), inline=field.inline)
+        if params.add_timestamp:
+            em.timestamp = utcnow()
+
+        if params.color is True:
+            em.color = await cog.bot.get_embed_color(destination)
+        elif not params.color:
+            pass
+        else:
+            em.color = discord.Colour(params.color)
+
+    mentions = discord.AllowedMentions(
+        everyone=params.allow_mass_mentions, roles=True, users=True, replied_user=params.ping_on_reply
+    )
+
+    if params.edit_message_id:
+        params.edit_message_id = runtime.safe_sub(params.edit_message_id)
+
+    if isinstance(destination, discord.Member):
+        destination = destination.dm_channel if destination.dm_channel else await destination.create_dm()
+
+    reference = None
+    if params.reply_message_id:
+        params.reply_message_id = runtime.safe_sub(params.reply_message_id)
+        if params.reply_message_id.isdigit():
+            reference = destination.get_partial_message(int(params.reply_message_id))
+
+    if not params.edit_message_id:
+        try:
+            runtime.last_sent_message = await destination.send(
+                params.content, embed=em, allowed_mentions=mentions, reference=reference
+            )
+        except (discord.HTTPException, discord.Forbidden) as e:
+            # A user could just have DMs disabled
+            if is_user is False:
+                raise ExecutionError(
+                    f"[Warden] ({runtime.rule.name}): Failed to deliver message " f"to channel #{destination}. {e}"
+                )
+    else:
+        try:
+            partial_msg = destination.get_partial_message(int(params.edit_message_id))
+            await partial_msg.edit(
+                content=params.content if params.content else None, embed=em, allowed_mentions=mentions
+            )
+        except (discord.HTTPException, discord.Forbidden) as e:
+            raise ExecutionError(
+                f"[Warden] ({runtime.rule.name}): Failed to edit message " f"in channel #{destination}. {e}"
+            )
+        except ValueError:
+            raise ExecutionError(
+                f"[Warden] ({runtime.rule.name}): Failed to edit message. "
+                f"{params.edit_message_id} is not a valid ID"
+            )
+
+
+@processor(Action.ArchiveThread)
+async def archive_thread(runtime: WDRuntime, params: models.IsNone):
+    channel = runtime.channel
+    if isinstance(channel, discord.Thread):
+        await channel.edit(archived=True, reason=f"Archived by Warden rule '{runtime.rule.name}'")
+
+
+@processor(Action.LockThread)
+async def lock_thread(runtime: WDRuntime, params: models.IsNone):
+    channel = runtime.channel
+    if isinstance(channel, discord.Thread):
+        await channel.edit(locked=True, reason=f"Locked by Warden rule '{runtime.rule.name}'")
+
+
+@processor(Action.ArchiveAndLockThread)
+async def archive_and_lock_thread(runtime: WDRuntime, params: models.IsNone):
+    channel = runtime.channel
+    if isinstance(channel, discord.Thread):
+        await channel.edit(
+            archived=True, locked=True, reason=f"Archived and locked by Warden rule '{runtime.rule.name}'"
+        )
+
+
+@processor(Action.DeleteThread)
+async def delete_thread(runtime: WDRuntime, params: models.IsNone):
+    channel = runtime.channel
+    if isinstance(channel, discord.Thread):
+        await channel.delete()
+
+
+@processor(Action.GetUserInfo)
+async def get_user_info(runtime: WDRuntime, params: models.GetUserInfo):
+    cog = runtime.cog
+    guild = runtime.guild
+    _id = runtime.safe_sub(params.id)
+    if not _id.isdigit():
+        raise ExecutionError(f"{_id} is not a valid ID.")
+
+    member = guild.get_member(int(_id))
+    if not member:
+        raise ExecutionError(f"Member {_id} not found.")
+
+    for target, attr in params.mapping.items():
+        if attr.startswith("_") or "." in attr:
+            raise ExecutionError(f"You cannot access internal attributes.")
+
+        attr = attr.lower()
+
+        if attr == "rank":
+            value = await cog.rank_user(member)
+            value = value.value
+        elif attr == "is_staff":
+            value = await memo.is_mod(cog.bot, member)
+        elif attr == "is_helper":
+            value = await cog.is_helper(member)
+        elif attr == "message_count":
+            value = await cog.get_total_recorded_messages(member)
+        else:
+            value = getattr(member, attr, None)
+            if value is None:
+                raise ExecutionError(f'Attribute "{attr}" does not exist.')
+
+        if isinstance(value, bool):
+            value = str(value).lower()
+        elif isinstance(value, datetime.datetime):
+            value = value.strftime("%Y/%m/%d %H:%M:%S")
+        elif isinstance(value, discord.BaseActivity):
+            value = value.name if value.name is not None else "none"
+        elif isinstance(value, discord.Spotify):
+            value = "none"
+        elif isinstance(value, (str, int, discord.Asset, discord.Status)):
+            value = str(value)
+        else:
+            raise ExecutionError(f'Attribute "{attr}" not supported.')
+
+        runtime.state[runtime.safe_sub(target)] = value
+
+
+@processor(Action.Exit)
+async def stop_execution(runtime: WDRuntime, params: models.IsNone):
+    raise StopExecution("Exiting.")
+
+
+@processor(Action.VarAssign)
+async def assign(runtime: WDRuntime, params: models.VarAssign):
+    value = runtime.safe_sub(params.value) if params.evaluate else params.value
+    runtime.state[runtime.safe_sub(params.var_name)] = value
+
+
+@processor(Action.VarAssignRandom)
+async def assign_random(runtime: WDRuntime, params: models.VarAssignRandom):
+    choices = []
+    weights = []
+
+    if isinstance(params.choices, list):
+        choices = params.choices
+    else:
+        for k, v in params.choices.items():
+            choices.append(k)
+            weights.append(v)
+
+    choice = random.choices(choices, weights=weights or None, k=1)[0]
+    if params.evaluate:
+        choice = runtime.safe_sub(choice)
+
+    runtime.state[runtime.safe_sub(params.var_name)] = choice
+
+
+@processor(Action.VarAssignHeat)
+async def assign_heat(runtime: WDRuntime, params: models.VarAssignHeat):
+    guild = runtime.guild
+    user = runtime.user
+    channel = runtime.channel
+    debug = runtime.debug
+    heat_key = runtime.safe_sub(params.heat_label)
+
+    if heat_key == "user_heat" and user:
+        value = heat.get_user_heat(user, debug=debug)
+    elif heat_key == "channel_heat" and channel:
+        value = heat.get_channel_heat(channel, debug=debug)
+    else:
+        value = heat.get_custom_heat(guild, heat_key, debug=debug)
+
+    runtime.state[params.var_name] = value
+
+
+@processor(Action.VarMath)
+async def var_math(runtime: WDRuntime, params: models.VarMath):
+    ops = ("+", "-", "*", "/", "pow")
+    single_ops = ("abs", "floor", "ceil", "trunc")
+
+    op = runtime.safe_sub(params.operator).lower()
+
+    if op not in ops and op not in single_ops:
+        raise ExecutionError(f"{op} is not a valid operator.")
+    elif op in ops and params.operand2 is None:
+        raise ExecutionError("Missing second operand.")
+    elif op in single_ops and params.operand2 is not None:
+        raise ExecutionError(f"A second operand is not needed with operator {op}")
+
+    num1, num2 = (
+        runtime.safe_sub(params.operand1),
+        runtime.safe_sub(params.operand2) if params.operand2 is not None else 0,
+    )
+
+    def cast_to_number(n):
+        try:
+            return int(n)
+        except:
+            try:
+                return float(n)
+            except:
+                raise ExecutionError(f"{n} is not a number.")
+
+    num1, num2 = cast_to_number(num1), cast_to_number(num2)
+
+    try:
+        if op == "+":
+            result = num1 + num2
+        elif op == "-":
+            result = num1 - num2
+        elif op == "*":
+            result = num1 * num2
+        elif op == "/":
+            result = num1 / num2
+        elif op == "abs":
+            result = abs(num1)
+        elif op == "pow":
+            result = math.pow(num1, num2)
+        elif op == "floor":
+            result = math.floor(num1)
+        elif op == "ceil":
+            result = math.ceil(num1)
+        elif op == "trunc":
+            result = math.trunc(num1)
+        else:
+            raise ExecutionError(f"Unhandled operator: {op}.")
+    except Exception as e:
+        raise ExecutionError(f"Calculation error: {e}")
+
+    runtime.state[params.result_var] = str(result)
+
+
+@processor(Action.VarReplace)
+async def var_replace(runtime: WDRuntime, params: models.VarReplace):
+    var_name = runtime.safe_sub(params.var_name)
+    var = runtime.state.get(var_name, None)
+    if var is None:
+        raise ExecutionError(f'Variable "{var_name}" does not exist.')
+
+    to_sub = []
+
+    if isinstance(params.strings, str):
+        to_sub.append(params.strings)
+    else:
+        to_sub = params.strings
+
+    for sub in to_sub:
+        var = var.replace(sub, params.substring)
+
+    runtime.state[var_name] = var
+
+
+@processor(Action.VarSplit)
+async def var_split(runtime: WDRuntime, params: models.VarSplit):
+    var_name = runtime.safe_sub(params.var_name)
+    var = runtime.state.get(var_name, None)
+    if var is None:
+        raise ExecutionError(f'Variable "{var_name}" does not exist.')
+
+    sequences = var.split(params.separator, maxsplit=params.max_split)
+
+    for i, var in enumerate(params.split_into):
+        try:
+            runtime.state[var] = sequences[i]
+        except IndexError:
+            runtime.state[var] = ""
+
+
+@processor(Action.VarTransform)
+async def var_transform(runtime: WDRuntime, params: models.VarTransform):
+    var_name = runtime.safe_sub(params.var_name)
+    var = runtime.state.get(var_name, None)
+    if var is None:
+        raise ExecutionError(f'Variable "{var_name}" does not exist.')
+
+    operation = params.operation.lower()
+
+    if operation == "capitalize":
+        var = var.capitalize()
+    elif operation == "lowercase":
+        var = var.lower()
+    elif operation == "reverse":
+        var = var[::-1]
+    elif operation == "uppercase":
+        var = var.upper()
+    elif operation == "title":
+        var = var.title()
+
+    runtime.state[var_name] = var
+
+
+@processor(Action.VarSlice)
+async def var_slice(runtime: WDRuntime, params: models.VarSlice):
+    var_name = runtime.safe_sub(params.var_name)
+    var = runtime.state.get(var_name, None)
+    if var is None:
+        raise ExecutionError(f'Variable "{var_name}" does not exist.')
+
+    var = var[params.index : params.end_index : params.step]
+
+    if params.slice_into:
+        runtime.state[runtime.safe_sub(params.slice_into)] = var
+    else:
+        runtime.state[var_name] = var
+
+
+@processor(Action.WarnSystemWarn)
+async def warnsystem_warn(runtime: WDRuntime, params: models.WarnSystemWarn):
+    cog = runtime.cog
+    guild = runtime.guild
+    ws = cog.bot.get_cog("WarnSystem")
+    if ws is None:
+        raise ExecutionError("WarnSystem is not loaded. Integration not available.")
+
+    if isinstance(params.members, list):
+        raw_targets = [runtime.safe_sub(m) for m in params.members]
+    else:
+        raw_targets = [runtime.safe_sub(params.members)]
+
+    targets = []
+    for rt in raw_targets:
+        try:
+            member = guild.get_member(int(rt))
+        except ValueError:
+            raise ExecutionError(f"'{rt}' is not a valid ID.")
+        if member is None:
+            if rt.isnumeric():
+                raise ExecutionError("The hackban feature is not yet available.")  # TODO
+                # targets.append(ws.api.UnavailableMember(rt)) # hackban
+            else:
+                raise ExecutionError(f"'{rt}' is not a valid ID.")
+        else:
+            targets.append(member)
+
+    if params.author:
+        ws_author = guild.get_member(int(runtime.safe_sub(params.author)))
+        if ws_author is None:
+            raise ExecutionError(f"I could not find the author to issue the warning ({ws_author}).")
+    else:
+        ws_author = guild.me
+
+    reason = runtime.safe_sub(params.reason) if params.reason else None
+
+    try:
+        await ws.api.warn(
+            guild=guild,
+            members=targets,
+            author=ws_author,
+            level=params.level,
+            reason=reason,
+            time=params.time,
+            date=params.date,
+            ban_days=params.ban_days,
+            log_modlog=params.log_modlog,
+            log_dm=params.log_dm,
+            take_action=params.take_action,
+            automod=params.automod,
+        )
+    except Exception as e:
+        raise ExecutionError(f"WarnSystem error: {e}")
+
+
+@processor(Action.NoOp)
+async def no_op(runtime: WDRuntime, params: models.IsNone):
+    pass
@@ -0,0 +1,124 @@
+"""
+Defender - Protects your community with automod features and
+           empowers the staff and users you trust with
+           advanced moderation tools
+Copyright (C) 2020-present  Twentysix (https://github.com/Twentysix26/)
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import defaultdict, deque
+from typing import Dict, Iterable, List, Optional
+import logging
+import time
+
+log = logging.getLogger("red.x26cogs.defender")
+
+# Always-on counters of what each Warden rule costs, since the cog was loaded.
+# Only a couple of perf_counter calls per evaluated rule: rules skipped by rank never get here.
+# Timing each condition as well is optional, see CONDITION_TIMING.
+
+CONDITION_TIMING = False
+SAMPLES = 512  # Recent evaluation times kept for the p99
+
+clock = time.perf_counter
+
+
+class ConditionStats:
+    __slots__ = ("evaluations", "time")
+
+    def __init__(self):
+        self.evaluations = 0
+        self.time = 0.0
+
+
+class RuleStats:
+    __slots__ = (
+        "evaluations",
+        "passes",
+        "skipped",
+        "actions",
+        "eval_time",
+        "action_time",
+        "await_time",
+        "samples",
+        "conditions",
+    )
+
+    def __init__(self):
+        self.evaluations = 0
+        self.passes = 0
+        self.skipped = 0  # By the keyword prefilter
+        self.actions = 0
+        self.eval_time = 0.0
+        self.action_time = 0.0
+        self.await_time = 0.0  # Spent waiting on user regex and API calls while evaluating
+        self.samples = deque(maxlen=SAMPLES)
+        self.conditions: Dict[object, ConditionStats] = defaultdict(ConditionStats)
+
+    @property
+    def total_time(self):
+        return self.eval_time + self.action_time
+
+    def p99(self) -> float:
+        if not self.samples:
+            return 0.0
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+    def add_evaluation(self, elapsed: float, passed: bool):
+        self.evaluations += 1
+        self.eval_time += elapsed
+        self.samples.append(elapsed)
+        if passed:
+            self.passes += 1
+
+    def add_actions(self, elapsed: float):
+        self.actions += 1
+        self.action_time += elapsed
+
+    def add_condition(self, condition, elapsed: float):
+        stats = self.conditions[condition]
+        stats.evaluations += 1
+        stats.time += elapsed
+
+
+# Guild ID -> rule name -> stats
+_stats: Dict[int, Dict[str, RuleStats]] = defaultdict(dict)
+
+
+def get_rule_stats(guild_id: int, rule_name: str) -> RuleStats:
+    guild_stats = _stats[guild_id]
+    stats = guild_stats.get(rule_name)
+    if stats is None:
+        stats = guild_stats[rule_name] = RuleStats()
+    return stats
+
+
+def get_guild_stats(guild_id: int) -> Dict[str, RuleStats]:
+    return _stats.get(guild_id, {})
+
+
+def get_ranked(guild_id: int) -> List[tuple]:
+    """(rule name, stats) of a guild, most expensive first"""
+    return sorted(get_guild_stats(guild_id).items(), key=lambda i: i[1].total_time, reverse=True)
+
+
+def reset(guild_id: Optional[int] = None, rule_names: Optional[Iterable[str]] = None):
+    """Drops the stats of some rules of a guild, of a whole guild or of every guild"""
+    if guild_id is None:
+        _stats.clear()
+    elif rule_names is None:
+        _stats.pop(guild_id, None)
+    else:
+        guild_stats = _stats.get(guild_id, {})
+        for name in rule_names:
+            guild_stats.pop(name, None)
@@ -54,6 +54,7 @@ async def run_user_regex(*, rule_obj, cog, guild: discord.Guild, regex: str, tex
             )
             cog.active_warden_rules[guild.id].pop(rule_obj.name, None)
             cog.invalid_warden_rules[guild.id][rule_obj.name] = rule_obj
+            cog.warden_rules_changed(guild.id)
             async with cog.config.guild(guild).wd_rules() as warden_rules:
                 # There's no way to disable rules for now. So, let's just break it :D
                 rule_obj.raw_rule = (
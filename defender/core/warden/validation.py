@@ -22,6 +22,7 @@ from pydantic_core import PydanticCustomError, CoreSchema, core_schema
 from pydantic import (
     BaseModel as PydanticBaseModel,
     ConfigDict,
+    PrivateAttr,
     field_validator,
     model_validator as pydantic_model_validator,
 )
@@ -32,6 +33,8 @@ from datetime import timedelta, datetime
 from ...exceptions import InvalidRule
 import logging
 import string
+import fnmatch
+import re
 import discord
 
 VALID_VAR_NAME_CHARS = string.ascii_letters + string.digits + "_"
@@ -186,6 +189,12 @@ class CheckCustomHeatpoint(BaseModel):
     points: int
 
 
+class MessageRate(BaseModel):
+    _short_form = ("messages", "minutes")
+    messages: conint(ge=0, lt=50)
+    minutes: conint(gt=0, le=1440)
+
+
 class Compare(BaseModel):
     value1: str
     operator: str
@@ -446,6 +455,45 @@ class NonEmptyListStr(BaseModel):
     value: conlist(str, min_length=1)
 
 
+class WildcardList(NonEmptyListStr):
+    """
+    Case insensitive wildcard patterns (* ? [seq]), compiled once when the rule is parsed:
+    plain words end up in a set, the actual wildcards in a single regex
+    """
+
+    _literals: frozenset = PrivateAttr(default=frozenset())
+    _regex: Optional[re.Pattern] = PrivateAttr(default=None)
+
+    def model_post_init(self, __context):
+        literals = set()
+        wildcards = []
+        for pattern in self.value:
+            pattern = pattern.lower()
+            if any(c in pattern for c in "*?["):
+                wildcards.append(fnmatch.translate(pattern))
+            else:
+                literals.add(pattern)
+        self._literals = frozenset(literals)
+        if wildcards:
+            self._regex = re.compile("|".join(wildcards))
+
+    def matches(self, text: str) -> bool:
+        """Whether the whole text matches any of the patterns"""
+        text = text.lower()
+        if text in self._literals:
+            return True
+        return self._regex is not None and self._regex.match(text) is not None
+
+    def matches_any(self, texts: List[str]) -> bool:
+        """Whether any of the (lowercase) texts matches any of the patterns"""
+        if not self._literals.isdisjoint(texts):
+            return True
+        if self._regex is None:
+            return False
+        match = self._regex.match
+        return any(match(t) is not None for t in texts)
+
+
 class StatusList(NonEmptyListStr):
     async def _runtime_check(self, *, cog, author: discord.Member, action_or_cond: Union[Action, Condition]):
         for status in self.value:
@@ -537,18 +585,18 @@ class IsRank(BaseModel):
 # The accepted types of each condition for basic sanity checking
 CONDITIONS_VALIDATORS = {
     Condition.UserIdMatchesAny: NonEmptyListInt,
-    Condition.UsernameMatchesAny: NonEmptyListStr,
+    Condition.UsernameMatchesAny: WildcardList,
     Condition.UsernameMatchesRegex: IsRegex,
-    Condition.NicknameMatchesAny: NonEmptyListStr,
+    Condition.NicknameMatchesAny: WildcardList,
     Condition.NicknameMatchesRegex: IsRegex,
-    Condition.DisplayNameMatchesAny: NonEmptyListStr,
+    Condition.DisplayNameMatchesAny: WildcardList,
     Condition.DisplayNameMatchesRegex: IsRegex,
-    Condition.MessageMatchesAny: NonEmptyListStr,
+    Condition.MessageMatchesAny: WildcardList,
     Condition.MessageMatchesRegex: IsRegex,
-    Condition.MessageContainsWord: NonEmptyListStr,
+    Condition.MessageContainsWord: WildcardList,
     Condition.UserCreatedLessThan: UserJoinedCreated,
     Condition.UserJoinedLessThan: UserJoinedCreated,
-    Condition.UserActivityMatchesAny: NonEmptyListStr,
+    Condition.UserActivityMatchesAny: WildcardList,
     Condition.UserStatusMatchesAny: StatusList,
     Condition.UserHasDefaultAvatar: IsBool,
     Condition.ChannelMatchesAny: NonEmptyList,
@@ -558,6 +606,7 @@ CONDITIONS_VALIDATORS = {
     Condition.MessageHasAttachment: IsBool,
     Condition.UserHasAnyRoleIn: NonEmptyList,
     Condition.UserHasSentLessThanMessages: IsInt,
+    Condition.UserMessageRateMoreThan: MessageRate,
     Condition.MessageContainsInvite: IsBool,
     Condition.MessageContainsMedia: IsBool,
     Condition.MessageContainsUrl: IsBool,
@@ -646,6 +695,7 @@ CONDITIONS_USER_CONTEXT = [
     Condition.UserHasDefaultAvatar,
     Condition.UserHasAnyRoleIn,
     Condition.UserHasSentLessThanMessages,
+    Condition.UserMessageRateMoreThan,
     Condition.IsStaff,
     Condition.IsHelper,
     Condition.UserIsRank,
@@ -15,25 +15,28 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from typing import Deque, List, Optional
+from typing import Deque, Iterable, List, Optional
 from redbot.core import commands, Config
 from collections import Counter, defaultdict
 from redbot.core.utils.chat_formatting import pagify
 from redbot.core.utils import AsyncIter
 from redbot.core import modlog
+from redbot.core.data_manager import cog_data_path
+from pathlib import Path
 from .abc import CompositeMetaClass
 from .core.automodules import AutoModules
 from .commands import Commands
 from .core.events import Events
 from .enums import Rank, Action, EmergencyModules, PerspectiveAttributes
 from .exceptions import InvalidRule
-from .core.warden.rule import WardenRule
+from .core.warden.rule import WardenRule, WDEventContext
 from .core.warden.enums import Event as WardenEvent
-from .core.warden import heat, api as WardenAPI
+from .core.warden import heat, membercache, prefilter, profiler, api as WardenAPI
 from .core.announcements import get_announcements_text
 from .core.cache import CacheUser
 from .core.utils import utcnow, timestamp
 from .core import cache as df_cache
+from .core import dedup, memo
 from multiprocessing.pool import Pool
 from zlib import crc32
 from string import Template
@@ -42,6 +45,8 @@ import datetime
 import discord
 import asyncio
 import logging
+import sqlite3
+import time
 
 log = logging.getLogger("red.x26cogs.defender")
 
@@ -56,6 +61,7 @@ default_guild_settings = {
     "rank3_joined_days": 1,  # Users that joined < X days ago are considered new users (rank 3)
     "rank3_min_messages": 50,  # Messages threshold that users should reach to be no longer classified as rank 4
     "count_messages": True,  # Count users' messages. If disabled, rank4 will be unobtainable
+    "message_search_index": False,  # Keep a search index of the cached messages
     "announcements_sent": [],
     "invite_filter_enabled": False,
     "invite_filter_rank": Rank.Rank4.value,
@@ -111,10 +117,17 @@ default_member_settings = {
 default_owner_settings = {
     "cache_expiration": 48,  # Hours before a message will be removed from the cache
     "cache_cap": 3000,  # Max messages to store for each user / channel
+    "cache_budget": 0,  # Max memory for the message cache in megabytes, 0 is unlimited
+    "cache_snapshot": True,  # Save the message cache to disk to restore it after a restart
     "wd_regex_allowed": False,  # Allows the creation of Warden rules with user defined regex
     "wd_periodic_allowed": True,  # Allows the creation of periodic Warden rules
     "wd_upload_max_size": 3,  # Max size for Warden rule upload (in kilobytes)
     "wd_regex_safety_checks": True,  # Performance safety checks for user defined regex
+    "wd_heatpoints_cap": 100,  # Max heatpoints a user / channel / custom heat level can have
+    "wd_heat_snapshot": True,  # Save the heat levels to disk to restore them after a restart
+    "wd_heat_backend": "memory",  # Where heat levels are kept: "memory" or "sqlite"
+    "wd_heat_db_path": "",  # SQLite database shared between bot processes, empty is the cog's data folder
+    "wd_condition_timing": False,  # Times each condition of the Warden rules, for [p]def warden stats
 }
 
 
@@ -140,19 +153,33 @@ class Defender(Commands, AutoModules, Events, commands.Cog, metaclass=CompositeM
         self.emergency_mode = {}
         self.active_warden_rules = defaultdict(lambda: dict())
         self.invalid_warden_rules = defaultdict(lambda: dict())
+        # Guild ID -> (event, rank) -> rules, kept up to date by warden_rules_changed
+        self.warden_dispatch = {}
         self.warden_checks = defaultdict(lambda: dict())
         self.loop.create_task(self.load_warden_rules())
         self.loop.create_task(self.send_announcements())
+        self.cache_snapshot_path = cog_data_path(self) / "message_cache.bin"
+        self.cache_snapshot_enabled = False
+        self.cache_restored = False
+        # Users whose data was deleted before the message cache was restored
+        self.deleted_during_restore = set()
+        self.heat_snapshot_path = cog_data_path(self) / "heat.bin"
+        self.dedup_snapshot_path = cog_data_path(self) / "dedup.bin"
+        self.heat_snapshot_enabled = False
+        self.heat_db_path = cog_data_path(self) / "heat.sqlite3"
+        self.heat_restored = False
         self.loop.create_task(self.load_cache_settings())
         self.mc_task = self.loop.create_task(self.message_cache_cleaner())
+        self.heat_task = self.loop.create_task(self.heat_expiry_ticker())
         self.wd_periodic_task = self.loop.create_task(self.wd_periodic_rules())
         self.monitor = defaultdict(lambda: Deque(maxlen=500))
         self.wd_pool = Pool(maxtasksperchild=1000)
         self.quick_actions = defaultdict(lambda: dict())
 
+    @memo.memoized("rank_user", key=lambda self, member: (member.guild.id, member.id))
     async def rank_user(self, member: discord.Member):
         """Returns the user's rank"""
-        is_mod = await self.bot.is_mod(member)
+        is_mod = await memo.is_mod(self.bot, member)
         if is_mod:
             return Rank.Rank1
 
@@ -181,6 +208,7 @@ class Defender(Commands, AutoModules, Events, commands.Cog, metaclass=CompositeM
         messages = await self.get_total_recorded_messages(member)
         return messages < min_m
 
+    @memo.memoized("get_total_recorded_messages", key=lambda self, member: (member.guild.id, member.id))
     async def get_total_recorded_messages(self, member: discord.Member):
         # The ones already stored in config...
         msg_n = await self.config.member(member).messages()
@@ -195,7 +223,7 @@ class Defender(Commands, AutoModules, Events, commands.Cog, metaclass=CompositeM
         _log = []
 
         if isinstance(obj, (discord.Member, CacheUser)):
-            messages = df_cache.get_user_messages(obj)
+            messages = df_cache.iter_user_messages(obj)
 
             async for m in AsyncIter(messages, steps=20):
                 ts = m.created_at.strftime("%H:%M:%S")
@@ -219,7 +247,7 @@ class Defender(Commands, AutoModules, Events, commands.Cog, metaclass=CompositeM
                 else:
                     _log.append(f"[{ts}]({channel}) {content}")
         elif isinstance(obj, (discord.TextChannel, discord.Thread)):
-            messages = df_cache.get_channel_messages(obj)
+            messages = df_cache.iter_channel_messages(obj)
 
             async for m in AsyncIter(messages, steps=20):
                 ts = m.created_at.strftime("%H:%M:%S")
@@ -310,11 +338,25 @@ class Defender(Commands, AutoModules, Events, commands.Cog, metaclass=CompositeM
         self.monitor[guild.id].appendleft(f"[{now}] {entry}")
 
     async def message_cache_cleaner(self):
+        last_snapshot = time.monotonic()
         try:
             while True:
-                await asyncio.sleep(60 * 60)
+                await asyncio.sleep(60)
                 await df_cache.discard_stale()
-                await heat.remove_stale_heat()
+                df_cache.enforce_budget()
+                if time.monotonic() - last_snapshot >= 60 * 10:
+                    await self.save_cache_snapshot()
+                    await self.save_heat_snapshot()
+                    last_snapshot = time.monotonic()
+        except asyncio.CancelledError:
+            pass
+
+    async def heat_expiry_ticker(self):
+        try:
+            while True:
+                await asyncio.sleep(1)
+                heat.discard_expired_heat()
+                dedup.discard_expired()
         except asyncio.CancelledError:
             pass
 
@@ -384,22 +426,27 @@ class Defender(Commands, AutoModules, Events, commands.Cog, metaclass=CompositeM
             await asyncio.gather(*tasks)
 
     async def exec_wd_period_rules(self, guild, rules):
-        for rule in rules:
-            if not rule.next_run <= utcnow() or rule.run_every is None:
+        now = utcnow()
+        rules = [r for r in rules if r.run_every is not None and r.next_run <= now]
+        if not rules:
+            return
+        # One pass over the members, each member's context is shared by all the rules that are due
+        async for member in AsyncIter(guild.members, steps=2):
+            if member.bot:
                 continue
-            async for member in AsyncIter(guild.members, steps=2):
-                if member.bot:
-                    continue
-                if member.joined_at is None:
-                    continue
-                rank = await self.rank_user(member)
-                if await rule.satisfies_conditions(cog=self, rank=rank, guild=member.guild, user=member):
+            if member.joined_at is None:
+                continue
+            rank = await self.rank_user(member)
+            wd_ctx = WDEventContext(cog=self, guild=member.guild, user=member)
+            for rule in rules:
+                if await rule.satisfies_conditions(rank=rank, ctx=wd_ctx):
                     try:
-                        await rule.do_actions(cog=self, guild=member.guild, user=member)
+                        await rule.do_actions(ctx=wd_ctx)
                     except Exception as e:
                         self.send_to_monitor(
                             guild, f"[Warden] Rule {rule.name} " f"({rule.last_action.value}) - {str(e)}"
                         )
+        for rule in rules:
             rule.next_run = utcnow() + rule.run_every
 
     async def load_warden_rules(self):
@@ -430,11 +477,63 @@ class Defender(Commands, AutoModules, Events, commands.Cog, metaclass=CompositeM
                 else:
                     self.active_warden_rules[int(guid)][new_rule.name] = new_rule
 
+        self.warden_rules_changed()
         await WardenAPI.load_modules_checks()
 
     async def load_cache_settings(self):
         df_cache.MSG_STORE_CAP = await self.config.cache_cap()
         df_cache.MSG_EXPIRATION_TIME = await self.config.cache_expiration()
+        df_cache.MSG_CACHE_BUDGET = await self.config.cache_budget() * 1024 * 1024
+        heat.MAX_HEATPOINTS = await self.config.wd_heatpoints_cap()
+        profiler.CONDITION_TIMING = await self.config.wd_condition_timing()
+        for guid, guild_data in (await self.config.all_guilds()).items():
+            if guild_data["message_search_index"]:
+                await df_cache.set_search_index(guid, True)
+        if await self.config.wd_heat_backend() == "sqlite":
+            db_path = await self.config.wd_heat_db_path()
+            try:
+                heat.set_backend(heat.SQLiteHeatBackend(Path(db_path) if db_path else self.heat_db_path))
+            except sqlite3.Error as e:
+                log.error("Warden - failed to open the heat database, heat will be kept in memory", exc_info=e)
+        self.heat_snapshot_enabled = await self.config.wd_heat_snapshot()
+        if self.heat_snapshot_enabled:
+            try:
+                if not heat.get_backend().persistent:
+                    await heat.load_snapshot(self.heat_snapshot_path)
+                dedup.load_snapshot(self.dedup_snapshot_path)
+            except OSError as e:
+                log.error("Failed to restore the heat snapshot", exc_info=e)
+        self.heat_restored = True
+        self.cache_snapshot_enabled = await self.config.cache_snapshot()
+        if self.cache_snapshot_enabled:
+            try:
+                await df_cache.load_snapshot(self.cache_snapshot_path, skip_authors=self.deleted_during_restore)
+            except OSError as e:
+                log.error("Failed to restore the message cache snapshot", exc_info=e)
+        self.cache_restored = True
+        # The snapshot on disk still has their messages
+        if self.deleted_during_restore:
+            self.deleted_during_restore.clear()
+            await self.save_cache_snapshot()
+
+    async def save_cache_snapshot(self):
+        # Saving before the restore is done would overwrite the snapshot with a partial cache
+        if not self.cache_snapshot_enabled or not self.cache_restored:
+            return
+        try:
+            await df_cache.save_snapshot(self.cache_snapshot_path)
+        except OSError as e:
+            log.error("Failed to save the message cache snapshot", exc_info=e)
+
+    async def save_heat_snapshot(self):
+        if not self.heat_snapshot_enabled or not self.heat_restored:
+            return
+        try:
+            if not heat.get_backend().persistent:
+                await heat.save_snapshot(self.heat_snapshot_path)
+            dedup.save_snapshot(self.dedup_snapshot_path)
+        except OSError as e:
+            log.error("Failed to save the heat snapshot", exc_info=e)
 
     async def send_announcements(self):
         new_announcements = get_announcements_text(only_recent=True)
@@ -480,6 +579,23 @@ class Defender(Commands, AutoModules, Events, commands.Cog, metaclass=CompositeM
         self.counter_task.cancel()
         self.wd_periodic_task.cancel()
         self.mc_task.cancel()
+        self.heat_task.cancel()
+        if self.cache_snapshot_enabled and self.cache_restored:
+            try:
+                df_cache.save_snapshot_sync(self.cache_snapshot_path)
+            except OSError as e:
+                log.error("Failed to save the message cache snapshot", exc_info=e)
+        if self.heat_snapshot_enabled and self.heat_restored:
+            try:
+                if not heat.get_backend().persistent:
+                    heat.save_snapshot_sync(self.heat_snapshot_path)
+                dedup.save_snapshot(self.dedup_snapshot_path)
+            except OSError as e:
+                log.error("Failed to save the heat snapshot", exc_info=e)
+        try:
+            heat.set_backend(None)
+        except sqlite3.Error as e:
+            log.error("Warden - failed to commit the last heatpoints to the heat database", exc_info=e)
         self.wd_pool.close()
         self.bot.loop.run_in_executor(None, self.wd_pool.join)
 
@@ -506,6 +622,7 @@ class Defender(Commands, AutoModules, Events, commands.Cog, metaclass=CompositeM
     async def inc_message_count(self, member):
         self.message_counter[member.guild.id][member.id] += 1
 
+    @memo.memoized("is_helper", key=lambda self, member: (member.guild.id, member.id))
     async def is_helper(self, member: discord.Member):
         helper_roles = await self.config.guild(member.guild).helper_roles()
         for r in member.roles:
@@ -546,9 +663,13 @@ class Defender(Commands, AutoModules, Events, commands.Cog, metaclass=CompositeM
                 heat_key = f"{destination.id}-{description}-{fields}"
                 heat_key = f"core-notif-{crc32(heat_key.encode('utf-8', 'ignore'))}"
 
-            if not heat.get_custom_heat(guild, heat_key) == 0:
-                return
-            heat.increase_custom_heat(guild, heat_key, no_repeat_for)
+            if heat_key.startswith("core-"):
+                if not dedup.add(guild.id, heat_key, no_repeat_for):
+                    return
+            else:  # Warden's no repeat keys are rule-defined custom heat
+                if not heat.get_custom_heat(guild, heat_key) == 0:
+                    return
+                heat.increase_custom_heat(guild, heat_key, no_repeat_for)
 
         guild = destination
         is_staff_notification = False
@@ -618,10 +739,48 @@ class Defender(Commands, AutoModules, Events, commands.Cog, metaclass=CompositeM
         else:
             return False
 
-    def get_warden_rules_by_event(self, guild: discord.Guild, event: WardenEvent) -> List[WardenRule]:
-        rules = self.active_warden_rules.get(guild.id, {}).values()
-        rules = [r for r in rules if event in r.events]
-        return sorted(rules, key=lambda k: k.priority)
+    def get_warden_rules_by_event(
+        self, guild: discord.Guild, event: WardenEvent, rank: Optional[Rank] = None
+    ) -> List[WardenRule]:
+        """
+        The rules of an event sorted by priority. If a rank is passed, only the
+        rules that can apply to it. The list is shared and must not be modified
+        """
+        table = self.warden_dispatch.get(guild.id)
+        if table is None:
+            table = self.build_warden_dispatch(guild.id)
+        return table.get((event, rank), [])
+
+    def build_warden_dispatch(self, guild_id: int):
+        rules = sorted(self.active_warden_rules.get(guild_id, {}).values(), key=lambda k: k.priority)
+        table = {}
+        for event in WardenEvent:
+            event_rules = [r for r in rules if event in r.events]
+            if not event_rules:
+                continue
+            table[(event, None)] = event_rules
+            for rank in Rank:
+                table[(event, rank)] = [r for r in event_rules if rank >= r.rank]
+        self.warden_dispatch[guild_id] = table
+        return table
+
+    def warden_rules_changed(self, guild_id: Optional[int] = None, replaced: Iterable[str] = ()):
+        """
+        Must be called whenever the active rules of a guild (or of all guilds) change.
+        'replaced' are the names of the rules that were added, replaced or removed
+        """
+        prefilter.invalidate(guild_id)
+        # Stats are by rule name, a replaced rule must not inherit the old one's
+        if guild_id is not None and replaced:
+            profiler.reset(guild_id, replaced)
+        if guild_id is None:
+            membercache.clear()
+            self.warden_dispatch.clear()
+            for guid in list(self.active_warden_rules.keys()):
+                self.build_warden_dispatch(guid)
+        else:
+            membercache.invalidate_guild(guild_id)
+            self.build_warden_dispatch(guild_id)
 
     async def format_punish_message(self, member: discord.Member):
         text = await self.config.guild(member.guild).punish_message()
@@ -662,9 +821,8 @@ class Defender(Commands, AutoModules, Events, commands.Cog, metaclass=CompositeM
         mod_id = moderator.id if moderator else "none"
 
         heat_key = f"core-modlog-{user.id}-{action_type}-{mod_id}"
-        if not heat.get_custom_heat(guild, heat_key) == 0:
+        if not dedup.add(guild.id, heat_key, datetime.timedelta(seconds=15)):
             return
-        heat.increase_custom_heat(guild, heat_key, datetime.timedelta(seconds=15))
 
         await modlog.create_case(
             bot, guild, created_at, action_type, user, moderator, reason, until, channel, last_known_username
@@ -696,4 +854,7 @@ class Defender(Commands, AutoModules, Events, commands.Cog, metaclass=CompositeM
 
         # Technically it isn't going to end up in config
         # but we'll scrub the cache too because we're nice
+        if not self.cache_restored:
+            self.deleted_during_restore.add(user_id)
         await df_cache.discard_messages_from_user(user_id)
+        await self.save_cache_snapshot()
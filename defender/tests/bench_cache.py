@@ -0,0 +1,79 @@
+"""
+Memory benchmark for the message cache
+
+Run from the repository root with: python -m defender.tests.bench_cache
+"""
+
+from ..core import cache as df_cache
+from .test_cache import FakeGuild, FakeChannel, FakeUser, make_message
+from collections import deque
+import tracemalloc
+import random
+
+USERS = 200
+CHANNELS = 20
+MESSAGES = 50_000
+
+
+class OldLiteMessage:
+    # The per-message object layout the cache used to have
+    __slots__ = ("id", "created_at", "content", "channel_id", "author_id", "edits")
+
+    def __init__(self, message):
+        self.id = message.id
+        self.created_at = message.created_at
+        self.content = message.content
+        self.author_id = message.author.id
+        self.channel_id = message.channel.id
+        self.edits = deque(maxlen=20)
+
+
+def make_messages():
+    rng = random.Random(26)
+    guild = FakeGuild(26)
+    users = [FakeUser(1000 + i, guild) for i in range(USERS)]
+    channels = [FakeChannel(100 + i, guild) for i in range(CHANNELS)]
+    return guild, [
+        make_message(rng.choice(users), rng.choice(channels), "hello " * rng.randint(1, 10)) for _ in range(MESSAGES)
+    ]
+
+
+def measure(func, messages):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    keep = func(messages)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del keep
+    return (after - before) / len(messages)
+
+
+def old_store(messages):
+    users, channels, index = {}, {}, {}
+    for m in messages:
+        lite = OldLiteMessage(m)
+        users.setdefault(m.author.id, deque(maxlen=df_cache.MSG_STORE_CAP)).appendleft(lite)
+        channels.setdefault(m.channel.id, deque(maxlen=df_cache.MSG_STORE_CAP)).appendleft(lite)
+        index[lite.id] = lite
+    return users, channels, index
+
+
+def new_store(messages):
+    for m in messages:
+        df_cache.add_message(m)
+    return df_cache._message_cache[messages[0].guild.id]
+
+
+def main():
+    guild, messages = make_messages()
+    # Content strings are built before measuring: they come from Discord either way
+    old = measure(old_store, messages)
+    new = measure(new_store, messages)
+    df_cache._message_cache.pop(guild.id, None)
+    print(f"{len(messages)} messages, {USERS} users, {CHANNELS} channels")
+    print(f"Before: {old:.1f} bytes per cached message")
+    print(f"After:  {new:.1f} bytes per cached message")
+
+
+if __name__ == "__main__":
+    main()
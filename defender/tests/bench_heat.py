@@ -0,0 +1,63 @@
+"""
+Per-event overhead of the heat backends
+
+Run from the repository root with: python -m defender.tests.bench_heat
+"""
+
+from ..core.warden import heat
+from .test_warden import FakeUser, FAKE_GUILD
+from datetime import timedelta
+from pathlib import Path
+import tempfile
+import time
+import random
+
+USERS = 500
+EVENTS = 20_000
+
+
+def run(backend, events):
+    # What a "N messages in M minutes" rule does on every message: add heat, then read it back
+    heat.set_backend(backend)
+    td = timedelta(minutes=5)
+    start = time.perf_counter()
+    next_tick = start + 1
+    for user in events:
+        heat.increase_user_heat(user, td)
+        heat.get_user_heat(user)
+        if time.perf_counter() > next_tick:
+            heat.discard_expired_heat()
+            next_tick += 1
+    heat.discard_expired_heat()
+    elapsed = time.perf_counter() - start
+    heat.empty_state(FAKE_GUILD)
+    heat.set_backend(None)
+    return elapsed / len(events) * 1_000_000
+
+
+def main():
+    rng = random.Random(26)
+    users = []
+    for i in range(USERS):
+        user = FakeUser()
+        user.id = 1000 + i
+        users.append(user)
+    events = [rng.choice(users) for _ in range(EVENTS)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {"memory": run(None, events)}
+        results["sqlite"] = run(heat.SQLiteHeatBackend(Path(tmp) / "batched.sqlite3"), events)
+        old_batch = heat.SQLITE_WRITE_BATCH
+        heat.SQLITE_WRITE_BATCH = 1
+        try:
+            results["sqlite, eager writer"] = run(heat.SQLiteHeatBackend(Path(tmp) / "unbatched.sqlite3"), events)
+        finally:
+            heat.SQLITE_WRITE_BATCH = old_batch
+
+    print(f"{EVENTS} events, {USERS} users")
+    for name, us in results.items():
+        print(f"{name:>20}: {us:.1f} µs per event")
+
+
+if __name__ == "__main__":
+    main()
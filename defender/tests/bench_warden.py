@@ -0,0 +1,87 @@
+"""
+Warden rule evaluation benchmark, over the sample rules
+
+Run from the repository root with: python -m defender.tests.bench_warden
+"""
+
+from ..core.warden.rule import WardenRule, WDEventContext
+from ..core.warden import heat
+from ..enums import Rank
+from . import wd_sample_rules as rl
+from .test_warden import FAKE_GUILD, FAKE_MESSAGE
+import asyncio
+import time
+
+ROUNDS = 2000
+
+
+async def load_rules():
+    rules = []
+    for name in dir(rl):
+        if not name.isupper():
+            continue
+        rule = WardenRule()
+        try:
+            await rule.parse(getattr(rl, name), cog=None)
+            # Rules that need a cog or a different event are left out
+            await rule.satisfies_conditions(cog=None, rank=Rank.Rank1, guild=FAKE_GUILD, message=FAKE_MESSAGE)
+        except Exception:
+            continue
+        rules.append(rule)
+    return rules
+
+
+async def load_action_rules(rules):
+    action_rules = []
+    for rule in rules:
+        try:
+            await rule.do_actions(cog=None, guild=FAKE_GUILD, message=FAKE_MESSAGE)
+        except Exception:
+            continue
+        action_rules.append(rule)
+    heat.empty_state(FAKE_GUILD)
+    return action_rules
+
+
+async def run(rules, debug=False):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for rule in rules:
+            await rule.satisfies_conditions(
+                cog=None, rank=Rank.Rank1, guild=FAKE_GUILD, message=FAKE_MESSAGE, debug=debug
+            )
+    return (time.perf_counter() - start) / (ROUNDS * len(rules)) * 1_000_000
+
+
+async def run_shared(rules):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        ctx = WDEventContext(cog=None, guild=FAKE_GUILD, message=FAKE_MESSAGE)
+        for rule in rules:
+            await rule.satisfies_conditions(rank=Rank.Rank1, ctx=ctx)
+    return (time.perf_counter() - start) / (ROUNDS * len(rules)) * 1_000_000
+
+
+async def run_actions(rules):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for rule in rules:
+            await rule.do_actions(cog=None, guild=FAKE_GUILD, message=FAKE_MESSAGE)
+    elapsed = time.perf_counter() - start
+    heat.empty_state(FAKE_GUILD)
+    return elapsed / (ROUNDS * len(rules)) * 1_000_000
+
+
+async def main():
+    rules = await load_rules()
+    print(f"{len(rules)} sample rules, {ROUNDS} rounds")
+    print(f"{await run(rules):.1f} µs per rule evaluation")
+    print(f"{await run(rules, debug=True):.1f} µs per rule evaluation (debug)")
+    print(f"{await run_shared(rules):.1f} µs per rule evaluation (one context per event)")
+    action_rules = await load_action_rules(rules)
+    print(f"{len(action_rules)} of them can run their actions without a cog")
+    print(f"{await run_actions(action_rules):.1f} µs per rule's actions")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,382 @@
+from ..core import cache as df_cache
+from ..core.utils import utcnow
+from discord.utils import time_snowflake
+from datetime import timedelta
+import asyncio
+import pytest
+
+
+class FakeGuild:
+    def __init__(self, _id):
+        self.id = _id
+
+
+class FakeChannel:
+    def __init__(self, _id, guild):
+        self.id = _id
+        self.guild = guild
+
+
+class FakeUser:
+    def __init__(self, _id, guild):
+        self.id = _id
+        self.guild = guild
+
+
+class FakeMessage:
+    attachments = []
+    edited_at = None
+
+    def __init__(self, author, channel, content, created_at=None):
+        created_at = created_at or utcnow()
+        self.id = time_snowflake(created_at)
+        self.created_at = created_at
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+
+
+_last_ts = utcnow() - timedelta(hours=1)
+
+
+def make_message(author, channel, content, created_at=None):
+    # Snowflakes must be unique and increasing, like Discord's
+    global _last_ts
+    if created_at is None:
+        _last_ts += timedelta(milliseconds=1)
+        created_at = _last_ts
+    return FakeMessage(author, channel, content, created_at)
+
+
+@pytest.mark.asyncio
+async def test_message_index():
+    guild = FakeGuild(1)
+    channel = FakeChannel(10, guild)
+    user = FakeUser(100, guild)
+    old_cap = df_cache.MSG_STORE_CAP
+    df_cache.MSG_STORE_CAP = 3
+    try:
+        messages = [make_message(user, channel, f"msg {i}") for i in range(5)]
+        for m in messages:
+            df_cache.add_message(m)
+
+        # The two oldest have been pushed out of both stores
+        assert df_cache.get_message(guild, messages[0].id) is None
+        assert df_cache.get_message(guild, messages[1].id) is None
+        assert df_cache.get_message(guild, messages[4].id).content == "msg 4"
+
+        messages[4].content = "edited"
+        messages[4].edited_at = utcnow()
+        await df_cache.add_message_edit(messages[4])
+        lite = df_cache.get_message(guild, messages[4].id)
+        assert lite.content == "edited"
+        assert lite.edits[0].content == "msg 4"
+
+        await df_cache.discard_messages_from_user(user.id)
+        assert df_cache.get_message(guild, messages[4].id) is None
+    finally:
+        df_cache.MSG_STORE_CAP = old_cap
+        df_cache._message_cache.pop(guild.id, None)
+
+
+@pytest.mark.asyncio
+async def test_message_index_user_store():
+    guild = FakeGuild(3)
+    busy_channel = FakeChannel(30, guild)
+    quiet_channel = FakeChannel(31, guild)
+    user = FakeUser(300, guild)
+    other = FakeUser(301, guild)
+    old_cap = df_cache.MSG_STORE_CAP
+    df_cache.MSG_STORE_CAP = 3
+    total = df_cache.get_total_bytes()
+    try:
+        first = make_message(user, busy_channel, "first")
+        df_cache.add_message(first)
+        for i in range(3):
+            df_cache.add_message(make_message(other, busy_channel, f"spam {i}"))
+        # Out of the channel store, but their store still has it
+        assert first.id not in [m.id for m in df_cache.get_channel_messages(busy_channel)]
+        assert df_cache.get_message(guild, first.id).content == "first"
+        df_cache.add_message(first)
+        assert len(df_cache.get_user_messages(user)) == 1
+
+        first.content = "edited"
+        first.edited_at = utcnow()
+        await df_cache.add_message_edit(first)
+        assert df_cache.get_message(guild, first.id).edits[0].content == "first"
+
+        # Now it's gone from both
+        for i in range(3):
+            df_cache.add_message(make_message(user, quiet_channel, f"msg {i}"))
+        assert df_cache.get_message(guild, first.id) is None
+        assert first.id not in df_cache._message_cache[guild.id]["edits"]
+
+        await df_cache.discard_messages_from_user(user.id)
+        await df_cache.discard_messages_from_user(other.id)
+        assert df_cache._message_cache[guild.id]["messages"] == {}
+        assert df_cache.get_total_bytes() == total
+    finally:
+        df_cache.MSG_STORE_CAP = old_cap
+        df_cache._message_cache.pop(guild.id, None)
+
+
+def test_message_store():
+    guild = FakeGuild(2)
+    channel = FakeChannel(20, guild)
+    user = FakeUser(200, guild)
+    try:
+        messages = [make_message(user, channel, f"msg {i}") for i in range(4)]
+        # Out of order arrival must not break the ordering
+        for m in (messages[0], messages[2], messages[1], messages[3]):
+            df_cache.add_message(m)
+
+        stored = df_cache.get_user_messages(user)
+        assert [m.id for m in stored] == [m.id for m in reversed(messages)]
+        assert [m.id for m in df_cache.get_channel_messages(channel)] == [m.id for m in stored]
+        assert abs(stored[0].created_at - messages[3].created_at) < timedelta(milliseconds=1)
+        assert stored[0].channel_id == channel.id and stored[0].author_id == user.id
+        # Edit history is only allocated on edit
+        assert not stored[0].edits
+        assert not df_cache._message_cache[guild.id]["edits"]
+    finally:
+        df_cache._message_cache.pop(guild.id, None)
+
+
+@pytest.mark.asyncio
+async def test_discard_stale():
+    guild = FakeGuild(3)
+    channel = FakeChannel(30, guild)
+    old_user = FakeUser(300, guild)
+    user = FakeUser(301, guild)
+    long_ago = utcnow() - timedelta(hours=df_cache.MSG_EXPIRATION_TIME + 1)
+    try:
+        old = [make_message(old_user, channel, "old", long_ago + timedelta(milliseconds=i)) for i in range(3)]
+        new = make_message(user, channel, "new")
+        for m in old + [new]:
+            df_cache.add_message(m)
+        old[0].content = "edited"
+        await df_cache.add_message_edit(old[0])
+
+        await df_cache.discard_stale()
+        _cache = df_cache._message_cache[guild.id]
+        assert old_user.id not in _cache["users"]
+        assert old_user.id not in df_cache._author_index
+        assert not _cache["edits"]
+        assert list(_cache["messages"]) == [new.id]
+        assert [m.content for m in df_cache.get_channel_messages(channel)] == ["new"]
+    finally:
+        df_cache._message_cache.pop(guild.id, None)
+
+
+@pytest.mark.asyncio
+async def test_discard_messages_from_user():
+    guilds = [FakeGuild(4), FakeGuild(5)]
+    channels = [FakeChannel(40, guilds[0]), FakeChannel(41, guilds[0]), FakeChannel(50, guilds[1])]
+    try:
+        for channel in channels:
+            df_cache.add_message(make_message(FakeUser(400, channel.guild), channel, "bye"))
+            df_cache.add_message(make_message(FakeUser(401, channel.guild), channel, "stay"))
+        assert df_cache._author_index[400] == {4: {40, 41}, 5: {50}}
+
+        await df_cache.discard_messages_from_user(400)
+        assert 400 not in df_cache._author_index
+        for channel in channels:
+            assert [m.content for m in df_cache.get_channel_messages(channel)] == ["stay"]
+            assert not df_cache.get_user_messages(FakeUser(400, channel.guild))
+    finally:
+        for guild in guilds:
+            df_cache._message_cache.pop(guild.id, None)
+        df_cache._author_index.pop(401, None)
+
+
+@pytest.mark.asyncio
+async def test_memory_budget():
+    big, small = FakeGuild(6), FakeGuild(7)
+    big_channel, small_channel = FakeChannel(60, big), FakeChannel(70, small)
+    user = FakeUser(600, big)
+    total = df_cache.get_total_bytes()
+    try:
+        for i in range(10):
+            df_cache.add_message(make_message(FakeUser(700, small), small_channel, "small"))
+        small_usage = df_cache._message_cache[small.id]["bytes"]
+        for i in range(200):
+            df_cache.add_message(make_message(user, big_channel, f"big {i}"))
+        edited = df_cache.get_user_messages(user)[0]
+        msg = make_message(user, big_channel, "edited")
+        msg.id = edited.id
+        await df_cache.add_message_edit(msg)
+        assert df_cache.get_total_bytes() - total == sum(u[1] for u in df_cache.get_usage() if u[0] in (6, 7))
+
+        # Going a little over budget is left to the periodic cleanup
+        df_cache.MSG_CACHE_BUDGET = df_cache.get_total_bytes() - 1
+        df_cache.add_message(make_message(user, big_channel, "over budget"))
+        assert len(df_cache.get_channel_messages(big_channel)) == 201
+
+        df_cache.MSG_CACHE_BUDGET = total + small_usage * 5
+        df_cache.enforce_budget()
+        assert df_cache.get_total_bytes() <= df_cache.MSG_CACHE_BUDGET
+        # The largest guild pays for it
+        assert len(df_cache.get_channel_messages(small_channel)) == 10
+        remaining = df_cache.get_channel_messages(big_channel)
+        assert 0 < len(remaining) < 200 and remaining[1].content == "edited"
+
+        await df_cache.discard_messages_from_user(user.id)
+        await df_cache.discard_messages_from_user(700)
+        assert df_cache.get_total_bytes() == total
+    finally:
+        df_cache.MSG_CACHE_BUDGET = 0
+        for guild in (big, small):
+            df_cache._message_cache.pop(guild.id, None)
+
+
+def test_iter_messages():
+    guild = FakeGuild(8)
+    channel = FakeChannel(80, guild)
+    user = FakeUser(800, guild)
+    old_cap = df_cache.MSG_STORE_CAP
+    df_cache.MSG_STORE_CAP = 100
+    try:
+        messages = [make_message(user, channel, f"msg {i}") for i in range(100)]
+        for m in messages:
+            df_cache.add_message(m)
+
+        assert [m.content for m in df_cache.iter_user_messages(user, limit=2)] == ["msg 99", "msg 98"]
+        since = messages[94].created_at
+        assert len(list(df_cache.iter_channel_messages(channel, since=since))) == 5
+        assert not list(df_cache.iter_user_messages(FakeUser(801, guild)))
+
+        # New messages push out the old ones and compact the store while we're reading it
+        view = df_cache.iter_channel_messages(channel)
+        assert next(view).content == "msg 99"
+        for i in range(100, 180):
+            df_cache.add_message(make_message(user, channel, f"msg {i}"))
+        assert [m.content for m in view] == [f"msg {i}" for i in range(98, 79, -1)]
+    finally:
+        df_cache.MSG_STORE_CAP = old_cap
+        df_cache._message_cache.pop(guild.id, None)
+
+
+def test_message_rate():
+    guild = FakeGuild(9)
+    channel = FakeChannel(90, guild)
+    user = FakeUser(900, guild)
+    now = utcnow()
+    try:
+        assert df_cache.get_message_rate(user, 1) == 0
+        for i in range(df_cache.RATE_RING_SIZE + 10):
+            df_cache.add_message(make_message(user, channel, "spam", now - timedelta(seconds=90 - i)))
+        # The ring only keeps the latest timestamps
+        assert df_cache.get_message_rate(user, 5, now=now) == df_cache.RATE_RING_SIZE
+        assert df_cache.get_message_rate(user, 1, now=now) == 29
+        assert df_cache.get_message_rate(user, 1, now=now + timedelta(seconds=20)) == 9
+    finally:
+        df_cache._message_cache.pop(guild.id, None)
+
+
+@pytest.mark.asyncio
+async def test_search_index():
+    guild = FakeGuild(10)
+    channels = [FakeChannel(100, guild), FakeChannel(101, guild)]
+    users = [FakeUser(1000, guild), FakeUser(1001, guild)]
+    total = df_cache.get_total_bytes()
+    try:
+        first = make_message(users[0], channels[0], "Free nitro here")
+        df_cache.add_message(first)
+        assert df_cache.search_messages(guild, "nitro") is None
+
+        # Enabling it indexes what's already cached
+        await df_cache.set_search_index(guild.id, True)
+        second = make_message(users[1], channels[1], "free NITRO, click!")
+        df_cache.add_message(second)
+        df_cache.add_message(make_message(users[1], channels[0], "hello there"))
+        assert [m.id for m in df_cache.search_messages(guild, "nitro free")] == [second.id, first.id]
+        assert [m.id for m in df_cache.search_messages(guild, "nitro", channel_id=100)] == [first.id]
+        assert [m.id for m in df_cache.search_messages(guild, "nitro", author_id=1001)] == [second.id]
+        assert df_cache.search_messages(guild, "nitro hello") == []
+        assert [m.id for m in df_cache.search_messages(guild, "nitro", limit=1)] == [second.id]
+        only_first = lambda m: m.id == first.id
+        assert [m.id for m in df_cache.search_messages(guild, "nitro", check=only_first, limit=1)] == [first.id]
+
+        first.content = "hello world"
+        await df_cache.add_message_edit(first)
+        assert [m.id for m in df_cache.search_messages(guild, "nitro")] == [second.id]
+        assert len(df_cache.search_messages(guild, "hello")) == 2
+
+        await df_cache.discard_messages_from_user(1001)
+        assert df_cache.search_messages(guild, "nitro") == []
+        assert set(df_cache._message_cache[guild.id]["tokens"]) == {"hello", "world"}
+
+        await df_cache.set_search_index(guild.id, False)
+        await df_cache.discard_messages_from_user(1000)
+        assert df_cache.get_total_bytes() == total
+    finally:
+        await df_cache.set_search_index(guild.id, False)
+        df_cache._message_cache.pop(guild.id, None)
+
+
+@pytest.mark.asyncio
+async def test_snapshot(tmp_path):
+    guild = FakeGuild(11)
+    channel = FakeChannel(110, guild)
+    user = FakeUser(1100, guild)
+    path = tmp_path / "message_cache.bin"
+    long_ago = utcnow() - timedelta(hours=df_cache.MSG_EXPIRATION_TIME + 1)
+    try:
+        expired = make_message(user, channel, "old", long_ago)
+        df_cache.add_message(expired)
+        first = make_message(user, channel, "héllo 🦹")
+        df_cache.add_message(first)
+        first.content = "edited"
+        first.edited_at = utcnow()
+        await df_cache.add_message_edit(first)
+        await df_cache.save_snapshot(path)
+        df_cache._message_cache.pop(guild.id)
+
+        # Messages received after the restart are kept
+        live = make_message(user, channel, "live")
+        df_cache.add_message(live)
+        await df_cache.load_snapshot(path)
+
+        restored = df_cache.get_channel_messages(channel)
+        assert [m.id for m in restored] == [live.id, first.id]
+        assert restored[1].content == "edited"
+        assert restored[1].edits[0].content == "héllo 🦹"
+        assert restored[1].edits[0].edited_at == first.edited_at
+        assert df_cache.get_message_rate(user, 120) == 2
+
+        df_cache.save_snapshot_sync(path)
+        df_cache._message_cache.pop(guild.id)
+        await df_cache.load_snapshot(path)
+        assert [m.id for m in df_cache.get_user_messages(user)] == [live.id, first.id]
+    finally:
+        df_cache._message_cache.pop(guild.id, None)
+
+
+@pytest.mark.asyncio
+async def test_snapshot_deletion_during_restore(tmp_path, monkeypatch):
+    guild = FakeGuild(14)
+    channel = FakeChannel(140, guild)
+    kept, deleted = FakeUser(1400, guild), FakeUser(1401, guild)
+    path = tmp_path / "message_cache.bin"
+    try:
+        for i in range(20):
+            df_cache.add_message(make_message(kept if i % 2 else deleted, channel, f"msg {i}"))
+        await df_cache.save_snapshot(path)
+        df_cache._message_cache.pop(guild.id)
+
+        # Yields after every message, the deletion lands halfway through the restore
+        monkeypatch.setattr(df_cache, "CLEANUP_SLICE", -1)
+        skip_authors = set()
+        restore = asyncio.create_task(df_cache.load_snapshot(path, skip_authors=skip_authors))
+        while len(df_cache.get_user_messages(deleted)) < 5:
+            await asyncio.sleep(0)
+        assert not restore.done()
+        skip_authors.add(deleted.id)
+        await df_cache.discard_messages_from_user(deleted.id)
+        await restore
+
+        assert df_cache.get_user_messages(deleted) == []
+        assert len(df_cache.get_user_messages(kept)) == 10
+    finally:
+        df_cache._message_cache.pop(guild.id, None)
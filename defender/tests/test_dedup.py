@@ -0,0 +1,21 @@
+from ..core import dedup
+from datetime import timedelta
+
+
+def test_dedup(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(dedup.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(dedup, "_last_expired_bucket", 1000)
+    assert dedup.add(12, "core-test", timedelta(seconds=10))
+    assert not dedup.add(12, "core-test", timedelta(seconds=10))
+    assert dedup.add(13, "core-test", timedelta(seconds=5))
+    now[0] += 10.5
+    # Expired, but its bucket hasn't been processed yet
+    assert dedup.add(12, "core-test", timedelta(seconds=30))
+    now[0] += 1.5
+    dedup.discard_expired()
+    assert list(dedup._expiries) == [(12, "core-test")]
+    assert not dedup.add(12, "core-test", timedelta(seconds=10))
+    now[0] += 30
+    dedup.discard_expired()
+    assert not dedup._expiries and not dedup._buckets
@@ -0,0 +1,26 @@
+from ..core import memo
+from .test_cache import FakeGuild, FakeUser
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_event_memo():
+    guild = FakeGuild(13)
+    users = [FakeUser(1, guild), FakeUser(2, guild)]
+    computed = []
+
+    @memo.memoized("test", key=lambda user: (user.guild.id, user.id))
+    async def expensive(user):
+        computed.append(user.id)
+        return user.id * 2
+
+    @memo.event_scoped
+    async def event(user):
+        return [await expensive(user), await expensive(user), await expensive(users[1])]
+
+    calls, hits = memo.calls["test"], memo.hits["test"]
+    assert await event(users[0]) == [2, 2, 4] and computed == [1, 2]
+    assert await event(users[0]) == [2, 2, 4] and computed == [1, 2, 1, 2]  # Not shared between events
+    assert memo.calls["test"] - calls == 6 and memo.hits["test"] - hits == 2
+    # Outside of an event nothing is memoized or counted
+    assert await expensive(users[0]) == 2 and computed[-1] == 1 and memo.calls["test"] - calls == 6
@@ -1,16 +1,24 @@
-from ..core.warden.enums import Action, Condition, ChecksKeys
+from ..core.warden.enums import Action, Condition, ChecksKeys, Event
 from ..enums import Rank
 from ..core.warden.validation import CONDITIONS_VALIDATORS, ACTIONS_VALIDATORS
 from ..core.warden.validation import CONDITIONS_ANY_CONTEXT, CONDITIONS_USER_CONTEXT, CONDITIONS_MESSAGE_CONTEXT
 from ..core.warden.validation import ACTIONS_ANY_CONTEXT, ACTIONS_USER_CONTEXT, ACTIONS_MESSAGE_CONTEXT, BaseModel
-from ..core.warden.rule import WardenRule, WardenCheck
-from ..core.warden import heat
+from ..core.warden.validation import WildcardList
+from ..core.warden.rule import WardenRule, WardenCheck, WDEventContext
+from ..core.warden.checkers import CHECKERS
+from ..core.warden import heat, membercache, prefilter, profiler
 from ..core.warden.rule import WardenRule
 from ..core.utils import utcnow
+from ..core import cache as df_cache
+from ..core import dedup
 from ..exceptions import InvalidRule
+from ..defender import Defender
 from . import wd_sample_rules as rl
 from datetime import timedelta
+from types import SimpleNamespace
 from discord import Activity
+from discord.utils import time_snowflake
+import fnmatch
 import pytest
 
 
@@ -112,6 +120,7 @@ def test_check_validators_consistency():
 
     for condition in Condition:
         assert condition in CONDITIONS_VALIDATORS
+        assert condition in CHECKERS
 
     for action in Action:
         assert action in ACTIONS_VALIDATORS
@@ -156,6 +165,289 @@ def test_check_validators_consistency():
     assert x_contains_only_y(ACTIONS_MESSAGE_CONTEXT, Action)
 
 
+def test_wildcard_list():
+    patterns = ["spider", "*Spider*", "b?d", "[ch]at", "ex*mp*e", "a.b", "[!x]yz", "(tm)", "*\\*"]
+    texts = ["spider", "SPIDERMAN", "bad", "bd", "hat", "mat", "example", "exmpe", "a.b", "axb", "ayz", "xyz"]
+    texts += ["(tm)", "tm", "a\\b", "", "line\nspider", "spi der"]
+
+    for subset in (patterns, patterns[:1], patterns[1:], ["*"]):
+        wl = WildcardList(value=subset)
+        for text in texts:
+            assert wl.matches(text) is any(fnmatch.fnmatch(text.lower(), p.lower()) for p in subset), (subset, text)
+        words = " ".join(texts).lower().split()
+        assert wl.matches_any(words) is any(fnmatch.fnmatch(w, p.lower()) for w in words for p in subset)
+        assert wl.matches_any([]) is False
+
+
+@pytest.mark.asyncio
+async def test_keyword_prefilter():
+    assert prefilter.longest_literal("*bad*word?s*") == "word"
+    assert prefilter.longest_literal("[!ab]cde[fg") == "cde[fg"
+    assert prefilter.longest_literal("*") == ""
+
+    def keyword_rule(conditions):
+        return rl.DYNAMIC_RULE.format(rank="1", event="on-message", conditions=conditions, actions="    - no-op:")
+
+    spider, spi, anything = WardenRule(), WardenRule(), WardenRule()
+    await spider.parse(keyword_rule("    - message-matches-any: ['*spiderman*', 'spider*']"), cog=None)
+    await spi.parse(keyword_rule("    - message-contains-word: ['spi']"), cog=None)
+    await anything.parse(keyword_rule("    - message-matches-any: ['*spider*', '*']"), cog=None)
+    assert spider.keywords == (frozenset({"spiderman", "spider"}),) and anything.keywords == ()
+
+    # Literals contained in a longer one starting at the same position are found too
+    index = prefilter.KeywordIndex([spider, spi])
+    assert index.scan("i am spiderman") == {"spiderman", "spider", "spi"}
+    assert index.scan("a spi der") == {"spi"}
+
+    prefilter.invalidate(FAKE_GUILD.id)
+    prefilter.get_index(FAKE_GUILD.id, [spider, spi, anything])
+    checks = (("spider", True, False), ("a spi", False, True), ("SPI", False, True), ("nothing", False, False))
+    try:
+        for content, spider_result, spi_result in checks:
+            FAKE_MESSAGE.content = content
+            ctx = WDEventContext(cog=None, guild=FAKE_GUILD, message=FAKE_MESSAGE)
+            assert prefilter.may_pass(spider, ctx) is spider_result
+            assert bool(await spider.satisfies_conditions(rank=Rank.Rank1, ctx=ctx)) is spider_result
+            assert bool(await spi.satisfies_conditions(rank=Rank.Rank1, ctx=ctx)) is spi_result
+            assert prefilter.may_pass(anything, ctx) is True
+    finally:
+        prefilter.invalidate(FAKE_GUILD.id)
+        FAKE_MESSAGE.content = "increase"
+
+
+@pytest.mark.asyncio
+async def test_warden_dispatch():
+    rules = {}
+    for name, rank, event, priority in (
+        ("a", 3, "on-message", 50),
+        ("b", 1, "on-message", 10),
+        ("c", 2, "on-user-join", 1),
+    ):
+        rule = WardenRule()
+        rule_str = rl.DYNAMIC_RULE.format(
+            rank=rank, event=event, conditions="    - is-staff: false", actions="    - no-op:"
+        )
+        await rule.parse(rule_str.replace("name: test", f"name: {name}\n    priority: {priority}"), cog=None)
+        rules[name] = rule
+
+    cog = SimpleNamespace(active_warden_rules={FAKE_GUILD.id: dict(rules)}, warden_dispatch={})
+    cog.build_warden_dispatch = lambda guild_id: Defender.build_warden_dispatch(cog, guild_id)
+
+    def names(event, rank=None):
+        return [r.name for r in Defender.get_warden_rules_by_event(cog, FAKE_GUILD, event, rank)]
+
+    assert names(Event.OnMessage) == ["b", "a"] and names(Event.OnMessage, Rank.Rank4) == ["b", "a"]
+    assert names(Event.OnMessage, Rank.Rank2) == ["b"] and names(Event.OnMessage, Rank.Rank1) == ["b"]
+    assert names(Event.OnUserJoin, Rank.Rank1) == [] and names(Event.OnUserJoin, Rank.Rank2) == ["c"]
+    assert names(Event.OnEmergency) == []
+
+    del cog.active_warden_rules[FAKE_GUILD.id]["b"]
+    Defender.warden_rules_changed(cog, FAKE_GUILD.id)
+    assert names(Event.OnMessage) == ["a"] and names(Event.OnMessage, Rank.Rank1) == []
+
+
+@pytest.mark.asyncio
+async def test_member_condition_cache():
+    rule = WardenRule()
+    conditions = "    - username-matches-any: ['twenty*']\n    - user-created-less-than: 1"
+    await rule.parse(
+        rl.DYNAMIC_RULE.format(rank="1", event="on-user-join", conditions=conditions, actions="    - no-op:"),
+        cog=None,
+    )
+    username, created = list(rule.cond_tree)
+    user = FakeUser()
+    user.id = 2626
+    try:
+        assert bool(await rule.satisfies_conditions(cog=None, rank=Rank.Rank1, guild=FAKE_GUILD, user=user)) is True
+        assert membercache.get(FAKE_GUILD.id, user.id, username) is True
+        assert membercache.get(FAKE_GUILD.id, user.id, created) is None  # Would turn False over time
+        # Until the member changes, the cached result is used
+        user.name = "Spider"
+        assert bool(await rule.satisfies_conditions(cog=None, rank=Rank.Rank1, guild=FAKE_GUILD, user=user)) is True
+        assert (
+            bool(await rule.satisfies_conditions(cog=None, rank=Rank.Rank1, guild=FAKE_GUILD, user=user, debug=True))
+            is False
+        )
+        membercache.invalidate_user(user.id)
+        assert bool(await rule.satisfies_conditions(cog=None, rank=Rank.Rank1, guild=FAKE_GUILD, user=user)) is False
+        assert membercache.get(FAKE_GUILD.id, user.id, username) is False
+        membercache.invalidate_member(FAKE_GUILD.id, user.id)
+        assert membercache.get(FAKE_GUILD.id, user.id, username) is None
+
+        # A rule's actions can change the member for the rules that run after it
+        async def edit(**kwargs):
+            pass
+
+        user.edit = edit
+        await rule.satisfies_conditions(cog=None, rank=Rank.Rank1, guild=FAKE_GUILD, user=user)
+        assert membercache.get(FAKE_GUILD.id, user.id, username) is False
+        renamer = WardenRule()
+        await renamer.parse(
+            rl.DYNAMIC_RULE.format(
+                rank="1", event="on-user-join", conditions="    - is-staff: false", actions="    - set-user-nickname: x"
+            ),
+            cog=None,
+        )
+        await renamer.do_actions(cog=None, guild=FAKE_GUILD, user=user)
+        assert membercache.get(FAKE_GUILD.id, user.id, username) is None
+    finally:
+        membercache.clear()
+
+
+@pytest.mark.asyncio
+async def test_profiler(monkeypatch):
+    rule = WardenRule()
+    await rule.parse(
+        rl.DYNAMIC_RULE.format(
+            rank="1", event="on-user-join", conditions="    - username-matches-any: ['twenty*']", actions="    - no-op:"
+        ),
+        cog=None,
+    )
+    profiler.reset(FAKE_GUILD.id)
+    monkeypatch.setattr(profiler, "CONDITION_TIMING", True)
+    try:
+        for debug in (False, False, True):
+            await rule.satisfies_conditions(cog=None, rank=Rank.Rank1, guild=FAKE_GUILD, user=FAKE_USER, debug=debug)
+        await rule.do_actions(cog=None, guild=FAKE_GUILD, user=FAKE_USER)
+        stats = profiler.get_guild_stats(FAKE_GUILD.id)["test"]
+        # Debug runs are not counted
+        assert (stats.evaluations, stats.passes, stats.actions) == (2, 2, 1)
+        assert stats.eval_time > 0 and stats.action_time > 0 and 0 < stats.p99() <= stats.eval_time
+        assert stats.conditions[Condition.UsernameMatchesAny].evaluations == 2
+        assert profiler.get_ranked(FAKE_GUILD.id)[0] == ("test", stats)
+        # Only the rules that were replaced start over
+        profiler.get_rule_stats(FAKE_GUILD.id, "other")
+        profiler.reset(FAKE_GUILD.id, ["other"])
+        assert list(profiler.get_guild_stats(FAKE_GUILD.id)) == ["test"]
+    finally:
+        profiler.reset(FAKE_GUILD.id)
+
+
+def test_heat_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(heat.time, "monotonic", lambda: now[0])
+    heat.empty_custom_heat(FAKE_GUILD, "expiry-test")
+    for seconds in (30, 10, 20):
+        heat.increase_custom_heat(FAKE_GUILD, "expiry-test", timedelta(seconds=seconds))
+    assert heat.get_custom_heat(FAKE_GUILD, "expiry-test") == 3
+    now[0] += 10
+    assert heat.get_custom_heat(FAKE_GUILD, "expiry-test") == 2
+    now[0] += 15
+    assert heat.get_custom_heat(FAKE_GUILD, "expiry-test") == 1
+
+    # Points added together are a single entry and the cap trims the ones closest to expiring
+    heat.increase_custom_heat(FAKE_GUILD, "expiry-test", timedelta(seconds=60), heat.MAX_HEATPOINTS - 2)
+    assert heat.get_custom_heat(FAKE_GUILD, "expiry-test") == heat.MAX_HEATPOINTS - 1
+    heat.increase_custom_heat(FAKE_GUILD, "expiry-test", timedelta(seconds=90), 5)
+    assert heat.get_custom_heat(FAKE_GUILD, "expiry-test") == heat.MAX_HEATPOINTS
+    now[0] += 60
+    assert heat.get_custom_heat(FAKE_GUILD, "expiry-test") == 5
+    now[0] += 30
+    # Expired heat levels are removed once due, without being read
+    heat.discard_expired_heat()
+    assert "expiry-test" not in heat.get_custom_heat_keys(FAKE_GUILD)
+
+
+@pytest.mark.asyncio
+async def test_heat_snapshot(tmp_path):
+    heat.empty_state(FAKE_GUILD)
+    heat.empty_state(FAKE_GUILD, debug=True)
+    heat.increase_user_heat(FAKE_USER, timedelta(minutes=5), 3)
+    heat.increase_user_heat(FAKE_USER, timedelta(seconds=-1))
+    heat.increase_custom_heat(FAKE_GUILD, "snapshot-tést", timedelta(minutes=5))
+    heat.increase_channel_heat(FAKE_CHANNEL, timedelta(minutes=5), debug=True)
+    dedup.add(FAKE_GUILD.id, "core-snapshot-test", timedelta(minutes=5))
+    await heat.save_snapshot(tmp_path / "heat.bin")
+    dedup.save_snapshot(tmp_path / "dedup.bin")
+    heat.empty_state(FAKE_GUILD)
+    heat.empty_state(FAKE_GUILD, debug=True)
+    dedup._expiries.clear()
+
+    # Heat gained after the restart is added to the restored one
+    heat.increase_user_heat(FAKE_USER, timedelta(minutes=5))
+    await heat.load_snapshot(tmp_path / "heat.bin")
+    dedup.load_snapshot(tmp_path / "dedup.bin")
+    assert heat.get_user_heat(FAKE_USER) == 4
+    assert heat.get_custom_heat(FAKE_GUILD, "snapshot-tést") == 1
+    assert heat.get_channel_heat(FAKE_CHANNEL, debug=True) == 0
+    assert not dedup.add(FAKE_GUILD.id, "core-snapshot-test", timedelta(minutes=5))
+
+    heat.save_snapshot_sync(tmp_path / "heat.bin")
+    heat.empty_state(FAKE_GUILD)
+    await heat.load_snapshot(tmp_path / "heat.bin")
+    assert heat.get_user_heat(FAKE_USER) == 4
+    heat.empty_state(FAKE_GUILD)
+    dedup._expiries.clear()
+
+
+def test_heat_sqlite_backend(tmp_path):
+    # Two bot processes sharing the same database
+    first = heat.SQLiteHeatBackend(tmp_path / "heat.sqlite3")
+    second = heat.SQLiteHeatBackend(tmp_path / "heat.sqlite3")
+    heat.set_backend(first)
+    try:
+        heat.increase_user_heat(FAKE_USER, timedelta(minutes=5), 2)
+        heat.increase_custom_heat(FAKE_GUILD, "Shared", timedelta(minutes=5))
+        heat.increase_user_heat(FAKE_USER, timedelta(seconds=-1))
+        # Not committed yet, only the writer sees it
+        assert heat.get_user_heat(FAKE_USER) == 2
+        assert second.get_heat(FAKE_GUILD.id, "users", FAKE_USER.id) == 0
+        assert first.flush(5)
+        # Reads are served from what was fetched on the last tick
+        assert second.get_heat(FAKE_GUILD.id, "users", FAKE_USER.id) == 0
+        assert second.flush(5)
+        assert second.get_heat(FAKE_GUILD.id, "users", FAKE_USER.id) == 2
+
+        second.increase_heat(FAKE_GUILD.id, "users", FAKE_USER.id, timedelta(minutes=5), heat.MAX_HEATPOINTS)
+        assert second.flush(5)
+        assert first.flush(5)
+        assert heat.get_user_heat(FAKE_USER) == heat.MAX_HEATPOINTS
+        assert heat.get_state(FAKE_GUILD) == {
+            "users": {FAKE_USER.id: heat.MAX_HEATPOINTS},
+            "channels": {},
+            "custom": {"shared": 1},
+        }
+        # Emptied right away, even though the rows are deleted on the next tick
+        heat.empty_user_heat(FAKE_USER)
+        assert heat.get_user_heat(FAKE_USER) == 0
+        heat.increase_user_heat(FAKE_USER, timedelta(minutes=5))
+        assert first.flush(5)
+        assert second.flush(5)
+        assert second.get_heat(FAKE_GUILD.id, "users", FAKE_USER.id) == 1
+        # Only what changed is read back on every tick, including what the others emptied
+        second.empty_state(FAKE_GUILD.id)
+        second.increase_heat(FAKE_GUILD.id, "custom", "shared", timedelta(minutes=5), 3)
+        assert second.flush(5)
+        assert first.flush(5)
+        assert heat.get_state(FAKE_GUILD) == {"users": {}, "channels": {}, "custom": {"shared": 3}}
+        # The sandbox is never shared
+        heat.increase_channel_heat(FAKE_CHANNEL, timedelta(minutes=5), debug=True)
+        assert heat.get_channel_heat(FAKE_CHANNEL) == 0
+    finally:
+        heat.set_backend(None)
+        second.close()
+        heat.empty_state(FAKE_GUILD, debug=True)
+
+
+def test_heat_sqlite_fallback(tmp_path, monkeypatch):
+    monkeypatch.setattr(heat, "SQLITE_MAX_FAILURES", 2)
+    backend = heat.SQLiteHeatBackend(tmp_path / "heat.sqlite3")
+    heat.set_backend(backend)
+    try:
+        # The database going away doesn't reach the rules, the heat is kept until the writer gives up
+        backend.conn.execute("DROP TABLE heat")
+        heat.increase_user_heat(FAKE_USER, timedelta(minutes=5))
+        assert backend.flush(5)
+        assert heat.get_user_heat(FAKE_USER) == 1
+        backend.flush(5)
+        assert backend.failed
+        assert heat.get_backend() is not backend
+        assert heat.get_user_heat(FAKE_USER) == 0
+    finally:
+        heat.set_backend(None)
+        heat.empty_state(FAKE_GUILD)
+
+
 @pytest.mark.asyncio
 async def test_rule_parsing():
     with pytest.raises(InvalidRule, match=r".*rank.*"):
@@ -284,6 +576,39 @@ async def test_rule_cond_eval():
                 is expected_result[i]
             )
 
+    # Context variables are only computed when a rule reads them
+    rule = WardenRule()
+    await rule.parse(
+        rl.DYNAMIC_RULE.format(
+            rank="1",
+            event="on-user-join",
+            conditions="    - compare: [$user_name, ==, Twentysix]",
+            actions="    - no-op:",
+        ),
+        cog=None,
+    )
+    runtime = await rule.satisfies_conditions(cog=None, rank=Rank.Rank1, guild=FAKE_GUILD, user=FAKE_USER)
+    assert bool(runtime) is True
+    assert "user_name" in dict.keys(runtime.state) and "user_created_at" not in dict.keys(runtime.state)
+    assert runtime.state.get("user_id") == FAKE_USER.id and runtime.state.get("message_id") is None
+    assert runtime.safe_sub("$user_mention $message") == f"{FAKE_USER.mention} $message"
+
+    # An event's context is shared by its rules, the variables they assign stay their own
+    wd_ctx = WDEventContext(cog=None, guild=FAKE_GUILD, user=FAKE_USER)
+    first = await rule.satisfies_conditions(rank=Rank.Rank1, ctx=wd_ctx)
+    first.state["user_name"] = "overwritten"
+    second = await rule.satisfies_conditions(rank=Rank.Rank1, ctx=wd_ctx)
+    assert bool(second) is True and second.state is not first.state
+    assert wd_ctx.vars["user_name"] == FAKE_USER.name and second.state.get("rule_name") == rule.name
+    # An earlier rule's actions can change the member, later rules must see it
+    assert first.state.get("user_nickname") == "None"
+    FAKE_USER.nick = "Renamed"
+    try:
+        third = await rule.satisfies_conditions(rank=Rank.Rank1, ctx=wd_ctx)
+        assert third.state.get("user_nickname") == "Renamed"
+    finally:
+        FAKE_USER.nick = None
+
     operations = (
         ('[result, 1, "+", 1]', 2),
         ('[result, 10, "-", 5]', 5),
@@ -582,6 +907,17 @@ async def test_conditions():
     await eval_cond(Condition.UserActivityMatchesAny, ["xx", "*spam*"], True)
     await eval_cond(Condition.UserActivityMatchesAny, ["xx", "*bla*"], False)
 
+    df_cache._message_cache.pop(FAKE_GUILD.id, None)
+    await eval_cond(Condition.UserMessageRateMoreThan, [2, 1], False)
+    for i in range(3):
+        msg = FakeMessage()
+        msg.id = time_snowflake(utcnow() - timedelta(minutes=2 - i))
+        df_cache.add_message(msg)
+    await eval_cond(Condition.UserMessageRateMoreThan, [2, 1], False)
+    await eval_cond(Condition.UserMessageRateMoreThan, [2, 3], True)
+    await eval_cond(Condition.UserMessageRateMoreThan, {"messages": 1, "minutes": 2}, True)
+    df_cache._message_cache.pop(FAKE_GUILD.id, None)
+
     # Missing tests for category, public channels, regex related and emojis
 
     # This tests the "_single_value" changes. The condition should only accept a single value,